@@ -0,0 +1,460 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from constants import MODEL_DIMENSIONS
+
+"""
+Índice ANN en memoria para /search (IVF sobre una matriz float32/float16).
+
+- Se carga desde `documents` al iniciar la app (en un thread, sin bloquear el arranque).
+  Con ANN_INDEX_SNAPSHOT la primera carga parte de un snapshot .npy (vector_snapshot.py) y
+  solo lee de la base las filas posteriores al snapshot.
+- Se mantiene sincronizado en forma incremental: los inserts y deletes de los endpoints
+  llaman a add() / remove().
+- search_service lo usa solo si está listo (cargado y no vencido); si no, la búsqueda
+  cae a pgvector.
+
+Los vectores se guardan normalizados (L2), por lo que el producto punto es la
+similitud coseno, igual a 1 - (embedding <=> query) de pgvector.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+# ============================================>
+# Configuración (variables de entorno)
+# ============================================>
+ANN_INDEX_ENABLED = os.getenv("ANN_INDEX_ENABLED", "0") == "1"
+# Cantidad de listas IVF (0 = automático, ~sqrt(n))
+ANN_INDEX_NLIST = int(os.getenv("ANN_INDEX_NLIST", "0"))
+# Listas que se recorren por consulta: más = mejor recall, más latencia
+ANN_INDEX_NPROBE = int(os.getenv("ANN_INDEX_NPROBE", "8"))
+ANN_INDEX_DTYPE = np.float16 if os.getenv("ANN_INDEX_DTYPE", "float32") == "float16" else np.float32
+# Con menos filas que esto no se entrena IVF: se busca exacto sobre la matriz
+ANN_INDEX_MIN_ROWS_FOR_IVF = int(os.getenv("ANN_INDEX_MIN_ROWS_FOR_IVF", "5000"))
+# Pasado este tiempo desde la última carga completa el índice se considera vencido. Los
+# inserts y deletes ya se aplican en forma incremental, así que por defecto no vence (0);
+# sirve para corregir cambios hechos por fuera de la app (SQL directo, otra instancia).
+ANN_INDEX_MAX_AGE_SECONDS = float(os.getenv("ANN_INDEX_MAX_AGE_SECONDS", "0"))
+# Prefijo de un snapshot (python manage.py export-snapshot) para la primera carga
+ANN_INDEX_SNAPSHOT = os.getenv("ANN_INDEX_SNAPSHOT", "")
+
+_KMEANS_ITERATIONS = 10
+_KMEANS_SAMPLE_PER_LIST = 256
+_ASSIGN_BATCH = 65536
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.clip(norms, 1e-12, None)
+
+
+class IVFIndex:
+    """
+    Índice IVF (k-means esférico) con una zona "delta" para inserts recientes.
+
+    - vectors / ids / alive: filas de la construcción más reciente.
+    - lists: para cada centroide, los índices de fila asignados.
+    - delta: inserts posteriores, buscados en forma exacta hasta que se fusionan.
+    """
+
+    def __init__(self, dimensions: int = MODEL_DIMENSIONS, dtype=ANN_INDEX_DTYPE):
+        self.dimensions = dimensions
+        self.dtype = dtype
+        self.vectors = np.empty((0, dimensions), dtype=dtype)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.row_of = {}
+        self.centroids = None
+        self.lists = []
+        self.delta = {}
+
+    # ---------- construcción ----------
+    def build(self, ids: np.ndarray, vectors: np.ndarray, nlist: int = ANN_INDEX_NLIST) -> None:
+        vectors = _normalize(vectors)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.vectors = vectors.astype(self.dtype)
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        self.row_of = {int(i): row for row, i in enumerate(self.ids)}
+        self.delta = {}
+        n = len(self.ids)
+        if n < ANN_INDEX_MIN_ROWS_FOR_IVF:
+            self.centroids = None
+            self.lists = []
+            return
+        nlist = nlist or max(int(np.sqrt(n)), 1)
+        self.centroids = self._train(vectors, nlist)
+        self.lists = self._assign_lists(vectors)
+
+    def _train(self, vectors: np.ndarray, nlist: int) -> np.ndarray:
+        rng = np.random.default_rng(0)
+        sample_size = min(len(vectors), nlist * _KMEANS_SAMPLE_PER_LIST)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(_KMEANS_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+        return centroids
+
+    def _nearest_centroid(self, vectors: np.ndarray) -> np.ndarray:
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), _ASSIGN_BATCH):
+            block = np.asarray(vectors[start:start + _ASSIGN_BATCH], dtype=np.float32)
+            assignment[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignment
+
+    def _assign_lists(self, vectors: np.ndarray) -> List[np.ndarray]:
+        assignment = self._nearest_centroid(vectors)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(len(self.centroids) + 1))
+        return [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+
+    # ---------- sincronización incremental ----------
+    def add(self, ids: List[int], vectors) -> None:
+        for doc_id, vector in zip(ids, _normalize(vectors)):
+            if doc_id is None:
+                continue
+            self._remove_one(int(doc_id))
+            self.delta[int(doc_id)] = vector.astype(self.dtype)
+        if len(self.delta) > max(1000, len(self.ids) // 20):
+            self._merge_delta()
+
+    def remove(self, ids: List[int]) -> None:
+        for doc_id in ids:
+            self._remove_one(int(doc_id))
+
+    def _remove_one(self, doc_id: int) -> None:
+        self.delta.pop(doc_id, None)
+        row = self.row_of.pop(doc_id, None)
+        if row is not None:
+            self.alive[row] = False
+
+    def _merge_delta(self) -> None:
+        """
+        Pasa la zona delta a la matriz principal, asignando cada vector a su centroide
+        (sin reentrenar k-means).
+        """
+        delta_ids = np.fromiter(self.delta.keys(), dtype=np.int64, count=len(self.delta))
+        delta_vectors = np.stack(list(self.delta.values())).astype(self.dtype)
+        offset = len(self.ids)
+        self.ids = np.concatenate([self.ids, delta_ids])
+        self.vectors = np.concatenate([self.vectors, delta_vectors])
+        self.alive = np.concatenate([self.alive, np.ones(len(delta_ids), dtype=bool)])
+        for row, doc_id in enumerate(delta_ids, start=offset):
+            self.row_of[int(doc_id)] = row
+        if self.centroids is not None:
+            assignment = self._nearest_centroid(delta_vectors)
+            for c in np.unique(assignment):
+                rows = offset + np.nonzero(assignment == c)[0]
+                self.lists[c] = np.concatenate([self.lists[c], rows])
+        self.delta = {}
+
+    # ---------- búsqueda ----------
+    def snapshot(self) -> "IVFIndex":
+        """
+        Vista para buscar sin el lock del gestor: comparte las matrices (los merges las
+        reemplazan, no las modifican) y copia lo que add/remove cambian en el lugar.
+        """
+        view = IVFIndex.__new__(IVFIndex)
+        view.dimensions = self.dimensions
+        view.dtype = self.dtype
+        view.vectors = self.vectors
+        view.ids = self.ids
+        view.row_of = self.row_of
+        view.centroids = self.centroids
+        view.alive = self.alive.copy()
+        view.lists = list(self.lists)
+        view.delta = dict(self.delta)
+        return view
+
+    def __len__(self) -> int:
+        return int(self.alive.sum()) + len(self.delta)
+
+    def search(self, query, k: int, nprobe: int = ANN_INDEX_NPROBE, exact: bool = False) -> List[Tuple[int, float]]:
+        """
+        Retorna [(id, similitud)] de los k vecinos más cercanos.
+        exact=True (o índice sin IVF) recorre toda la matriz.
+        """
+        q = _normalize(query)[0]
+        if exact or self.centroids is None:
+            candidates = np.nonzero(self.alive)[0]
+        else:
+            probe = np.argsort(-(self.centroids @ q))[:max(nprobe, 1)]
+            candidates = np.concatenate([self.lists[c] for c in probe]) if len(probe) else np.empty(0, dtype=np.int64)
+            candidates = candidates[self.alive[candidates]]
+
+        scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ q
+        ids = self.ids[candidates]
+        if self.delta:
+            delta_ids = np.fromiter(self.delta.keys(), dtype=np.int64, count=len(self.delta))
+            delta_scores = np.stack(list(self.delta.values())).astype(np.float32) @ q
+            ids = np.concatenate([ids, delta_ids])
+            scores = np.concatenate([scores, delta_scores])
+
+        if len(scores) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+
+    def search_many(self, queries, k: int, nprobe: int = ANN_INDEX_NPROBE) -> List[List[Tuple[int, float]]]:
+        """
+        Búsqueda de varias consultas. Sin IVF se resuelve con una sola multiplicación
+        matricial (consultas x matriz completa); con IVF, consulta por consulta.
+        """
+        queries = _normalize(queries)
+        if self.centroids is not None:
+            return [self.search(q, k, nprobe=nprobe) for q in queries]
+
+        rows = np.nonzero(self.alive)[0]
+        ids = self.ids[rows]
+        scores = queries @ np.asarray(self.vectors[rows], dtype=np.float32).T
+        if self.delta:
+            delta_ids = np.fromiter(self.delta.keys(), dtype=np.int64, count=len(self.delta))
+            delta_matrix = np.stack(list(self.delta.values())).astype(np.float32)
+            ids = np.concatenate([ids, delta_ids])
+            scores = np.concatenate([scores, queries @ delta_matrix.T], axis=1)
+
+        results = []
+        for row_scores in scores:
+            top = np.argpartition(-row_scores, k)[:k] if len(row_scores) > k else np.arange(len(row_scores))
+            top = top[np.argsort(-row_scores[top])]
+            results.append([(int(ids[i]), float(row_scores[i])) for i in top])
+        return results
+
+
+# ============================================>
+# Gestor global: carga, estado y fallback
+# ============================================>
+class AnnIndexManager:
+    """
+    Mantiene el índice global, su carga desde la base y el estado (frío, listo, vencido).
+    """
+
+    def __init__(self):
+        self._index: Optional[IVFIndex] = None
+        self._lock = threading.Lock()
+        self._loading = False
+        # Inserts/deletes ocurridos durante una carga, para reaplicarlos al índice nuevo
+        self._replay = []
+        self.loaded_at = None
+        self.load_seconds = None
+        self.last_error = None
+        self.source = None
+        self.searches = 0
+        self.fallbacks = 0
+
+    def ready(self) -> bool:
+        """
+        True si el índice está cargado y no vencido. Si está vencido dispara una recarga
+        en segundo plano y retorna False (la búsqueda usa pgvector mientras tanto).
+        """
+        if not ANN_INDEX_ENABLED:
+            return False
+        if self._index is None:
+            self.start_background_load()
+            return False
+        if ANN_INDEX_MAX_AGE_SECONDS > 0 and time.time() - self.loaded_at > ANN_INDEX_MAX_AGE_SECONDS:
+            self.start_background_load()
+            return False
+        return True
+
+    def start_background_load(self) -> None:
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+            self._replay = []
+        threading.Thread(target=self._load_safely, name="ann-index-load", daemon=True).start()
+
+    def _load_safely(self) -> None:
+        try:
+            if ANN_INDEX_SNAPSHOT and self._index is None:
+                try:
+                    self.load_from_snapshot(ANN_INDEX_SNAPSHOT)
+                    return
+                except Exception as e:
+                    app_logger.warning(f"No se pudo usar el snapshot {ANN_INDEX_SNAPSHOT}, se carga desde la base: {str(e)}")
+            self.load_from_database()
+        except Exception as e:
+            self.last_error = str(e)
+            app_logger.error(f"Error cargando el índice ANN: {str(e)}")
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def load_from_database(self) -> None:
+        """
+        Lee todos los embeddings de `documents` con un cursor del lado del servidor y
+        construye un índice nuevo, que reemplaza al anterior al terminar.
+        """
+        start = time.time()
+        ids, vectors = self._scan()
+        self.build(ids, vectors, started_at=start, source="database")
+
+    def load_from_snapshot(self, prefix: str) -> None:
+        """
+        Construye el índice con los vectores de un snapshot (mapeados desde disco) más las
+        filas con id mayor al último del snapshot, sin recorrer la tabla. Los borrados y
+        re-embeds posteriores al snapshot se corrigen en la próxima carga completa
+        (POST /search/index/reload, o ANN_INDEX_MAX_AGE_SECONDS si está configurado).
+        """
+        from vector_snapshot import read_snapshot
+
+        start = time.time()
+        snapshot_ids, snapshot_vectors, manifest = read_snapshot(prefix)
+        delta_ids, delta_vectors = self._scan("AND id > %s", (manifest["max_id"],))
+        ids = np.concatenate([snapshot_ids, np.asarray(delta_ids, dtype=np.int64)])
+        self.build(ids, [snapshot_vectors] + delta_vectors, started_at=start, source="snapshot")
+        app_logger.info(f"Índice ANN desde snapshot: {len(snapshot_ids)} vectores del snapshot y {len(delta_ids)} de la base")
+
+    def _scan(self, where: str = "", params: tuple = ()) -> Tuple[List[int], List[np.ndarray]]:
+        """Ids y vectores de documents con un cursor del lado del servidor."""
+        from database import connection
+
+        ids = []
+        vectors = []
+        with connection() as conn:
+            with conn.cursor(name="ann_index_load") as cur:
+                cur.itersize = 5000
+                cur.execute(f"SELECT id, embedding::text AS embedding FROM documents WHERE embedding IS NOT NULL {where};", params)
+                for row in cur:
+                    ids.append(row['id'])
+                    vectors.append(np.fromstring(row['embedding'][1:-1], dtype=np.float32, sep=","))
+            conn.rollback()
+        return ids, vectors
+
+    def build(self, ids, vectors, started_at: Optional[float] = None, source: Optional[str] = None) -> None:
+        """
+        Construye el índice a partir de ids y vectores ya cargados y lo publica.
+        """
+        started_at = started_at or time.time()
+        index = IVFIndex()
+        matrix = np.vstack(vectors) if len(vectors) else np.empty((0, MODEL_DIMENSIONS), dtype=np.float32)
+        index.build(np.asarray(ids, dtype=np.int64), matrix)
+        with self._lock:
+            for op, op_ids, op_vectors in self._replay:
+                if op == "add":
+                    index.add(op_ids, op_vectors)
+                else:
+                    index.remove(op_ids)
+            self._replay = []
+            self._index = index
+            self.loaded_at = time.time()
+            self.load_seconds = round(self.loaded_at - started_at, 3)
+            self.last_error = None
+            self.source = source
+        app_logger.info(f"Índice ANN cargado: {len(index)} vectores en {self.load_seconds}s")
+
+    def add(self, ids: List[Optional[int]], vectors) -> None:
+        if not ANN_INDEX_ENABLED or not len(ids):
+            return
+        with self._lock:
+            if self._loading:
+                self._replay.append(("add", list(ids), np.asarray(vectors, dtype=np.float32)))
+            if self._index is not None:
+                self._index.add(ids, vectors)
+
+    def remove(self, ids: List[int]) -> None:
+        if not ANN_INDEX_ENABLED or not ids:
+            return
+        with self._lock:
+            if self._loading:
+                self._replay.append(("remove", list(ids), None))
+            if self._index is not None:
+                self._index.remove(ids)
+
+    def search(self, query, k: int, nprobe: int = ANN_INDEX_NPROBE) -> List[Tuple[int, float]]:
+        # El lock solo cubre la copia: el recorrido no frena a otras búsquedas ni a add/remove/build
+        with self._lock:
+            self.searches += 1
+            index = self._index.snapshot()
+        return index.search(query, k, nprobe=nprobe)
+
+    def search_many(self, queries, k: int, nprobe: int = ANN_INDEX_NPROBE) -> List[List[Tuple[int, float]]]:
+        with self._lock:
+            self.searches += len(queries)
+            index = self._index.snapshot()
+        return index.search_many(queries, k, nprobe=nprobe)
+
+    async def asearch(self, query, k: int, nprobe: int = ANN_INDEX_NPROBE) -> List[Tuple[int, float]]:
+        """Variante para los handlers async: el recorrido corre en un thread, fuera del event loop."""
+        return await asyncio.to_thread(self.search, query, k, nprobe)
+
+    async def asearch_many(self, queries, k: int, nprobe: int = ANN_INDEX_NPROBE) -> List[List[Tuple[int, float]]]:
+        return await asyncio.to_thread(self.search_many, queries, k, nprobe)
+
+    def record_fallback(self) -> None:
+        self.fallbacks += 1
+
+    def recall_at_k(self, k: int = 10, samples: int = 100, nprobe: int = ANN_INDEX_NPROBE) -> Dict[str, Any]:
+        """
+        Compara la búsqueda IVF contra la búsqueda exacta sobre la misma matriz usando
+        vectores del propio índice como consultas. Retorna recall@k y latencias medias.
+        """
+        if self._index is None:
+            return {"error": "El índice no está cargado"}
+        with self._lock:
+            index = self._index.snapshot()
+        rows = np.nonzero(index.alive)[0]
+        if not len(rows):
+            return {"error": "El índice está vacío"}
+        rng = np.random.default_rng(0)
+        queries = np.asarray(index.vectors[rng.choice(rows, min(samples, len(rows)), replace=False)], dtype=np.float32)
+        hits = 0
+        ann_seconds = 0.0
+        exact_seconds = 0.0
+        for q in queries:
+            t0 = time.perf_counter()
+            approx = {i for i, _ in index.search(q, k, nprobe=nprobe)}
+            t1 = time.perf_counter()
+            exact = {i for i, _ in index.search(q, k, exact=True)}
+            t2 = time.perf_counter()
+            hits += len(approx & exact)
+            ann_seconds += t1 - t0
+            exact_seconds += t2 - t1
+        # Con menos de k filas la búsqueda exacta devuelve todas: ese es el máximo posible
+        expected = min(k, len(index)) * len(queries)
+        return {
+            "k": k,
+            "samples": len(queries),
+            "nprobe": nprobe,
+            "recall_at_k": round(hits / expected, 4),
+            "ann_latency_ms": round(ann_seconds / len(queries) * 1000, 3),
+            "exact_latency_ms": round(exact_seconds / len(queries) * 1000, 3),
+        }
+
+    def status(self) -> Dict[str, Any]:
+        index = self._index
+        return {
+            "enabled": ANN_INDEX_ENABLED,
+            "ready": index is not None and (ANN_INDEX_MAX_AGE_SECONDS <= 0 or time.time() - self.loaded_at <= ANN_INDEX_MAX_AGE_SECONDS),
+            "loading": self._loading,
+            "vectors": len(index) if index is not None else 0,
+            "pending_delta": len(index.delta) if index is not None else 0,
+            "ivf_lists": len(index.lists) if index is not None else 0,
+            "nprobe": ANN_INDEX_NPROBE,
+            "dtype": np.dtype(ANN_INDEX_DTYPE).name,
+            "loaded_at": self.loaded_at,
+            "load_seconds": self.load_seconds,
+            "source": self.source,
+            "max_age_seconds": ANN_INDEX_MAX_AGE_SECONDS,
+            "searches": self.searches,
+            "fallbacks": self.fallbacks,
+            "last_error": self.last_error,
+        }
+
+
+ann_index = AnnIndexManager()
@@ -0,0 +1,94 @@
+"""
+Benchmark de backends de embeddings: textos/segundo del backend local (ONNX en CPU)
+contra la Inference API de Hugging Face, y similitud coseno entre ambos vectores
+para verificar que son intercambiables en la columna vector(384).
+
+Uso (desde la raíz del repo):
+    python -m benchmarks.bench_backends --texts 512 --batch 32
+    python -m benchmarks.bench_backends --file frases.txt --skip-remote
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import random
+from typing import List, Dict, Any
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_WORDS = ("departamento casa alquiler venta terreno lote cochera patio balcón ambientes dormitorios "
+          "baño cocina luminoso céntrico La Plata City Bell Gonnet Tolosa Berisso Ensenada diagonal "
+          "esquina metros cuadrados USD pesos por mes expensas apto crédito a estrenar reciclado").split()
+
+
+def synthetic_texts(count: int, seed: int = 42) -> List[str]:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 60))) for _ in range(count)]
+
+
+def run_backend(backend, texts: List[str], batch: int, runs: int) -> Dict[str, Any]:
+    # Calentamiento (carga perezosa, primera conexión HTTP, etc.)
+    backend.embed(texts[:min(batch, len(texts))])
+    timings = []
+    vectors = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = []
+        for i in range(0, len(texts), batch):
+            chunk = backend.embed(texts[i:i + batch])
+            result.extend(chunk.tolist() if hasattr(chunk, "tolist") else chunk)
+        timings.append(time.perf_counter() - start)
+        vectors = np.asarray(result, dtype=np.float32)
+    best = min(timings)
+    return {
+        "backend": backend.name,
+        "texts": len(texts),
+        "batch": batch,
+        "runs": runs,
+        "best_seconds": round(best, 4),
+        "texts_per_second": round(len(texts) / best, 2),
+        "dimensions": int(vectors.shape[1]),
+        "vectors": vectors,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark backend local vs Inference API")
+    parser.add_argument("--texts", type=int, default=256, help="Cantidad de textos sintéticos")
+    parser.add_argument("--file", help="Archivo con un texto por línea (reemplaza a los sintéticos)")
+    parser.add_argument("--batch", type=int, default=32, help="Textos por llamada")
+    parser.add_argument("--runs", type=int, default=3, help="Repeticiones (se informa la mejor)")
+    parser.add_argument("--skip-remote", action="store_true", help="No medir la Inference API")
+    parser.add_argument("--output", help="Guardar los resultados en este JSON")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = synthetic_texts(args.texts)
+
+    from embedding_backends import LocalOnnxBackend
+    results = [run_backend(LocalOnnxBackend(), texts, args.batch, args.runs)]
+
+    if not args.skip_remote and os.getenv("HF_TOKEN"):
+        from hf_client import HFInferenceBackend
+        results.append(run_backend(HFInferenceBackend(os.getenv("HF_TOKEN")), texts, args.batch, args.runs))
+
+    report = {"results": [{k: v for k, v in r.items() if k != "vectors"} for r in results]}
+    if len(results) == 2:
+        # Ambos backends normalizan L2: el producto punto es la similitud coseno
+        cosine = np.sum(results[0]["vectors"] * results[1]["vectors"], axis=1)
+        report["local_vs_remote_cosine"] = {"mean": round(float(cosine.mean()), 5), "min": round(float(cosine.min()), 5)}
+        report["speedup_local"] = round(results[0]["texts_per_second"] / results[1]["texts_per_second"], 2)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
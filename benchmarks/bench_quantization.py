@@ -0,0 +1,112 @@
+"""
+Recall vs. latencia de la búsqueda con columna cuantizada (quantization.py) contra la
+búsqueda exacta sobre `embedding`, para varios factores de rescoring.
+
+Las consultas son embeddings de documentos tomados al azar de la propia tabla. La búsqueda
+exacta se corre con los índices desactivados (SET LOCAL enable_indexscan = off) para que
+sea la referencia real.
+
+Uso (desde la raíz del repo, con DATABASE_URL y las columnas de sql/004_quantized_vectors.sql):
+    python -m benchmarks.bench_quantization --kind halfvec --samples 50 --limit 10 --factors 1,2,4,8
+    python -m benchmarks.bench_quantization --kind bit --factors 4,8,16,32 --output bit.json
+"""
+import os
+import sys
+import time
+import json
+import argparse
+from typing import List, Dict, Any, Tuple
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import connection  # noqa: E402
+from quantization import QUANTIZERS, quantized_search_sql, status_sql  # noqa: E402
+
+_SAMPLE_SQL = "SELECT embedding::text AS embedding FROM documents WHERE embedding IS NOT NULL ORDER BY random() LIMIT %s;"
+_EXACT_SQL = """
+    SELECT id FROM documents
+    ORDER BY embedding <=> %(query_vector)s::vector
+    LIMIT %(limit)s;
+"""
+
+
+def timed_ids(cur, sql: str, params: Dict[str, Any]) -> Tuple[List[int], float]:
+    start = time.perf_counter()
+    cur.execute(sql, params)
+    ids = [row["id"] for row in cur.fetchall()]
+    return ids, (time.perf_counter() - start) * 1000
+
+
+def summarize(latencies: List[float], recalls: List[float]) -> Dict[str, Any]:
+    return {
+        "recall_at_k": round(float(np.mean(recalls)), 4) if recalls else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kind", choices=list(QUANTIZERS), default="halfvec")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--factors", default="1,2,4,8", help="Factores de rescoring separados por coma")
+    parser.add_argument("--output", help="Guardar el resultado como JSON")
+    args = parser.parse_args()
+    factors = [int(f) for f in args.factors.split(",") if f.strip()]
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(status_sql(args.kind))
+            status = cur.fetchone()
+            if status["quantized"] < status["total"]:
+                print(f"[WARN] {status['total'] - status['quantized']} filas sin {args.kind}; "
+                      f"correr: python manage.py quantize-backfill --kind {args.kind}")
+
+            cur.execute(_SAMPLE_SQL, (args.samples,))
+            queries = [row["embedding"] for row in cur.fetchall()]
+
+            exact_ids = []
+            exact_latencies = []
+            cur.execute("SET LOCAL enable_indexscan = off;")
+            for query in queries:
+                ids, ms = timed_ids(cur, _EXACT_SQL, {"query_vector": query, "limit": args.limit})
+                exact_ids.append(set(ids))
+                exact_latencies.append(ms)
+            conn.rollback()
+
+            report = {
+                "kind": args.kind,
+                "rows": status["total"],
+                "samples": len(queries),
+                "limit": args.limit,
+                "exact": summarize(exact_latencies, []),
+                "factors": [],
+            }
+            sql = quantized_search_sql("", args.kind)
+            for factor in factors:
+                latencies = []
+                recalls = []
+                for query, truth in zip(queries, exact_ids):
+                    params = {"query_vector": query, "limit": args.limit, "candidates": args.limit * factor}
+                    ids, ms = timed_ids(cur, sql, params)
+                    latencies.append(ms)
+                    recalls.append(len(truth & set(ids)) / len(truth) if truth else 1.0)
+                report["factors"].append({"factor": factor, "candidates": args.limit * factor,
+                                          **summarize(latencies, recalls)})
+
+    print(f"{args.kind}: {report['rows']} filas, {report['samples']} consultas, top-{args.limit}")
+    print(f"  exacta         p50 {report['exact']['p50_ms']:>8} ms   p95 {report['exact']['p95_ms']:>8} ms")
+    for row in report["factors"]:
+        print(f"  factor {row['factor']:>3}     p50 {row['p50_ms']:>8} ms   p95 {row['p95_ms']:>8} ms   "
+              f"recall@{args.limit} {row['recall_at_k']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
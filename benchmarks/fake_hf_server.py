@@ -0,0 +1,161 @@
+"""
+Servidor falso de la Inference API de Hugging Face (feature-extraction) para probar la
+capa de resiliencia (resilience.py) y medir la app sin depender de HF.
+
+Responde a POST en cualquier ruta con {"inputs": [...]} devolviendo vectores
+deterministas (mismo texto -> mismo vector, normalizados L2) de MODEL_DIMENSIONS
+dimensiones. Se le pueden inyectar fallas:
+
+- --latency-ms / --jitter-ms: latencia base y variación uniforme.
+- --slow-rate / --slow-ms: fracción de requests lentos (cola de latencia, para hedging).
+- --error-rate / --error-status: fracción de requests que fallan (ej. 503, 500, 429).
+- --loading-seconds: durante los primeros N segundos responde 503 con `estimated_time`
+  como cuando el modelo está cargando.
+
+La configuración se cambia en caliente con POST /_control (mismo nombre de campos, con
+guiones bajos) y GET /_stats devuelve los contadores.
+
+Uso (desde la raíz del repo):
+    python -m benchmarks.fake_hf_server --port 8089 --latency-ms 40 --slow-rate 0.05 --slow-ms 800
+    HF_BASE_URL=http://127.0.0.1:8089 uvicorn main:app
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import MODEL_DIMENSIONS  # noqa: E402
+
+config: Dict[str, Any] = {
+    "latency_ms": 0.0,
+    "jitter_ms": 0.0,
+    "slow_rate": 0.0,
+    "slow_ms": 0.0,
+    "error_rate": 0.0,
+    "error_status": 503,
+    "loading_seconds": 0.0,
+    "dimensions": MODEL_DIMENSIONS,
+}
+stats = {"requests": 0, "texts": 0, "errors": 0, "loading": 0, "slow": 0}
+_started_at = time.monotonic()
+_lock = threading.Lock()
+
+
+def fake_vector(text: str, dimensions: int) -> List[float]:
+    """Vector determinista para `text` (semilla = sha256 del texto), normalizado L2."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def control(changes: Dict[str, Any]) -> Tuple[int, Any]:
+    global _started_at
+    unknown = set(changes) - set(config) - {"reset_loading"}
+    if unknown:
+        return 400, {"error": f"campos desconocidos: {sorted(unknown)}"}
+    with _lock:
+        if changes.pop("reset_loading", False):
+            _started_at = time.monotonic()
+        config.update(changes)
+        return 200, dict(config)
+
+
+def feature_extraction(body: Any) -> Tuple[int, Any]:
+    inputs = body.get("inputs", body) if isinstance(body, dict) else body
+    texts = [inputs] if isinstance(inputs, str) else list(inputs)
+    with _lock:
+        stats["requests"] += 1
+        stats["texts"] += len(texts)
+        current = dict(config)
+        remaining = current["loading_seconds"] - (time.monotonic() - _started_at)
+        if remaining > 0:
+            stats["loading"] += 1
+            return 503, {"error": "Model is currently loading", "estimated_time": round(remaining, 1)}
+        slow = random.random() < current["slow_rate"]
+        failed = random.random() < current["error_rate"]
+        stats["slow"] += slow
+        stats["errors"] += failed
+
+    delay = current["latency_ms"] + random.uniform(0, current["jitter_ms"]) + (current["slow_ms"] if slow else 0)
+    if delay > 0:
+        time.sleep(delay / 1000)
+    if failed:
+        return current["error_status"], {"error": "injected failure"}
+
+    vectors = [fake_vector(text, current["dimensions"]) for text in texts]
+    return 200, vectors[0] if isinstance(inputs, str) else vectors
+
+
+class FakeHFHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, status: int, payload: Any) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/_stats":
+            with _lock:
+                self._reply(200, dict(stats))
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            self._reply(400, {"error": "JSON inválido"})
+            return
+        if self.path == "/_control":
+            self._reply(*control(body))
+        else:
+            self._reply(*feature_extraction(body))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host: str = "127.0.0.1", port: int = 8089) -> ThreadingHTTPServer:
+    """
+    Crea el servidor (sin arrancarlo); para usarlo desde otro script:
+    threading.Thread(target=serve(port=0).serve_forever, daemon=True).start()
+    """
+    server = ThreadingHTTPServer((host, port), FakeHFHandler)
+    server.daemon_threads = True
+    return server
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    for name, value in config.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=type(value), default=value)
+    args = parser.parse_args()
+    config.update({name: getattr(args, name) for name in config})
+
+    server = serve(args.host, args.port)
+    print(f"Fake HF server en http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
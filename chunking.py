@@ -0,0 +1,100 @@
+import os
+import re
+import logging
+import threading
+from typing import List, Tuple, Optional
+import numpy as np
+from constants import MODEL_NAME, MAX_SEQUENCE_LENGTH
+
+"""
+División de documentos largos en chunks acotados por tokens (CHUNKING_ENABLED=1).
+
+bge-small trunca la entrada en MAX_SEQUENCE_LENGTH (512) tokens: todo lo que sigue no
+influye en el embedding. Con chunking, cada texto se tokeniza localmente y, si no entra,
+se divide en ventanas de CHUNK_MAX_TOKENS tokens que se solapan CHUNK_OVERLAP_TOKENS.
+El documento se guarda como una fila "padre" (contenido completo, sin embedding) y una fila
+hija por chunk (parent_id, chunk_index, con su embedding); ver sql/008_document_chunks.sql.
+/search agrupa los chunks encontrados por documento padre (search_service.py).
+
+El tokenizer es el del modelo (tokenizers + tokenizer.json del repo en HF, las mismas
+dependencias del backend local). Si no está instalado se usa una estimación por palabras
+(~4 caracteres por token) con un margen, para no pasarse del límite.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+CHUNKING_ENABLED = os.getenv("CHUNKING_ENABLED", "0") == "1"
+# [CLS] y [SEP] ocupan 2 de los 512 tokens
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", str(MAX_SEQUENCE_LENGTH - 2)))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+
+# Con la estimación por palabras se deja un margen por los errores de la aproximación
+_APPROX_SAFETY = 0.8
+_WORD = re.compile(r"\S+")
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+
+def _load_tokenizer():
+    """Tokenizer del modelo, o None si no se puede cargar (se usa la estimación)."""
+    global _tokenizer, _tokenizer_loaded
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            try:
+                from tokenizers import Tokenizer
+                from huggingface_hub import hf_hub_download
+                tokenizer = Tokenizer.from_file(hf_hub_download(repo_id=MODEL_NAME, filename="tokenizer.json"))
+                tokenizer.no_truncation()
+                tokenizer.no_padding()
+                _tokenizer = tokenizer
+            except Exception as e:
+                app_logger.warning(f"Chunking sin tokenizer del modelo ({type(e).__name__}: {e}); se estima por palabras")
+            _tokenizer_loaded = True
+        return _tokenizer
+
+
+def _token_spans(text: str) -> Tuple[List[Tuple[int, int]], int]:
+    """
+    Spans (inicio, fin) en caracteres de cada token y el máximo de tokens por chunk para
+    esos spans. Con la estimación, cada span es una palabra y cuenta ~len/4 tokens.
+    """
+    tokenizer = _load_tokenizer()
+    if tokenizer is not None:
+        return list(tokenizer.encode(text, add_special_tokens=False).offsets), CHUNK_MAX_TOKENS
+    spans = []
+    for match in _WORD.finditer(text):
+        # Una palabra larga se parte en pedazos de ~4 caracteres por token
+        for start in range(match.start(), match.end(), 4):
+            spans.append((start, min(start + 4, match.end())))
+    return spans, int(CHUNK_MAX_TOKENS * _APPROX_SAFETY)
+
+
+def chunk_text(text: str, max_tokens: Optional[int] = None, overlap: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """
+    Divide `text` en chunks de hasta max_tokens tokens que se solapan `overlap` tokens.
+    Un texto que entra en el modelo se devuelve sin cambios, como único chunk.
+    """
+    spans, default_max = _token_spans(text)
+    max_tokens = max_tokens or default_max
+    if len(spans) <= max_tokens:
+        return [text]
+
+    step = max(max_tokens - min(overlap, max_tokens // 2), 1)
+    chunks = []
+    for start in range(0, len(spans), step):
+        end = min(start + max_tokens, len(spans))
+        chunks.append(text[spans[start][0]:spans[end - 1][1]])
+        if end == len(spans):
+            break
+    return chunks
+
+
+def pooled_embedding(embeddings) -> List[float]:
+    """
+    Embedding de un documento a partir de los de sus chunks (promedio normalizado L2),
+    para devolver un solo vector por texto en las respuestas de /embedding y /embeddings.
+    """
+    mean = np.asarray(embeddings, dtype=np.float32).mean(axis=0)
+    return (mean / max(float(np.linalg.norm(mean)), 1e-12)).tolist()
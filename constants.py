@@ -4,7 +4,7 @@
 
 MODEL_NAME = "BAAI/bge-small-en-v1.5"
 MODEL_DIMENSIONS = 384
-MAX_SEQUENCE_LENGTH = 5126
+MAX_SEQUENCE_LENGTH = 512
 MODEL_DESCRIPTION = "Sentence embedding model, maps sentences to 384 dimensional dense vectors"
 MODEL_USE_CASE = "Semantic similarity, clustering, semantic search"
 MODEL_LANGUAGE = "English (optimized), but works reasonably with other languages"
\ No newline at end of file
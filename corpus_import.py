@@ -0,0 +1,253 @@
+import io
+import os
+import csv
+import json
+import time
+import logging
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+from constants import MODEL_DIMENSIONS
+from database import connection
+from hf_client import get_embeddings_from_hf
+from vectors import to_pgvector_literals
+from quantization import quantizer
+from model_migration import prepare_dual_write, dual_write
+from document_store import build_metadata, content_hash, CONTENT_HASH_ENABLED
+
+"""
+Importación offline de un corpus a `documents` (python manage.py import-corpus).
+
+Formatos (un registro por línea o fila; el número de registro es el offset):
+- txt: cada línea no vacía es un documento.
+- jsonl: un objeto por línea; el texto sale de `text_field` y el resto de los campos (y los
+  de un campo "metadata", si es un objeto) se guardan en metadata.
+- csv: con encabezado; el texto sale de la columna `text_field` y el resto de las columnas
+  va a metadata.
+
+Los lotes se embeben en paralelo (`workers` lotes por delante, con get_embeddings_from_hf,
+que ya usa la caché y reparte cada lote en chunks concurrentes) pero se escriben en orden:
+cada lote se copia con COPY a una tabla temporal y pasa a documents con un solo
+INSERT ... SELECT (que calcula la columna cuantizada y dispara los triggers de
+document_counters). Después de cada commit se guarda el offset del próximo registro en un
+archivo de checkpoint, así una importación cortada se retoma sin repetir lotes.
+
+No divide textos largos en chunks (CHUNKING_ENABLED): cada registro se embebe entero.
+Con CONTENT_HASH_ENABLED los contenidos ya guardados se saltean (ON CONFLICT DO NOTHING).
+La API no se entera de la importación: search_cache (si está activa) se pone al día al vencer
+su TTL y el índice ANN de los procesos en marcha con POST /search/index/reload.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "256"))
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "4"))
+IMPORT_FORMATS = {".txt": "txt", ".jsonl": "jsonl", ".ndjson": "jsonl", ".csv": "csv"}
+
+_STAGING_TABLE = "corpus_import_staging"
+
+
+def detect_format(path: str) -> str:
+    fmt = IMPORT_FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f"No se reconoce el formato de {path} (usar --format txt, jsonl o csv)")
+    return fmt
+
+
+def read_records(path: str, fmt: str, text_field: str = "text", offset: int = 0) -> Iterator[Tuple[int, Optional[str], Dict[str, Any]]]:
+    """
+    (número de registro, texto, metadata) de cada registro a partir de `offset`. Los registros
+    vacíos o inválidos se devuelven con texto None para que igual cuenten en el offset.
+    """
+    with open(path, encoding="utf-8", newline="" if fmt == "csv" else None) as f:
+        if fmt == "txt":
+            records = (line.strip() or None for line in f)
+        elif fmt == "jsonl":
+            records = f
+        elif fmt == "csv":
+            records = csv.DictReader(f)
+        else:
+            raise ValueError(f"Formato desconocido: {fmt}")
+
+        for number, record in enumerate(itertools.islice(records, offset, None), start=offset):
+            if fmt == "txt":
+                yield number, record, {}
+                continue
+            if fmt == "jsonl":
+                if not record.strip():
+                    yield number, None, {}
+                    continue
+                try:
+                    record = json.loads(record)
+                except ValueError as e:
+                    app_logger.warning(f"{path}:{number + 1}: JSON inválido, se saltea ({str(e)})")
+                    yield number, None, {}
+                    continue
+                if not isinstance(record, dict):
+                    yield number, None, {}
+                    continue
+            record = dict(record)
+            text = record.pop(text_field, None)
+            metadata = record.pop("metadata", None) if fmt == "jsonl" else None
+            metadata = {**record, **metadata} if isinstance(metadata, dict) else record
+            yield number, text.strip() if isinstance(text, str) and text.strip() else None, metadata
+
+
+def load_checkpoint(checkpoint: str) -> Dict[str, Any]:
+    if not os.path.exists(checkpoint):
+        return {}
+    with open(checkpoint, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_checkpoint(checkpoint: str, state: Dict[str, Any]) -> None:
+    tmp = checkpoint + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({**state, "updated_at": datetime.utcnow().isoformat()}, f, indent=2)
+    os.replace(tmp, checkpoint)
+
+
+def _batches(records, batch_size: int) -> Iterator[Tuple[int, List[str], List[Dict[str, Any]]]]:
+    """(offset siguiente al lote, textos, metadatas) de a `batch_size` registros."""
+    texts, metadatas, next_offset = [], [], None
+    for number, text, metadata in records:
+        next_offset = number + 1
+        if text is not None:
+            texts.append(text)
+            metadatas.append(metadata)
+        if next_offset % batch_size == 0:
+            yield next_offset, texts, metadatas
+            texts, metadatas = [], []
+    if next_offset is not None and next_offset % batch_size:
+        yield next_offset, texts, metadatas
+
+
+def _staging_columns() -> List[str]:
+    return ["content", "embedding", "metadata", "source"] + (["content_hash"] if CONTENT_HASH_ENABLED else [])
+
+
+def _insert_sql() -> str:
+    """INSERT ... SELECT desde la tabla temporal (con la columna cuantizada si corresponde)."""
+    columns = _staging_columns()
+    select = list(columns)
+    q = quantizer()
+    if q is not None:
+        columns.append(q["column"])
+        select.append(q["expression"])
+    sql = f"INSERT INTO documents ({', '.join(columns)}) SELECT {', '.join(select)} FROM {_STAGING_TABLE} ORDER BY ord"
+    if CONTENT_HASH_ENABLED:
+        sql += " ON CONFLICT (content_hash) DO NOTHING"
+    return sql + " RETURNING id, content;"
+
+
+def _write_batch(cur, texts: List[str], embeddings, metadatas: List[Dict[str, Any]], base: Dict[str, Any],
+                 source: str) -> Tuple[List[int], List[str]]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for text, literal, metadata in zip(texts, to_pgvector_literals(embeddings), metadatas):
+        row = [text, literal, json.dumps({**metadata, **base}, default=str), source]
+        if CONTENT_HASH_ENABLED:
+            row.append(content_hash(text))
+        writer.writerow(row)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {_STAGING_TABLE} ({', '.join(_staging_columns())}) FROM STDIN WITH (FORMAT csv)", buffer)
+    cur.execute(_insert_sql())
+    rows = cur.fetchall()
+    return [row["id"] for row in rows], [row["content"] for row in rows]
+
+
+def _embed_batch(texts: List[str]) -> Tuple[Any, Optional[Dict[str, Any]]]:
+    """Embeddings del lote y, durante una migración, los del modelo destino (fuera de la transacción)."""
+    return get_embeddings_from_hf(texts), prepare_dual_write(texts)
+
+
+def import_file(path: str, fmt: Optional[str] = None, text_field: str = "text", batch_size: int = IMPORT_BATCH_SIZE,
+                workers: int = IMPORT_WORKERS, offset: Optional[int] = None, limit: Optional[int] = None,
+                checkpoint: Optional[str] = None) -> Dict[str, Any]:
+    """ ==========================================================================================
+    Importa un archivo txt/jsonl/csv a documents.
+    Args:
+        path: Archivo a importar.
+        fmt: "txt", "jsonl" o "csv" (default: según la extensión).
+        text_field: Campo (jsonl) o columna (csv) con el texto.
+        batch_size: Registros por lote (una llamada de embeddings y un COPY por lote).
+        workers: Lotes que se embeben en paralelo.
+        offset: Registro desde el que empezar (default: el del checkpoint, o 0).
+        limit: Máximo de registros a procesar en esta corrida.
+        checkpoint: Archivo de checkpoint (default: <path>.import.json).
+    Returns:
+        {'path', 'offset', 'records', 'inserted', 'skipped', 'batches', 'seconds', 'docs_per_second'}
+    =========================================================================================== """
+    fmt = fmt or detect_format(path)
+    checkpoint = checkpoint or path + ".import.json"
+    state = load_checkpoint(checkpoint)
+    if offset is None:
+        offset = state.get("offset", 0)
+        if offset:
+            app_logger.info(f"Retomando {path} desde el registro {offset} ({checkpoint})")
+    else:
+        state = {}
+    state = {"path": os.path.abspath(path), "format": fmt, "offset": offset,
+             "inserted": state.get("inserted", 0), "skipped": state.get("skipped", 0)}
+
+    records = read_records(path, fmt, text_field, offset)
+    if limit is not None:
+        records = itertools.islice(records, limit)
+    batches = _batches(records, batch_size)
+    base = build_metadata()
+    base["import_file"] = os.path.basename(path)
+    result = {"path": path, "offset": offset, "records": 0, "inserted": 0, "skipped": 0, "batches": 0}
+    start = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="corpus-import") as pool, connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {_STAGING_TABLE} ("
+                        f"ord BIGSERIAL, content TEXT, embedding vector({MODEL_DIMENSIONS}), metadata JSONB, "
+                        f"source TEXT, content_hash TEXT) ON COMMIT DELETE ROWS;")
+        conn.commit()
+
+        pending = deque()
+
+        def submit_next() -> bool:
+            batch = next(batches, None)
+            if batch is None:
+                return False
+            next_offset, texts, metadatas = batch
+            future = pool.submit(_embed_batch, texts) if texts else None
+            pending.append((next_offset, texts, metadatas, future))
+            return True
+
+        while len(pending) < max(workers, 1) and submit_next():
+            pass
+        while pending:
+            next_offset, texts, metadatas, future = pending.popleft()
+            submit_next()
+            inserted = 0
+            if texts:
+                embeddings, prepared = future.result()
+                with conn.cursor() as cur:
+                    ids, contents = _write_batch(cur, texts, embeddings, metadatas, base, base["import_file"])
+                    # Durante una migración de modelo también se escribe la columna nueva
+                    dual_write(cur, ids, contents, prepared)
+                inserted = len(ids)
+            conn.commit()
+
+            records = next_offset - state["offset"]
+            state["inserted"] += inserted
+            state["skipped"] += records - inserted
+            state["offset"] = next_offset
+            _save_checkpoint(checkpoint, state)
+            result["records"] += records
+            result["inserted"] += inserted
+            result["skipped"] += records - inserted
+            result["batches"] += 1
+            elapsed = time.monotonic() - start
+            app_logger.info(f"{path}: offset {next_offset}, {result['inserted']} insertados "
+                            f"({result['inserted'] / elapsed if elapsed else 0:.0f} docs/s)")
+
+    result["offset"] = state["offset"]
+    result["seconds"] = round(time.monotonic() - start, 3)
+    result["docs_per_second"] = round(result["inserted"] / result["seconds"], 1) if result["seconds"] else 0.0
+    return result
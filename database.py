@@ -1,12 +1,34 @@
 import os
 import re
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any
 import psycopg2
 import psycopg2.extras
+import psycopg2.extensions
 from dotenv import load_dotenv
+from metrics import observe_stage
 
 # Cargar variables de entorno
 load_dotenv()
 
+app_logger = logging.getLogger(__name__)
+
+# ============================================>
+# Configuración del pool (variables de entorno)
+# ============================================>
+# "pool": conexiones reutilizables; "oneshot": una conexión nueva por uso (arranques en frío de Vercel)
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "oneshot" if os.getenv("VERCEL") else "pool")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+DB_POOL_MAX_IDLE_SECONDS = float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", "300"))
+DB_POOL_MAX_LIFETIME_SECONDS = float(os.getenv("DB_POOL_MAX_LIFETIME_SECONDS", "1800"))
+DB_POOL_PRE_PING_AFTER_SECONDS = float(os.getenv("DB_POOL_PRE_PING_AFTER_SECONDS", "5"))
+
 def _sanitize_neon_url(url: str) -> str:
     """
     Limpia la URL de conexion de Neon para compatibilidad con psycopg2:
@@ -45,4 +67,242 @@ def get_connection():
     )
     return conn
 
+
+class PoolTimeout(RuntimeError):
+    """No se obtuvo una conexión del pool dentro de DB_POOL_TIMEOUT_SECONDS."""
+
+
+# ============================================>
+# Pool de conexiones thread-safe
+# ============================================>
+class ConnectionPool:
+    """
+    Pool de conexiones psycopg2 con tamaño mínimo/máximo, desalojo de conexiones
+    ociosas, reciclado por antigüedad y pre-ping (SELECT 1) antes de entregar una
+    conexión que estuvo inactiva, para descartar sockets congelados del lado de Neon.
+    """
+
+    def __init__(self, min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT_SECONDS, max_idle: float = DB_POOL_MAX_IDLE_SECONDS,
+                 max_lifetime: float = DB_POOL_MAX_LIFETIME_SECONDS,
+                 pre_ping_after: float = DB_POOL_PRE_PING_AFTER_SECONDS):
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.pre_ping_after = pre_ping_after
+        # Cada elemento: (conexión, creada_en, último_uso)
+        self._idle = deque()
+        self._created_at = {}
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "connections_created": 0,
+            "connections_closed": 0,
+            "pre_ping_failures": 0,
+            "recycled": 0,
+            "idle_evicted": 0,
+            "timeouts": 0,
+            "wait_time_total_ms": 0.0,
+            "wait_time_max_ms": 0.0,
+        }
+
+    def _close(self, conn) -> None:
+        """Cierra una conexión y libera su lugar. Llamar con el lock tomado."""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._created_at.pop(id(conn), None)
+        self._size -= 1
+        self._stats["connections_closed"] += 1
+
+    def _evict_idle(self, now: float) -> None:
+        """Cierra las conexiones ociosas más viejas, respetando min_size. Llamar con el lock tomado."""
+        while self._idle and self._size > self.min_size:
+            conn, _, last_used = self._idle[0]
+            if now - last_used <= self.max_idle:
+                break
+            self._idle.popleft()
+            self._close(conn)
+            self._stats["idle_evicted"] += 1
+
+    def _is_usable(self, conn, created_at: float, last_used: float, now: float) -> bool:
+        """
+        Valida una conexión ociosa antes de entregarla (cerrada, vieja o socket congelado).
+        Se llama sin el lock (el pre-ping va a la red); las métricas se actualizan con el lock.
+        """
+        if conn.closed:
+            return False
+        if now - created_at > self.max_lifetime:
+            with self._cond:
+                self._stats["recycled"] += 1
+            return False
+        if now - last_used > self.pre_ping_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1;")
+                conn.rollback()
+            except Exception:
+                with self._cond:
+                    self._stats["pre_ping_failures"] += 1
+                return False
+        return True
+
+    def getconn(self):
+        """
+        Entrega una conexión del pool, creando una nueva si hay lugar.
+        Si el pool está lleno espera hasta `timeout` segundos y luego lanza PoolTimeout.
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            candidate = None
+            create = False
+            with self._cond:
+                now = time.monotonic()
+                self._evict_idle(now)
+                if self._idle:
+                    candidate = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    create = True
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"No hay conexiones libres en el pool tras {self.timeout}s")
+                    self._cond.wait(remaining)
+                    continue
+
+            if create:
+                try:
+                    conn = get_connection()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created_at[id(conn)] = time.monotonic()
+                    self._stats["connections_created"] += 1
+                    self._record_checkout(start)
+                return conn
+
+            conn, created_at, last_used = candidate
+            if self._is_usable(conn, created_at, last_used, time.monotonic()):
+                with self._cond:
+                    self._record_checkout(start)
+                return conn
+            with self._cond:
+                self._close(conn)
+                self._cond.notify()
+
+    def _record_checkout(self, start: float) -> None:
+        waited_ms = (time.monotonic() - start) * 1000
+        self._stats["checkouts"] += 1
+        self._stats["wait_time_total_ms"] += waited_ms
+        self._stats["wait_time_max_ms"] = max(self._stats["wait_time_max_ms"], waited_ms)
+
+    def putconn(self, conn, discard: bool = False) -> None:
+        """
+        Devuelve una conexión al pool. Si quedó una transacción abierta se hace rollback;
+        si la conexión está rota (o discard=True) se cierra.
+        """
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            if discard or conn.closed:
+                self._close(conn)
+            else:
+                created_at = self._created_at.get(id(conn), time.monotonic())
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self) -> None:
+        with self._cond:
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                self._close(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            checkouts = self._stats["checkouts"]
+            return {
+                **self._stats,
+                "wait_time_avg_ms": round(self._stats["wait_time_total_ms"] / checkouts, 3) if checkouts else 0.0,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_oneshot_stats = {"checkouts": 0, "connect_time_total_ms": 0.0}
+
+
+def get_pool() -> ConnectionPool:
+    """Retorna el pool global, creándolo en el primer uso."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+@contextmanager
+def connection():
+    """
+    Context manager para usar una conexión a Neon:
+
+        with connection() as conn:
+            with conn.cursor() as cur:
+                ...
+            conn.commit()
+
+    En modo "pool" la conexión vuelve al pool al salir (con rollback si quedó una
+    transacción abierta). En modo "oneshot" se abre y se cierra una conexión por uso.
+    """
+    if DB_POOL_MODE == "oneshot":
+        start = time.monotonic()
+        conn = get_connection()
+        _oneshot_stats["checkouts"] += 1
+        _oneshot_stats["connect_time_total_ms"] += (time.monotonic() - start) * 1000
+        observe_stage("db_connect", time.monotonic() - start)
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+
+    start = time.monotonic()
+    pool = get_pool()
+    conn = pool.getconn()
+    observe_stage("db_connect", time.monotonic() - start)
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
+    finally:
+        pool.putconn(conn, discard=discard)
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Métricas del pool: checkouts, tiempos de espera y conexiones abiertas."""
+    if DB_POOL_MODE == "oneshot":
+        return {"mode": "oneshot", **_oneshot_stats}
+    return {"mode": "pool", **get_pool().stats()}
+
 print("Neon DB: modulo de conexion inicializado correctamente")
\ No newline at end of file
@@ -0,0 +1,126 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Any
+import psycopg
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from metrics import observe_stage
+from database import (
+    _sanitize_neon_url, DB_POOL_MODE, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT_SECONDS,
+    DB_POOL_MAX_IDLE_SECONDS, DB_POOL_MAX_LIFETIME_SECONDS
+)
+
+"""
+Conexiones async a Neon (psycopg 3 + psycopg_pool) para los endpoints async de main.py.
+
+Usa la misma configuración que el pool síncrono de database.py (DB_POOL_*). Las filas
+se devuelven como dict (dict_row), igual que RealDictCursor, y los placeholders son %s,
+por lo que las mismas sentencias SQL sirven para ambos drivers.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+_async_pool = None
+# Evita que varios requests concurrentes abran cada uno su pool en el primer uso
+_async_pool_lock = asyncio.Lock()
+_oneshot_stats = {"checkouts": 0, "connect_time_total_ms": 0.0}
+
+
+def _database_url() -> str:
+    raw_url = os.getenv("DATABASE_URL")
+    if not raw_url:
+        raise RuntimeError("ERROR CONFIG: La variable de entorno DATABASE_URL no esta definida.")
+    return _sanitize_neon_url(raw_url)
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    """
+    Retorna el pool async global, abriéndolo en el primer uso.
+    Las conexiones se validan con check_connection antes de entregarse (pre-ping).
+    """
+    global _async_pool
+    if _async_pool is not None:
+        return _async_pool
+    async with _async_pool_lock:
+        if _async_pool is not None:
+            return _async_pool
+        pool = AsyncConnectionPool(
+            _database_url(),
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=max(DB_POOL_MAX_SIZE, 1),
+            timeout=DB_POOL_TIMEOUT_SECONDS,
+            max_idle=DB_POOL_MAX_IDLE_SECONDS,
+            max_lifetime=DB_POOL_MAX_LIFETIME_SECONDS,
+            kwargs={"row_factory": dict_row, "connect_timeout": 10},
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+        )
+        await pool.open()
+        _async_pool = pool
+        return _async_pool
+
+
+@asynccontextmanager
+async def async_connection():
+    """
+    Context manager async para usar una conexión a Neon:
+
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(...)
+            await conn.commit()
+
+    En modo "oneshot" (DB_POOL_MODE) se abre y se cierra una conexión por uso.
+    """
+    if DB_POOL_MODE == "oneshot":
+        start = time.monotonic()
+        conn = await psycopg.AsyncConnection.connect(_database_url(), row_factory=dict_row, connect_timeout=10)
+        _oneshot_stats["checkouts"] += 1
+        _oneshot_stats["connect_time_total_ms"] += (time.monotonic() - start) * 1000
+        observe_stage("db_connect", time.monotonic() - start)
+        try:
+            yield conn
+        finally:
+            await conn.close()
+        return
+
+    start = time.monotonic()
+    pool = await get_async_pool()
+    async with pool.connection() as conn:
+        observe_stage("db_connect", time.monotonic() - start)
+        yield conn
+
+
+async def close_async_pool() -> None:
+    """Cierra el pool async (se llama al apagar la app)."""
+    global _async_pool
+    async with _async_pool_lock:
+        if _async_pool is not None:
+            await _async_pool.close()
+            _async_pool = None
+
+
+def get_async_pool_stats() -> Dict[str, Any]:
+    """Métricas del pool async: checkouts, tiempo de espera y conexiones abiertas."""
+    if DB_POOL_MODE == "oneshot":
+        return {"mode": "oneshot", **_oneshot_stats}
+    if _async_pool is None:
+        return {"mode": "pool", "opened": False}
+    stats = _async_pool.get_stats()
+    requests = stats.get("requests_num", 0)
+    return {
+        "mode": "pool",
+        "opened": True,
+        "checkouts": requests,
+        "wait_time_total_ms": stats.get("requests_wait_ms", 0),
+        "wait_time_avg_ms": round(stats.get("requests_wait_ms", 0) / requests, 3) if requests else 0.0,
+        "timeouts": stats.get("requests_errors", 0),
+        "size": stats.get("pool_size", 0),
+        "idle": stats.get("pool_available", 0),
+        "connections_created": stats.get("connections_num", 0),
+        "min_size": stats.get("pool_min", DB_POOL_MIN_SIZE),
+        "max_size": stats.get("pool_max", DB_POOL_MAX_SIZE),
+    }
@@ -0,0 +1,177 @@
+import os
+import json
+import logging
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable
+from constants import MODEL_NAME
+from database_async import async_connection
+from vectors import to_pgvector_literals
+from quantization import update_embeddings_sql
+from schemas import DocumentSelection
+from chunking import CHUNKING_ENABLED
+from metrics import timed
+from search_cache import search_cache
+
+"""
+Operaciones en lote sobre `documents` (POST /documents/delete y POST /documents/reembed).
+
+La selección (schemas.DocumentSelection) combina con AND una lista de ids, un rango de ids
+y un filtro de metadata (JSONB @>), y se resuelve en la base:
+
+- Borrado: un único DELETE ... RETURNING por request, acotado a DOCUMENTS_BULK_MAX_ROWS
+  filas (con `has_more` para seguir en otro request).
+- Re-embed: recorre la selección por id en pasadas de `batch_size` filas; cada pasada pide
+  los embeddings de nuevo al backend sin usar la caché (hf_client.arefresh_embeddings), los
+  escribe con un solo UPDATE y hace commit, así un corte a mitad de camino conserva lo hecho
+  y `next_after_id` permite retomarlo.
+
+Con CHUNKING_ENABLED la selección se aplica a los documentos (filas sin parent_id): borrar un
+documento borra sus chunks y re-embeberlo re-embebe sus chunks (la fila padre no tiene
+embedding). Las funciones devuelven los ids de las filas con embedding afectadas para que el
+llamador actualice el índice ANN sin recargarlo.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+DOCUMENTS_BULK_MAX_ROWS = int(os.getenv("DOCUMENTS_BULK_MAX_ROWS", "10000"))
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "64"))
+
+_DELETE_SQL = """
+    WITH target AS (
+        SELECT id FROM documents
+        {where}
+        ORDER BY id
+        LIMIT %(limit)s
+    )
+    DELETE FROM documents
+    WHERE id IN (SELECT id FROM target) {children}
+    RETURNING id, {parent} AS parent_id;
+"""
+
+_REEMBED_PAGE_SQL = """
+    SELECT id, content FROM documents
+    WHERE id > %(after_id)s AND {selection}
+    ORDER BY id
+    LIMIT %(batch)s;
+"""
+
+
+def selection_clauses(selection: DocumentSelection, params: Dict[str, Any]) -> List[str]:
+    """
+    Condiciones SQL de la selección (placeholders con nombre en `params`).
+    """
+    clauses = []
+    if selection.ids is not None:
+        clauses.append("id = ANY(%(ids)s)")
+        params["ids"] = selection.ids
+    if selection.start_id is not None:
+        clauses.append("id >= %(start_id)s")
+        params["start_id"] = selection.start_id
+    if selection.end_id is not None:
+        clauses.append("id <= %(end_id)s")
+        params["end_id"] = selection.end_id
+    if selection.metadata:
+        clauses.append("metadata @> %(metadata)s::jsonb")
+        params["metadata"] = json.dumps(selection.metadata)
+    if CHUNKING_ENABLED:
+        clauses.append("parent_id IS NULL")
+    return clauses
+
+
+async def adelete_documents(selection: DocumentSelection, limit: int = DOCUMENTS_BULK_MAX_ROWS) -> Dict[str, Any]:
+    """ ==========================================================================================
+    Borra los documentos seleccionados en una sola sentencia.
+    Args:
+        selection: Criterios de selección (al menos uno).
+        limit: Máximo de documentos a borrar en esta llamada.
+    Returns:
+        {'count', 'ids', 'has_more', 'removed_ids'}: documentos borrados, sus ids, si puede
+        quedar algo por borrar (se llegó a `limit`) y todos los ids eliminados de la tabla
+        (documentos y chunks) para sacarlos del índice ANN.
+    =========================================================================================== """
+    params: Dict[str, Any] = {"limit": limit}
+    sql = _DELETE_SQL.format(
+        where="WHERE " + " AND ".join(selection_clauses(selection, params)),
+        children="OR parent_id IN (SELECT id FROM target)" if CHUNKING_ENABLED else "",
+        parent="parent_id" if CHUNKING_ENABLED else "NULL::bigint",
+    )
+    async with async_connection() as conn:
+        async with conn.cursor() as cur:
+            with timed("db_query"):
+                await cur.execute(sql, params)
+                rows = await cur.fetchall()
+        await conn.commit()
+    if rows:
+        search_cache.invalidate()
+
+    ids = sorted(row["id"] for row in rows if row["parent_id"] is None)
+    app_logger.info(f"Borrado en lote: {len(ids)} documentos ({len(rows) - len(ids)} chunks)")
+    return {"count": len(ids), "ids": ids, "has_more": len(ids) >= limit, "removed_ids": [row["id"] for row in rows]}
+
+
+async def areembed_documents(selection: DocumentSelection, embed, batch_size: int = REEMBED_BATCH_SIZE,
+                             max_rows: int = DOCUMENTS_BULK_MAX_ROWS, after_id: int = 0,
+                             on_pass: Optional[Callable[[List[int], List[List[float]]], None]] = None) -> Dict[str, Any]:
+    """ ==========================================================================================
+    Recalcula en su lugar los embeddings de los documentos seleccionados.
+    Args:
+        selection: Criterios de selección (al menos uno).
+        embed: Función async que embebe una lista de textos sin caché (hf_client.arefresh_embeddings).
+        batch_size: Filas por pasada (una llamada al backend y un UPDATE por pasada).
+        max_rows: Máximo de filas a re-embeber en esta llamada.
+        after_id: Retomar después de este id (el `next_after_id` de una llamada anterior).
+        on_pass: Se llama con (ids, vectores) después del commit de cada pasada (índice ANN),
+            así lo ya guardado queda reflejado aunque una pasada posterior falle.
+    Returns:
+        {'count', 'ids', 'passes', 'next_after_id'}: filas actualizadas (documentos o chunks),
+        sus ids, pasadas hechas y el id desde donde seguir (None si se terminó).
+    =========================================================================================== """
+    params: Dict[str, Any] = {"batch": batch_size, "after_id": after_id}
+    where = " AND ".join(selection_clauses(selection, params))
+    if CHUNKING_ENABLED:
+        # Los chunks de los documentos seleccionados (o el documento, si no se dividió)
+        selection_sql = f"embedding IS NOT NULL AND COALESCE(parent_id, id) IN (SELECT id FROM documents WHERE {where})"
+    else:
+        selection_sql = where
+    page_sql = _REEMBED_PAGE_SQL.format(selection=selection_sql)
+    metadata_json = json.dumps({"model": MODEL_NAME, "reembedded_at": datetime.utcnow().isoformat()})
+
+    result = {"count": 0, "ids": [], "passes": 0, "next_after_id": None}
+    while result["count"] < max_rows:
+        params["batch"] = min(batch_size, max_rows - result["count"])
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                with timed("db_query"):
+                    await cur.execute(page_sql, params)
+                    rows = await cur.fetchall()
+        if not rows:
+            break
+
+        # La conexión no queda tomada mientras se espera al backend de embeddings
+        embeddings = await embed([row["content"] for row in rows])
+        literals = to_pgvector_literals(embeddings)
+        values = ",".join(["(%s::bigint, %s::vector)"] * len(rows))
+        update_params = [metadata_json] + [value for row, literal in zip(rows, literals) for value in (row["id"], literal)]
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                with timed("db_query"):
+                    await cur.execute(update_embeddings_sql(values), update_params)
+                    updated = {row["id"] for row in await cur.fetchall()}
+            await conn.commit()
+        search_cache.invalidate()
+
+        # Una fila borrada entre el SELECT y el UPDATE no se devuelve
+        written = [(row["id"], embedding) for row, embedding in zip(rows, embeddings) if row["id"] in updated]
+        if on_pass is not None and written:
+            on_pass([doc_id for doc_id, _ in written], [embedding for _, embedding in written])
+        result["ids"].extend(doc_id for doc_id, _ in written)
+        result["count"] = len(result["ids"])
+        result["passes"] += 1
+        params["after_id"] = rows[-1]["id"]
+        if len(rows) < params["batch"]:
+            break
+    else:
+        result["next_after_id"] = params["after_id"]
+
+    app_logger.info(f"Re-embed en lote: {result['count']} filas en {result['passes']} pasadas")
+    return result
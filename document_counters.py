@@ -0,0 +1,116 @@
+import os
+import logging
+from typing import List, Dict, Any
+from database import connection
+
+"""
+Estadísticas de `documents` para el dashboard (/documents/info, /documents/stats) sin
+recorrer la tabla.
+
+Con DOCUMENT_COUNTERS_ENABLED=1 se leen de document_counters (sql/009_document_counters.sql):
+una fila por modelo con cantidad de documentos, suma de largos de content y fechas extremas,
+que los triggers de documents actualizan en la misma transacción de cada INSERT, UPDATE o
+DELETE (ingesta, jobs, borrados, chunks). La lectura es O(modelos), no O(filas).
+
+Sin la tabla se calcula lo mismo con una consulta agregada sobre documents (el comportamiento
+anterior). reconcile() (python manage.py stats-reconcile) recalcula los contadores desde la
+tabla y reporta la diferencia, por si se desincronizan (TRUNCATE, triggers deshabilitados,
+cargas con COPY sin triggers).
+"""
+
+app_logger = logging.getLogger(__name__)
+
+DOCUMENT_COUNTERS_ENABLED = os.getenv("DOCUMENT_COUNTERS_ENABLED", "0") == "1"
+
+_COUNTER_FIELDS = ("documents", "content_chars", "min_created_at", "max_created_at")
+
+COUNTERS_SQL = """
+    SELECT model, documents, content_chars, min_created_at, max_created_at
+    FROM document_counters
+    ORDER BY model;
+"""
+
+# Mismo resultado que COUNTERS_SQL, recorriendo documents ({where}: excluir chunks)
+_SCAN_SQL = """
+    SELECT COALESCE(metadata->>'model', '') AS model, COUNT(*) AS documents,
+           COALESCE(SUM(length(content)), 0) AS content_chars,
+           MIN(created_at) AS min_created_at, MAX(created_at) AS max_created_at
+    FROM documents
+    {where}
+    GROUP BY 1
+    ORDER BY 1;
+"""
+
+_RECONCILE_SQL = """
+    INSERT INTO document_counters (model, documents, content_chars, min_created_at, max_created_at)
+    SELECT COALESCE(metadata->>'model', ''), COUNT(*), COALESCE(SUM(length(content)), 0), MIN(created_at), MAX(created_at)
+    FROM documents
+    WHERE parent_id IS NULL
+    GROUP BY 1;
+"""
+
+
+def scan_sql(exclude_chunks: bool) -> str:
+    """Consulta agregada sobre documents (sin contadores). exclude_chunks requiere sql/008."""
+    return _SCAN_SQL.format(where="WHERE parent_id IS NULL" if exclude_chunks else "")
+
+
+def summarize(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Respuesta de las estadísticas a partir de las filas por modelo (de COUNTERS_SQL o scan_sql).
+    """
+    rows = [row for row in rows if row["documents"] > 0]
+    total = sum(row["documents"] for row in rows)
+    chars = sum(row["content_chars"] for row in rows)
+    earliest = min((row["min_created_at"] for row in rows if row["min_created_at"] is not None), default=None)
+    latest = max((row["max_created_at"] for row in rows if row["max_created_at"] is not None), default=None)
+    return {
+        "count": total,
+        "earliest_created_at": str(earliest) if earliest is not None else None,
+        "latest_created_at": str(latest) if latest is not None else None,
+        "avg_content_length": round(chars / total, 1) if total else None,
+        "by_model": {row["model"] or "unknown": row["documents"] for row in rows},
+    }
+
+
+def reconcile(dry_run: bool = False) -> Dict[str, Any]:
+    """ ==========================================================================================
+    Recalcula document_counters desde documents.
+    Args:
+        dry_run: Solo reportar la diferencia, sin bloquear ni escribir.
+    Returns:
+        {'models', 'drift'}: cantidad de modelos y, por cada modelo desincronizado, los valores
+        guardados y los reales.
+    Mientras corre, los INSERT/DELETE sobre documents esperan en el trigger (LOCK EXCLUSIVE de
+    document_counters): las escrituras previas sin commit terminan antes del recuento y las
+    posteriores aplican su diferencia sobre los valores ya corregidos.
+    =========================================================================================== """
+    with connection() as conn:
+        with conn.cursor() as cur:
+            if not dry_run:
+                cur.execute("LOCK TABLE document_counters IN EXCLUSIVE MODE;")
+            cur.execute(COUNTERS_SQL)
+            stored = {row["model"]: row for row in cur.fetchall()}
+            cur.execute(scan_sql(exclude_chunks=True))
+            actual = {row["model"]: row for row in cur.fetchall()}
+
+            drift = []
+            for model in sorted(set(stored) | set(actual)):
+                old = {field: stored[model][field] if model in stored else None for field in _COUNTER_FIELDS}
+                new = {field: actual[model][field] if model in actual else None for field in _COUNTER_FIELDS}
+                if model not in actual and not old["documents"]:
+                    continue
+                if old != new:
+                    drift.append({"model": model or "unknown", "stored": old, "actual": new})
+
+            if not dry_run and drift:
+                cur.execute("DELETE FROM document_counters;")
+                cur.execute(_RECONCILE_SQL)
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+
+    if drift:
+        app_logger.warning(f"document_counters desincronizado en {len(drift)} modelo(s)")
+    return {"models": len(actual), "drift": drift, "applied": bool(drift) and not dry_run}
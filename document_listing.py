@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import base64
+import asyncio
+import logging
+import binascii
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+import numpy as np
+from fastapi import HTTPException
+from database_async import async_connection
+from response_formats import DTYPES
+from document_counters import DOCUMENT_COUNTERS_ENABLED, COUNTERS_SQL, scan_sql, summarize
+from chunking import CHUNKING_ENABLED
+
+"""
+Lectura paginada y exportación de la tabla `documents` (endpoints /documents/*).
+
+- Paginación keyset: en lugar de OFFSET o de un `n` sin tope, cada página se pide con
+  WHERE (created_at, id) < (último de la página anterior) y un LIMIT acotado
+  (DOCUMENTS_PAGE_MAX). El punto de continuación viaja como un cursor opaco (base64 de un
+  JSON) que el cliente devuelve tal cual en `cursor`. Índice en sql/007_documents_keyset.sql.
+- Exportación: aexport_documents() recorre la tabla con un cursor del lado del servidor
+  (DECLARE ... FETCH de a DOCUMENTS_EXPORT_BATCH_SIZE filas) y genera NDJSON, por lo que la
+  memoria no crece con el tamaño de la tabla. Con include_embeddings cada línea trae el
+  vector empaquetado en base64 (float32/float16 little-endian, ver response_formats.py).
+- Estadísticas: cantidad, fechas extremas, largo promedio y cantidad por modelo, leídas de
+  los contadores de document_counters.py (o en una sola consulta agregada si no están
+  habilitados), cacheadas por DOCUMENTS_STATS_TTL_SECONDS.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+DOCUMENTS_PAGE_MAX = int(os.getenv("DOCUMENTS_PAGE_MAX", "500"))
+DOCUMENTS_EXPORT_BATCH_SIZE = int(os.getenv("DOCUMENTS_EXPORT_BATCH_SIZE", "1000"))
+# Con contadores la lectura es barata y la cache puede ser mucho más corta
+DOCUMENTS_STATS_TTL_SECONDS = float(os.getenv("DOCUMENTS_STATS_TTL_SECONDS", "1" if DOCUMENT_COUNTERS_ENABLED else "30"))
+
+_COLUMNS = "id, content, metadata, created_at"
+
+# order -> (comparación keyset, ORDER BY)
+_ORDERS = {
+    "created_desc": ("(created_at, id) < (%(created_at)s::timestamptz, %(id)s)", "created_at DESC, id DESC"),
+    "created_asc": ("(created_at, id) > (%(created_at)s::timestamptz, %(id)s)", "created_at ASC, id ASC"),
+    "id_asc": ("id > %(id)s", "id ASC"),
+}
+
+# Con chunking, las filas hijas (chunks) no son documentos: no se listan ni se exportan
+_TOP_LEVEL = "parent_id IS NULL"
+
+_STATS_SQL = COUNTERS_SQL if DOCUMENT_COUNTERS_ENABLED else scan_sql(exclude_chunks=CHUNKING_ENABLED)
+
+
+# ============================================>
+# Cursores opacos
+# ============================================>
+def encode_cursor(order: str, row: Dict[str, Any]) -> str:
+    """
+    Cursor que apunta a la fila siguiente a `row` en el orden dado.
+    """
+    payload = {"o": order, "i": row["id"]}
+    if order != "id_asc":
+        created_at = row["created_at"]
+        payload["t"] = created_at.isoformat() if isinstance(created_at, datetime) else str(created_at)
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, order: str) -> Dict[str, Any]:
+    """
+    Decodifica un cursor de encode_cursor. Un cursor inválido o de otro endpoint es un 400.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if payload.get("o") != order:
+            raise ValueError("orden distinto")
+        params = {"id": int(payload["i"])}
+        if order != "id_asc":
+            params["created_at"] = datetime.fromisoformat(payload["t"])
+        return params
+    except (ValueError, KeyError, TypeError, AttributeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="cursor inválido")
+
+
+# ============================================>
+# Paginación keyset
+# ============================================>
+async def afetch_page(order: str, limit: int, cursor: Optional[str] = None,
+                      start_id: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """ ==========================================================================================
+    Una página de documents en el orden pedido.
+    Args:
+        order: "created_desc", "created_asc" o "id_asc".
+        limit: Filas por página (se acota a DOCUMENTS_PAGE_MAX).
+        cursor: next_cursor de la página anterior (None = primera página).
+        start_id: Solo para "id_asc" sin cursor: primer id a devolver (inclusive).
+    Returns:
+        (rows, next_cursor): next_cursor es None cuando no hay más filas.
+    =========================================================================================== """
+    comparison, order_by = _ORDERS[order]
+    limit = min(limit, DOCUMENTS_PAGE_MAX)
+    params: Dict[str, Any] = {"limit": limit + 1}
+    conditions = []
+    if cursor:
+        params.update(decode_cursor(cursor, order))
+        conditions.append(comparison)
+    elif start_id is not None:
+        params["id"] = start_id
+        conditions.append("id >= %(id)s")
+    if CHUNKING_ENABLED:
+        conditions.append(_TOP_LEVEL)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    sql = f"SELECT {_COLUMNS} FROM documents {where} ORDER BY {order_by} LIMIT %(limit)s;"
+    async with async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            rows = [dict(r) for r in await cur.fetchall()]
+
+    # Se pide una fila de más para saber si hay página siguiente sin un COUNT
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(order, rows[-1])
+    return rows, next_cursor
+
+
+# ============================================>
+# Exportación NDJSON con cursor del lado del servidor
+# ============================================>
+async def aexport_documents(include_embeddings: bool = False, dtype: str = "float32",
+                            after_id: int = 0,
+                            batch_size: int = DOCUMENTS_EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """
+    Genera todos los documentos con id > after_id, ordenados por id, como líneas NDJSON
+    (con chunking, solo los documentos y no sus chunks). Con include_embeddings cada línea trae "embedding" en base64 (dtype little-endian).
+    """
+    np_dtype = DTYPES[dtype][1]
+    columns = _COLUMNS + (", embedding::real[] AS embedding" if include_embeddings else "")
+    top_level = f" AND {_TOP_LEVEL}" if CHUNKING_ENABLED else ""
+    sql = f"SELECT {columns} FROM documents WHERE id > %s{top_level} ORDER BY id;"
+
+    exported = 0
+    async with async_connection() as conn:
+        # Cursor con nombre = DECLARE/FETCH en el servidor; vive dentro de la transacción
+        async with conn.cursor(name="documents_export") as cur:
+            cur.itersize = batch_size
+            await cur.execute(sql, (after_id,))
+            async for row in cur:
+                record = dict(row)
+                if include_embeddings:
+                    vector = record.pop("embedding")
+                    record["embedding"] = None if vector is None else base64.b64encode(
+                        np.asarray(vector, dtype=np_dtype).tobytes()
+                    ).decode("ascii")
+                exported += 1
+                yield (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        await conn.rollback()
+    app_logger.info(f"Exportación de documents: {exported} filas")
+
+
+# ============================================>
+# Estadísticas (una consulta, cacheada)
+# ============================================>
+class DocumentStats:
+    """
+    Cache de las estadísticas de documents con TTL. Las consultas concurrentes con la
+    cache vencida esperan a una sola ejecución del SQL (contadores o consulta agregada).
+    """
+
+    def __init__(self, ttl: float = DOCUMENTS_STATS_TTL_SECONDS):
+        self.ttl = ttl
+        self._value: Optional[Dict[str, Any]] = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _fresh(self) -> bool:
+        return self._value is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def aget(self) -> Dict[str, Any]:
+        if self._fresh():
+            return self._value
+        async with self._lock:
+            if not self._fresh():
+                async with async_connection() as conn:
+                    async with conn.cursor() as cur:
+                        await cur.execute(_STATS_SQL)
+                        rows = await cur.fetchall()
+                self._value = {**summarize(rows), "source": "counters" if DOCUMENT_COUNTERS_ENABLED else "scan"}
+                self._loaded_at = time.monotonic()
+        return self._value
+
+    def invalidate(self) -> None:
+        self._value = None
+
+
+document_stats = DocumentStats()
@@ -0,0 +1,524 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
+import psycopg2.extras
+from constants import MODEL_NAME
+from database import connection
+from database_async import async_connection
+from vectors import to_pgvector_literals
+from quantization import insert_sql
+from model_migration import prepare_dual_write, aprepare_dual_write, dual_write, adual_write
+from metrics import timed
+from chunking import CHUNKING_ENABLED, chunk_text, pooled_embedding
+from search_cache import search_cache
+
+"""
+Escritura de documentos en la tabla `documents`.
+
+insert_documents() reemplaza el INSERT ... RETURNING id por fila: los documentos se
+insertan en páginas con un único INSERT multi-fila (psycopg2.extras.execute_values).
+Si una página falla, se reintenta fila por fila dentro de savepoints para conservar
+los ids de las filas válidas y reportar el error de cada fila inválida.
+
+ainsert_documents() es la variante async (psycopg 3): arma el mismo INSERT multi-fila
+con un placeholder por valor, ya que psycopg 3 no tiene execute_values.
+
+aupsert_documents() es la ingesta con deduplicación (CONTENT_HASH_ENABLED=1, columna
+content_hash de sql/006_content_hash.sql): los textos repetidos dentro del lote se embeben
+una sola vez y los que ya están guardados devuelven su id sin llamar a Hugging Face. Con
+CHUNKING_ENABLED=1 también divide los textos largos (el hash va en la fila padre).
+
+ainsert_chunked_documents() es la ingesta con chunking (CHUNKING_ENABLED=1, chunking.py): los
+textos que superan el límite de tokens del modelo se guardan como una fila padre sin embedding
+y una fila hija por chunk (sql/008_document_chunks.sql).
+"""
+
+app_logger = logging.getLogger(__name__)
+
+INSERT_PAGE_SIZE = int(os.getenv("INSERT_PAGE_SIZE", "500"))
+CONTENT_HASH_ENABLED = os.getenv("CONTENT_HASH_ENABLED", "0") == "1"
+ON_CONFLICT_MODES = ("skip", "update")
+
+# Con QUANTIZED_STORAGE el INSERT también escribe la columna cuantizada (quantization.py)
+_INSERT_SQL = insert_sql()
+_INSERT_TEMPLATE = "(%s, %s::vector, %s::jsonb)"
+_UPSERT_TEMPLATE = "(%s, %s::vector, %s::jsonb, %s)"
+_CHUNK_TEMPLATE = "(%s, %s::vector, %s::jsonb, %s, %s)"
+
+_EXISTING_SQL = "SELECT id, content_hash, embedding::text AS embedding FROM documents WHERE content_hash = ANY(%s);"
+_CHUNK_EMBEDDINGS_SQL = ("SELECT parent_id, embedding::text AS embedding FROM documents "
+                         "WHERE parent_id = ANY(%s) ORDER BY parent_id, chunk_index;")
+_DELETE_CHUNKS_SQL = "DELETE FROM documents WHERE parent_id = ANY(%s) RETURNING id;"
+
+
+def build_metadata() -> Dict[str, Any]:
+    """
+    Metadatos que se guardan con cada documento (uno solo por lote).
+    """
+    return {"model": MODEL_NAME, "timestamp": datetime.utcnow().isoformat()}
+
+
+def insert_documents(texts: List[str], embeddings, metadata: Optional[Dict[str, Any]] = None,
+                     conn=None) -> Tuple[List[Optional[int]], List[Dict[str, Any]]]:
+    """ ==========================================================================================
+    Inserta un lote de documentos con sus embeddings.
+    Args:
+        texts: Contenidos a guardar.
+        embeddings: Embeddings en el mismo orden que `texts` (lista de listas o ndarray).
+        metadata: Metadatos comunes del lote (default: modelo y timestamp actual).
+        conn: Conexión existente. Si se pasa, el commit (y la invalidación de search_cache)
+            queda a cargo del llamador.
+    Returns:
+        (document_ids, failures): un id por texto (None si falló) y una lista de
+        {'index', 'error'} con las filas que no pudieron guardarse.
+    =========================================================================================== """
+    rows = _build_rows(texts, embeddings, metadata)
+    # Antes de escribir: la transacción no queda abierta mientras responde el modelo destino
+    prepared = prepare_dual_write(texts)
+    if conn is None:
+        with connection() as own_conn:
+            result = _insert_and_dual_write(own_conn, texts, rows, prepared)
+            own_conn.commit()
+        search_cache.invalidate()
+        return result
+    return _insert_and_dual_write(conn, texts, rows, prepared)
+
+
+async def ainsert_documents(texts: List[str], embeddings, metadata: Optional[Dict[str, Any]] = None,
+                            conn=None) -> Tuple[List[Optional[int]], List[Dict[str, Any]]]:
+    """
+    Variante async de insert_documents, con el mismo contrato de retorno.
+    """
+    rows = _build_rows(texts, embeddings, metadata)
+    prepared = await aprepare_dual_write(texts)
+    if conn is None:
+        async with async_connection() as own_conn:
+            result = await _ainsert_and_dual_write(own_conn, texts, rows, prepared)
+            await own_conn.commit()
+        search_cache.invalidate()
+        return result
+    return await _ainsert_and_dual_write(conn, texts, rows, prepared)
+
+
+def content_hash(text: str) -> str:
+    """
+    Hash del contenido tal como se guarda (sha256 hex); debe coincidir con el de sql/006_content_hash.sql.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+async def aupsert_documents(texts: List[str], embed: Callable[[List[str]], Awaitable[List[List[float]]]],
+                            on_conflict: str = "skip",
+                            metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """ ==========================================================================================
+    Ingesta con deduplicación por content_hash.
+    Args:
+        texts: Contenidos a guardar.
+        embed: Función async que embebe una lista de textos (ej. aget_embeddings_from_hf).
+        on_conflict: "skip" devuelve el id existente sin embeber; "update" vuelve a embeber
+            y actualiza embedding y metadata de la fila existente.
+        metadata: Metadatos comunes del lote.
+    Returns:
+        {'document_ids', 'embeddings', 'statuses', 'chunks', 'failures', 'written_ids',
+        'written_embeddings', 'removed_ids'}: un id, un embedding, un estado ("inserted",
+        "updated", "existing" o "failed") y una cantidad de chunks por texto de entrada, más las
+        filas escritas y las borradas (para actualizar el índice ANN).
+
+    Con CHUNKING_ENABLED=1 los textos largos se guardan como en ainsert_chunked_documents
+    (padre + chunks) y el content_hash va en la fila padre; el embedding devuelto es el
+    promedio normalizado de los chunks.
+    =========================================================================================== """
+    if on_conflict not in ON_CONFLICT_MODES:
+        raise ValueError(f"on_conflict debe ser uno de {', '.join(ON_CONFLICT_MODES)}")
+
+    hashes = [content_hash(text) for text in texts]
+    # Un solo representante por hash (el primero del lote)
+    unique: Dict[str, str] = {}
+    for text, digest in zip(texts, hashes):
+        unique.setdefault(digest, text)
+
+    by_hash: Dict[str, Dict[str, Any]] = {}
+    written_ids: List[int] = []
+    written_embeddings: List[List[float]] = []
+    removed_ids: List[int] = []
+    if on_conflict == "skip":
+        # Conexión corta solo para la búsqueda: no queda tomada mientras responden los modelos
+        async with async_connection() as conn:
+            by_hash.update(await _afetch_existing(conn, list(unique)))
+            await conn.commit()
+    pending = [digest for digest in unique if digest not in by_hash]
+
+    if pending:
+        pending_texts = [unique[digest] for digest in pending]
+        pieces = await _achunk(pending_texts)
+        flat = [chunk for chunks in pieces for chunk in chunks]
+        # Sin conexión tomada; el embedding del modelo destino (migración) va en paralelo
+        flat_embeddings, prepared = await asyncio.gather(embed(flat), aprepare_dual_write(flat))
+        offsets = _chunk_offsets(pieces)
+        short = [i for i, chunks in enumerate(pieces) if len(chunks) == 1]
+        rows = _build_rows([pending_texts[i] for i in short], [flat_embeddings[offsets[i]] for i in short], metadata)
+        rows = [row + (pending[i],) for row, i in zip(rows, short)]
+
+        async with async_connection() as conn:
+            with timed("db_query"):
+                returned, page_errors = await _aupsert_rows(conn, rows, on_conflict)
+
+            written_texts: List[str] = []
+            missing = []
+            for i in short:
+                digest, embedding = pending[i], flat_embeddings[offsets[i]]
+                if digest in returned:
+                    status = "updated" if returned[digest]["updated"] else "inserted"
+                    by_hash[digest] = {"id": returned[digest]["id"], "embedding": embedding, "status": status}
+                    written_ids.append(returned[digest]["id"])
+                    written_embeddings.append(embedding)
+                    written_texts.append(pending_texts[i])
+                elif digest in page_errors:
+                    by_hash[digest] = {"id": None, "embedding": embedding, "status": "failed", "error": page_errors[digest]}
+                else:
+                    # DO NOTHING: otro request insertó el mismo contenido entre la búsqueda y el INSERT
+                    missing.append(digest)
+
+            async with conn.cursor() as cur:
+                # Textos largos: padre (con el hash) + chunks, todo o nada por documento
+                for i, chunks in enumerate(pieces):
+                    if len(chunks) == 1:
+                        continue
+                    digest = pending[i]
+                    embeddings = flat_embeddings[offsets[i]:offsets[i] + len(chunks)]
+                    pooled = pooled_embedding(embeddings)
+                    await cur.execute("SAVEPOINT upsert_chunked;")
+                    try:
+                        with timed("db_query"):
+                            inserted = await _aupsert_chunked(cur, pending_texts[i], digest, chunks, embeddings,
+                                                              metadata or build_metadata(), on_conflict)
+                        await cur.execute("RELEASE SAVEPOINT upsert_chunked;")
+                    except Exception as e:
+                        await cur.execute("ROLLBACK TO SAVEPOINT upsert_chunked;")
+                        app_logger.error(f"Falló el upsert del documento en chunks {digest[:12]}: {str(e)}")
+                        by_hash[digest] = {"id": None, "embedding": pooled, "status": "failed", "error": str(e)}
+                        continue
+                    if inserted is None:
+                        missing.append(digest)
+                        continue
+                    by_hash[digest] = {"id": inserted["id"], "embedding": pooled, "chunks": len(chunks),
+                                       "status": "updated" if inserted["updated"] else "inserted"}
+                    removed_ids.extend(inserted["removed_ids"])
+                    written_ids.extend(inserted["chunk_ids"])
+                    written_embeddings.extend(embeddings)
+                    written_texts.extend(chunks)
+
+                # Un texto que antes se guardó en chunks y ahora entra entero deja de tener hijos
+                updated_short = [returned[pending[i]]["id"] for i in short
+                                 if pending[i] in returned and returned[pending[i]]["updated"]]
+                if CHUNKING_ENABLED and updated_short:
+                    await cur.execute(_DELETE_CHUNKS_SQL, (updated_short,))
+                    removed_ids.extend(row["id"] for row in await cur.fetchall())
+
+                await adual_write(cur, written_ids, written_texts, prepared)
+            if missing:
+                by_hash.update(await _afetch_existing(conn, missing))
+            await conn.commit()
+    if written_ids or removed_ids:
+        search_cache.invalidate()
+
+    result = {"document_ids": [], "embeddings": [], "statuses": [], "chunks": [], "failures": [],
+              "written_ids": written_ids, "written_embeddings": written_embeddings, "removed_ids": removed_ids}
+    first_index: Dict[str, int] = {}
+    for index, digest in enumerate(hashes):
+        entry = by_hash[digest]
+        status = entry["status"]
+        if digest in first_index and status != "failed":
+            status = "duplicate"
+        first_index.setdefault(digest, index)
+        result["document_ids"].append(entry["id"])
+        result["embeddings"].append(entry["embedding"])
+        result["statuses"].append(status)
+        result["chunks"].append(entry.get("chunks", 1))
+        if status == "failed":
+            result["failures"].append({"index": index, "error": entry["error"]})
+    return result
+
+
+async def _achunk(texts: List[str]) -> List[List[str]]:
+    """Chunks de cada texto con CHUNKING_ENABLED=1; sin chunking, cada texto es su único chunk."""
+    if not CHUNKING_ENABLED:
+        return [[text] for text in texts]
+    return await asyncio.to_thread(lambda: [chunk_text(text) for text in texts])
+
+
+def _chunk_offsets(pieces: List[List[str]]) -> List[int]:
+    """Posición del primer chunk de cada texto en la lista plana de chunks."""
+    offsets, total = [], 0
+    for chunks in pieces:
+        offsets.append(total)
+        total += len(chunks)
+    return offsets
+
+
+async def ainsert_chunked_documents(texts: List[str], embed: Callable[[List[str]], Awaitable[List[List[float]]]],
+                                    metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """ ==========================================================================================
+    Ingesta con chunking por tokens.
+    Args:
+        texts: Contenidos a guardar.
+        embed: Función async que embebe una lista de textos (ej. aget_embeddings_from_hf).
+            Recibe los chunks de todos los textos juntos, así el batching de hf_client los empaqueta.
+        metadata: Metadatos comunes del lote.
+    Returns:
+        {'document_ids', 'embeddings', 'chunks', 'failures', 'written_ids', 'written_embeddings'}:
+        por texto de entrada, el id del documento (el padre si se dividió), su embedding (el
+        promedio normalizado de sus chunks) y la cantidad de chunks; más las filas con embedding
+        escritas (para actualizar el índice ANN).
+    =========================================================================================== """
+    pieces = await asyncio.to_thread(lambda: [chunk_text(text) for text in texts])
+    flat = [chunk for chunks in pieces for chunk in chunks]
+    flat_embeddings, prepared = await asyncio.gather(embed(flat), aprepare_dual_write(flat))
+
+    metadata = metadata or build_metadata()
+    short = [i for i, chunks in enumerate(pieces) if len(chunks) == 1]
+    offsets = _chunk_offsets(pieces)
+
+    result = {"document_ids": [None] * len(texts), "embeddings": [None] * len(texts),
+              "chunks": [len(chunks) for chunks in pieces], "failures": [],
+              "written_ids": [], "written_embeddings": []}
+    written_texts: List[str] = []
+    async with async_connection() as conn:
+        # Textos que entran en el modelo: filas normales, con el INSERT multi-fila de siempre
+        if short:
+            rows = _build_rows([texts[i] for i in short], [flat_embeddings[offsets[i]] for i in short], metadata)
+            with timed("db_query"):
+                short_ids, short_failures = await _ainsert_rows(conn, rows)
+            for i, doc_id in zip(short, short_ids):
+                result["document_ids"][i] = doc_id
+                result["embeddings"][i] = flat_embeddings[offsets[i]]
+                if doc_id is not None:
+                    result["written_ids"].append(doc_id)
+                    result["written_embeddings"].append(flat_embeddings[offsets[i]])
+                    written_texts.append(texts[i])
+            result["failures"].extend({"index": short[f["index"]], "error": f["error"]} for f in short_failures)
+
+        # Textos largos: padre + chunks, todo o nada por documento
+        async with conn.cursor() as cur:
+            for i, chunks in enumerate(pieces):
+                if len(chunks) == 1:
+                    continue
+                embeddings = flat_embeddings[offsets[i]:offsets[i] + len(chunks)]
+                result["embeddings"][i] = pooled_embedding(embeddings)
+                await cur.execute("SAVEPOINT insert_chunked;")
+                try:
+                    with timed("db_query"):
+                        inserted = await _ainsert_chunked(cur, texts[i], chunks, embeddings, metadata)
+                    await cur.execute("RELEASE SAVEPOINT insert_chunked;")
+                except Exception as e:
+                    await cur.execute("ROLLBACK TO SAVEPOINT insert_chunked;")
+                    app_logger.error(f"Error saving chunked document {i} to Neon: {str(e)}")
+                    result["failures"].append({"index": i, "error": str(e)})
+                    continue
+                result["document_ids"][i] = inserted["id"]
+                result["written_ids"].extend(inserted["chunk_ids"])
+                result["written_embeddings"].extend(embeddings)
+                written_texts.extend(chunks)
+
+            await adual_write(cur, result["written_ids"], written_texts, prepared)
+        await conn.commit()
+    search_cache.invalidate()
+
+    result["failures"].sort(key=lambda failure: failure["index"])
+    return result
+
+
+async def _ainsert_chunked(cur, text: str, chunks: List[str], embeddings, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Inserta la fila padre (sin embedding) y sus chunks; retorna {'id', 'chunk_ids'}.
+    """
+    await cur.execute(insert_sql(_INSERT_TEMPLATE), (text, None, json.dumps({**metadata, "chunks": len(chunks)})))
+    parent_id = (await cur.fetchone())["id"]
+    return {"id": parent_id, "chunk_ids": await _ainsert_chunk_rows(cur, parent_id, chunks, embeddings, metadata)}
+
+
+async def _aupsert_chunked(cur, text: str, digest: str, chunks: List[str], embeddings, metadata: Dict[str, Any],
+                           on_conflict: str) -> Optional[Dict[str, Any]]:
+    """
+    Upsert de la fila padre por content_hash y alta de sus chunks; retorna {'id', 'updated',
+    'chunk_ids', 'removed_ids'}, o None si con "skip" otro request ya lo había insertado.
+    Con "update" los chunks anteriores se reemplazan.
+    """
+    sql = insert_sql(_UPSERT_TEMPLATE, content_hash=True, on_conflict=on_conflict,
+                     returning="id, (xmax <> 0) AS updated")
+    await cur.execute(sql, (text, None, json.dumps({**metadata, "chunks": len(chunks)}), digest))
+    parent = await cur.fetchone()
+    if parent is None:
+        return None
+    removed_ids = []
+    if parent["updated"]:
+        await cur.execute(_DELETE_CHUNKS_SQL, ([parent["id"]],))
+        removed_ids = [row["id"] for row in await cur.fetchall()]
+    chunk_ids = await _ainsert_chunk_rows(cur, parent["id"], chunks, embeddings, metadata)
+    return {"id": parent["id"], "updated": bool(parent["updated"]), "chunk_ids": chunk_ids, "removed_ids": removed_ids}
+
+
+async def _ainsert_chunk_rows(cur, parent_id: int, chunks: List[str], embeddings, metadata: Dict[str, Any]) -> List[int]:
+    metadata_json = json.dumps(metadata)
+    rows = [(chunk, literal, metadata_json, parent_id, index)
+            for index, (chunk, literal) in enumerate(zip(chunks, to_pgvector_literals(embeddings)))]
+    await cur.execute(insert_sql(",".join([_CHUNK_TEMPLATE] * len(rows)), chunk_columns=True),
+                      [value for row in rows for value in row])
+    return [row["id"] for row in await cur.fetchall()]
+
+
+async def _afetch_existing(conn, hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+    async with conn.cursor() as cur:
+        with timed("db_query"):
+            await cur.execute(_EXISTING_SQL, (hashes,))
+            rows = await cur.fetchall()
+            # Las filas padre de documentos en chunks no tienen embedding: se devuelve el de sus chunks
+            parents = [row["id"] for row in rows if row["embedding"] is None]
+            chunk_embeddings: Dict[int, List[List[float]]] = {}
+            if parents:
+                await cur.execute(_CHUNK_EMBEDDINGS_SQL, (parents,))
+                for row in await cur.fetchall():
+                    chunk_embeddings.setdefault(row["parent_id"], []).append(json.loads(row["embedding"]))
+    existing = {}
+    for row in rows:
+        # El literal de texto de pgvector ('[0.1,0.2,...]') es JSON válido
+        entry = {"id": row["id"], "status": "existing"}
+        if row["embedding"] is not None:
+            entry["embedding"] = json.loads(row["embedding"])
+        else:
+            embeddings = chunk_embeddings.get(row["id"], [])
+            entry["embedding"] = pooled_embedding(embeddings) if embeddings else None
+            entry["chunks"] = len(embeddings)
+        existing[row["content_hash"]] = entry
+    return existing
+
+
+async def _aupsert_rows(conn, rows: List[tuple], on_conflict: str) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+    """
+    INSERT ... ON CONFLICT (content_hash) por páginas. Retorna {hash: {'id', 'updated'}} de las
+    filas escritas y {hash: error} de las páginas que fallaron.
+    """
+    returned: Dict[str, Dict[str, Any]] = {}
+    errors: Dict[str, str] = {}
+    async with conn.cursor() as cur:
+        for start in range(0, len(rows), INSERT_PAGE_SIZE):
+            page = rows[start:start + INSERT_PAGE_SIZE]
+            # xmax <> 0 distingue una fila actualizada por ON CONFLICT de una insertada
+            sql = insert_sql(",".join([_UPSERT_TEMPLATE] * len(page)), content_hash=True, on_conflict=on_conflict,
+                             returning="id, content_hash, (xmax <> 0) AS updated")
+            await cur.execute("SAVEPOINT upsert_page;")
+            try:
+                await cur.execute(sql, [value for row in page for value in row])
+                for row in await cur.fetchall():
+                    returned[row["content_hash"]] = {"id": row["id"], "updated": bool(row["updated"])}
+                await cur.execute("RELEASE SAVEPOINT upsert_page;")
+            except Exception as e:
+                await cur.execute("ROLLBACK TO SAVEPOINT upsert_page;")
+                app_logger.error(f"Falló el upsert de la página {start // INSERT_PAGE_SIZE}: {str(e)}")
+                for row in page:
+                    errors[row[-1]] = str(e)
+    return returned, errors
+
+
+def _build_rows(texts: List[str], embeddings, metadata: Optional[Dict[str, Any]]) -> List[tuple]:
+    if len(texts) != len(embeddings):
+        raise ValueError(f"Se recibieron {len(texts)} textos y {len(embeddings)} embeddings")
+
+    metadata_json = json.dumps(metadata or build_metadata())
+    literals = to_pgvector_literals(embeddings)
+    return [(text, literal, metadata_json) for text, literal in zip(texts, literals)]
+
+
+def _insert_and_dual_write(conn, texts: List[str], rows: List[tuple],
+                           prepared: Optional[Dict[str, Any]]) -> Tuple[List[Optional[int]], List[Dict[str, Any]]]:
+    with timed("db_query"):
+        document_ids, failures = _insert_rows(conn, rows)
+    # Durante una migración de modelo también se escribe la columna nueva (model_migration.py)
+    with conn.cursor() as cur:
+        dual_write(cur, document_ids, texts, prepared)
+    return document_ids, failures
+
+
+async def _ainsert_and_dual_write(conn, texts: List[str], rows: List[tuple],
+                                  prepared: Optional[Dict[str, Any]]) -> Tuple[List[Optional[int]], List[Dict[str, Any]]]:
+    with timed("db_query"):
+        document_ids, failures = await _ainsert_rows(conn, rows)
+    async with conn.cursor() as cur:
+        await adual_write(cur, document_ids, texts, prepared)
+    return document_ids, failures
+
+
+def _insert_rows(conn, rows: List[tuple]) -> Tuple[List[Optional[int]], List[Dict[str, Any]]]:
+    document_ids = []
+    failures = []
+    with conn.cursor() as cur:
+        for start in range(0, len(rows), INSERT_PAGE_SIZE):
+            page = rows[start:start + INSERT_PAGE_SIZE]
+            cur.execute("SAVEPOINT insert_page;")
+            try:
+                # Un único INSERT por página; RETURNING respeta el orden de VALUES
+                returned = psycopg2.extras.execute_values(
+                    cur, _INSERT_SQL, page, template=_INSERT_TEMPLATE,
+                    page_size=len(page), fetch=True
+                )
+                cur.execute("RELEASE SAVEPOINT insert_page;")
+                document_ids.extend(row['id'] for row in returned)
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT insert_page;")
+                app_logger.warning(f"Falló el INSERT de la página {start // INSERT_PAGE_SIZE}, reintentando por fila: {str(e)}")
+                page_ids, page_failures = _insert_rows_one_by_one(cur, page, start)
+                document_ids.extend(page_ids)
+                failures.extend(page_failures)
+    return document_ids, failures
+
+
+def _insert_rows_one_by_one(cur, page: List[tuple], offset: int) -> Tuple[List[Optional[int]], List[Dict[str, Any]]]:
+    ids = []
+    failures = []
+    for i, row in enumerate(page):
+        cur.execute("SAVEPOINT insert_row;")
+        try:
+            cur.execute(insert_sql(_INSERT_TEMPLATE), row)
+            ids.append(cur.fetchone()['id'])
+            cur.execute("RELEASE SAVEPOINT insert_row;")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT insert_row;")
+            app_logger.error(f"Error saving document {offset + i} to Neon: {str(e)}")
+            ids.append(None)
+            failures.append({"index": offset + i, "error": str(e)})
+    return ids, failures
+
+
+async def _ainsert_rows(conn, rows: List[tuple]) -> Tuple[List[Optional[int]], List[Dict[str, Any]]]:
+    document_ids = []
+    failures = []
+    async with conn.cursor() as cur:
+        for start in range(0, len(rows), INSERT_PAGE_SIZE):
+            page = rows[start:start + INSERT_PAGE_SIZE]
+            sql = insert_sql(",".join([_INSERT_TEMPLATE] * len(page)))
+            params = [value for row in page for value in row]
+            await cur.execute("SAVEPOINT insert_page;")
+            try:
+                await cur.execute(sql, params)
+                returned = await cur.fetchall()
+                await cur.execute("RELEASE SAVEPOINT insert_page;")
+                document_ids.extend(row['id'] for row in returned)
+            except Exception as e:
+                await cur.execute("ROLLBACK TO SAVEPOINT insert_page;")
+                app_logger.warning(f"Falló el INSERT de la página {start // INSERT_PAGE_SIZE}, reintentando por fila: {str(e)}")
+                for i, row in enumerate(page):
+                    await cur.execute("SAVEPOINT insert_row;")
+                    try:
+                        await cur.execute(insert_sql(_INSERT_TEMPLATE), row)
+                        document_ids.append((await cur.fetchone())['id'])
+                        await cur.execute("RELEASE SAVEPOINT insert_row;")
+                    except Exception as row_error:
+                        await cur.execute("ROLLBACK TO SAVEPOINT insert_row;")
+                        app_logger.error(f"Error saving document {start + i} to Neon: {str(row_error)}")
+                        document_ids.append(None)
+                        failures.append({"index": start + i, "error": str(row_error)})
+    return document_ids, failures
@@ -0,0 +1,146 @@
+import os
+import asyncio
+import logging
+import threading
+from typing import List
+import numpy as np
+from constants import MODEL_NAME, MODEL_DIMENSIONS
+
+"""
+Backends de embeddings intercambiables, seleccionados con EMBEDDING_BACKEND:
+
+- "hf" (default): Inference API de Hugging Face (HFInferenceBackend, en hf_client.py).
+- "local": el mismo modelo (BAAI/bge-small-en-v1.5) corriendo en proceso con ONNX Runtime
+  sobre CPU (LocalOnnxBackend). Requiere las dependencias de requirements-local.txt.
+
+La caché, el coalescer y el envío en chunks de hf_client funcionan igual con cualquier backend.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "hf")
+
+# ============================================>
+# Configuración del backend local
+# ============================================>
+LOCAL_ONNX_MODEL_PATH = os.getenv("LOCAL_ONNX_MODEL_PATH")
+LOCAL_ONNX_QUANTIZE = os.getenv("LOCAL_ONNX_QUANTIZE", "1") == "1"
+LOCAL_ONNX_THREADS = int(os.getenv("LOCAL_ONNX_THREADS", str(os.cpu_count() or 1)))
+LOCAL_BATCH_SIZE = int(os.getenv("LOCAL_BATCH_SIZE", "32"))
+LOCAL_MAX_LENGTH = int(os.getenv("LOCAL_MAX_LENGTH", "512"))
+LOCAL_MODEL_CACHE_DIR = os.getenv("LOCAL_MODEL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "embeddings-back"))
+
+
+class EmbeddingBackend:
+    """
+    Interfaz de un backend: embed() síncrono y aembed() async.
+    Por defecto aembed() corre embed() en un thread.
+    """
+    name = "base"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed, texts)
+
+
+# ============================================>
+# Backend local: ONNX Runtime en CPU
+# ============================================>
+class LocalOnnxBackend(EmbeddingBackend):
+    """
+    Encoder bge-small en proceso con ONNX Runtime.
+
+    - Modelo int8 cuantizado dinámicamente (LOCAL_ONNX_QUANTIZE=1) a partir del ONNX
+      publicado en el repo del modelo, o el archivo indicado en LOCAL_ONNX_MODEL_PATH.
+    - Los textos se ordenan por cantidad de tokens y se procesan en batches de
+      LOCAL_BATCH_SIZE con padding dinámico (solo hasta el más largo de cada batch).
+    - Pooling CLS + normalización L2, igual que el modelo sentence-transformers
+      servido por la Inference API, por lo que los vectores son compatibles con vector(384).
+    """
+    name = "local"
+
+    def __init__(self, model_name: str = MODEL_NAME, dimensions: int = MODEL_DIMENSIONS):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+            from huggingface_hub import hf_hub_download
+        except ImportError as e:
+            raise RuntimeError("EMBEDDING_BACKEND=local requiere onnxruntime y tokenizers (pip install -r requirements-local.txt)") from e
+
+        self.model_name = model_name
+        self.dimensions = dimensions
+        self.tokenizer = Tokenizer.from_file(hf_hub_download(repo_id=model_name, filename="tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=LOCAL_MAX_LENGTH)
+        self.tokenizer.no_padding()
+
+        model_path = LOCAL_ONNX_MODEL_PATH or hf_hub_download(repo_id=model_name, filename="onnx/model.onnx")
+        if LOCAL_ONNX_QUANTIZE and not LOCAL_ONNX_MODEL_PATH:
+            model_path = self._quantized_model(model_path)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = LOCAL_ONNX_THREADS
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        # Una inferencia a la vez: cada una ya usa LOCAL_ONNX_THREADS threads
+        self._lock = threading.Lock()
+
+        produced = len(self.embed(["dimension check"])[0])
+        if produced != dimensions:
+            raise RuntimeError(f"El modelo local produce {produced} dimensiones y la columna espera {dimensions}")
+        app_logger.info(f"Backend local listo: {model_path} ({LOCAL_ONNX_THREADS} threads)")
+        print(f"[OK] Backend local ONNX inicializado: {model_path}")
+
+    def _quantized_model(self, model_path: str) -> str:
+        """
+        Genera (una sola vez) la versión int8 del modelo y retorna su ruta.
+        """
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        os.makedirs(LOCAL_MODEL_CACHE_DIR, exist_ok=True)
+        quantized_path = os.path.join(LOCAL_MODEL_CACHE_DIR, self.model_name.replace("/", "__") + ".int8.onnx")
+        if not os.path.exists(quantized_path):
+            app_logger.info(f"Cuantizando {model_path} a int8 en {quantized_path}")
+            quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        return quantized_path
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        """
+        Retorna una matriz float32 (len(texts), dimensions) en el orden de entrada.
+        """
+        encodings = self.tokenizer.encode_batch(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(encodings[i].ids))
+        output = None
+
+        for start in range(0, len(order), LOCAL_BATCH_SIZE):
+            batch = order[start:start + LOCAL_BATCH_SIZE]
+            max_len = max(len(encodings[i].ids) for i in batch)
+            input_ids = np.zeros((len(batch), max_len), dtype=np.int64)
+            attention_mask = np.zeros((len(batch), max_len), dtype=np.int64)
+            for row, i in enumerate(batch):
+                ids = encodings[i].ids
+                input_ids[row, :len(ids)] = ids
+                attention_mask[row, :len(ids)] = 1
+
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            with self._lock:
+                hidden = self.session.run(None, feeds)[0]
+
+            cls = hidden[:, 0, :]
+            cls = cls / np.linalg.norm(cls, axis=1, keepdims=True).clip(min=1e-12)
+            if output is None:
+                output = np.empty((len(texts), cls.shape[1]), dtype=np.float32)
+            output[batch] = cls
+
+        if output is None:
+            return np.empty((0, self.dimensions), dtype=np.float32)
+
+        return output
@@ -0,0 +1,238 @@
+import os
+import time
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict
+from constants import MODEL_NAME
+
+"""
+Caché de embeddings en capas, ubicada delante de get_embeddings_from_hf (hf_client.py).
+
+Capa 1 (memoria): LRU en proceso, acotada por tamaño aproximado en bytes y con TTL.
+Capa 2 (persistente, opcional): busca en la tabla `documents` filas con el mismo contenido
+(por hash md5 del texto) generadas con el mismo modelo, y reutiliza su embedding.
+
+La clave de la capa en memoria es (MODEL_NAME, sha256 del texto normalizado).
+"""
+
+app_logger = logging.getLogger(__name__)
+
+# ============================================>
+# Configuración (variables de entorno)
+# ============================================>
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+EMBEDDING_CACHE_PERSISTENT = os.getenv("EMBEDDING_CACHE_PERSISTENT", "0") == "1"
+
+# Costo aproximado en memoria de un float de Python dentro de una lista (objeto + puntero)
+_BYTES_PER_FLOAT = 32
+_ENTRY_OVERHEAD = 200
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normaliza el texto para la clave de caché: recorta extremos y colapsa espacios.
+    El tokenizador del modelo ignora esas diferencias, por lo que el embedding es el mismo.
+    """
+    return " ".join(text.split())
+
+
+def cache_key(text: str, model: str = MODEL_NAME) -> str:
+    """
+    Clave de caché para un texto: (modelo, sha256 del texto normalizado).
+    """
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}:{digest}"
+
+
+def _entry_size(key: str, vector: List[float]) -> int:
+    return _ENTRY_OVERHEAD + len(key) + len(vector) * _BYTES_PER_FLOAT
+
+
+# ============================================>
+# Capa 1: LRU en memoria con límite de bytes y TTL
+# ============================================>
+class EmbeddingCache:
+    """
+    LRU thread-safe de embeddings. Cada entrada guarda (vector, expira_en, tamaño).
+    Al superar max_bytes se desalojan las entradas menos usadas recientemente.
+    """
+
+    def __init__(self, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES, ttl_seconds: float = EMBEDDING_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.upstream_calls = 0
+        self.upstream_texts = 0
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """
+        Retorna un dict {clave: vector} con las claves encontradas y vigentes.
+        Cuenta un hit o un miss por cada clave solicitada (incluyendo repetidas).
+        """
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                if key in found:
+                    self.hits += 1
+                    continue
+                entry = self._entries.get(key)
+                if entry is None:
+                    self.misses += 1
+                    continue
+                vector, expires_at, size = entry
+                if expires_at < now:
+                    del self._entries[key]
+                    self._bytes -= size
+                    self.expirations += 1
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = vector
+                self.hits += 1
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        """
+        Inserta o reemplaza entradas y desaloja por LRU hasta respetar max_bytes.
+        """
+        if self.max_bytes <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for key, vector in items.items():
+                size = _entry_size(key, vector)
+                if size > self.max_bytes:
+                    continue
+                previous = self._entries.pop(key, None)
+                if previous is not None:
+                    self._bytes -= previous[2]
+                self._entries[key] = (vector, expires_at, size)
+                self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, _, size) = self._entries.popitem(last=False)
+                self._bytes -= size
+                self.evictions += 1
+
+    def record_persistent_hits(self, count: int) -> None:
+        """
+        Convierte `count` misses de memoria en hits de la capa persistente.
+        """
+        with self._lock:
+            self.misses -= count
+            self.persistent_hits += count
+
+    def record_upstream(self, count: int) -> None:
+        """
+        Registra una llamada al upstream (HF) con `count` textos no cacheados.
+        """
+        with self._lock:
+            self.upstream_calls += 1
+            self.upstream_texts += count
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "memory_hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.persistent_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "upstream_calls": self.upstream_calls,
+                "upstream_texts": self.upstream_texts,
+                "persistent_enabled": EMBEDDING_CACHE_PERSISTENT,
+            }
+
+
+embedding_cache = EmbeddingCache()
+
+
+# ============================================>
+# Capa 2: búsqueda en la tabla documents por hash de contenido
+# ============================================>
+_PERSISTENT_SQL = """
+    SELECT DISTINCT ON (md5(content)) md5(content) AS content_md5, embedding::text AS embedding
+    FROM documents
+    WHERE md5(content) = ANY(%s) AND metadata->>'model' = %s AND embedding IS NOT NULL;
+"""
+
+
+def lookup_persistent(texts: List[str], model: str = MODEL_NAME) -> Dict[str, List[float]]:
+    """
+    Busca en `documents` embeddings ya calculados para estos textos con el mismo modelo.
+    La comparación es por md5(content) (ver sql/001_content_md5_index.sql para el índice).
+    Retorna {texto: vector}. Ante cualquier error retorna {} y se sigue hacia HF.
+    """
+    if not EMBEDDING_CACHE_PERSISTENT or not texts:
+        return {}
+
+    by_md5 = _md5_index(texts)
+    try:
+        from database import connection
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(_PERSISTENT_SQL, (list(by_md5.keys()), model))
+                rows = cur.fetchall()
+    except Exception as e:
+        app_logger.warning(f"Cache persistente no disponible: {str(e)}")
+        return {}
+
+    return _rows_to_vectors(rows, by_md5)
+
+
+async def alookup_persistent(texts: List[str], model: str = MODEL_NAME) -> Dict[str, List[float]]:
+    """
+    Variante async de lookup_persistent (pool async de Postgres).
+    """
+    if not EMBEDDING_CACHE_PERSISTENT or not texts:
+        return {}
+
+    by_md5 = _md5_index(texts)
+    try:
+        from database_async import async_connection
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(_PERSISTENT_SQL, (list(by_md5.keys()), model))
+                rows = await cur.fetchall()
+    except Exception as e:
+        app_logger.warning(f"Cache persistente no disponible: {str(e)}")
+        return {}
+
+    return _rows_to_vectors(rows, by_md5)
+
+
+def _md5_index(texts: List[str]) -> Dict[str, str]:
+    return {hashlib.md5(t.encode("utf-8")).hexdigest(): t for t in texts}
+
+
+def _rows_to_vectors(rows, by_md5: Dict[str, str]) -> Dict[str, List[float]]:
+    return {by_md5[row['content_md5']]: json.loads(row['embedding']) for row in rows}
+
+
+def get_cache_stats() -> Dict[str, float]:
+    """
+    Contadores de la caché de embeddings (hits, misses, tamaño, etc.).
+    """
+    return embedding_cache.stats()
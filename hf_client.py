@@ -1,17 +1,31 @@
 import os
+import time
+import asyncio
 import logging
-from typing import List
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Any
 from fastapi import HTTPException
-from huggingface_hub import InferenceClient
-from constants import MODEL_NAME
+from huggingface_hub import InferenceClient, AsyncInferenceClient
+from constants import MODEL_NAME, MODEL_DIMENSIONS
+from embedding_cache import embedding_cache, cache_key, lookup_persistent, alookup_persistent
+from embedding_backends import EmbeddingBackend, LocalOnnxBackend, EMBEDDING_BACKEND
+from metrics import timed
+from resilience import ResilientBackend, classify_error, retry_delay
 
 """
-La función get_embeddings_from_hf se invoca desde el archivo main.py en varios endpoints de la API 
+La función get_embeddings_from_hf se invoca desde el archivo main.py en varios endpoints de la API
 FastAPI:
 Endpoint /health: Se usa para verificar la salud del modelo con un texto de prueba simple (["test"]).
 Endpoint /embedding: Para generar un embedding de UN SOLO texto proporcionado por el usuario.
 Endpoint /embeddings: Para generar embeddings de UNA LISTA de textos enviados en la solicitud.
 Endpoint /search: Para generar el embedding del texto de consulta y buscar documentos similares en la base de datos.
+
+Los endpoints de main.py son async y usan aget_embeddings_from_hf (AsyncInferenceClient).
+get_embeddings_from_hf es la variante síncrona para scripts y workers en threads.
+El backend que calcula los embeddings (HF remoto o ONNX local) se elige con
+EMBEDDING_BACKEND (ver embedding_backends.py).
 """
 
 # ============================================>
@@ -31,85 +45,575 @@ app_logger = logging.getLogger(__name__)
 # Inicializar cliente de Hugging Face
 # ============================================>
 HF_TOKEN = os.getenv("HF_TOKEN")
-if not HF_TOKEN:
+if EMBEDDING_BACKEND == "hf" and not HF_TOKEN:
     app_logger.error("HF_TOKEN environment variable is not set!")
     raise ValueError("HF_TOKEN environment variable is required")
 
 app_logger.info(f"HF Token loaded: {HF_TOKEN[:10]}..." if HF_TOKEN else "No token")
-print(f"[OK] HF Token cargado correctamente")
+print(f"[OK] Backend de embeddings: {EMBEDDING_BACKEND}")
 print(f"[OK] Modelo: {MODEL_NAME}")
 
-# Inicializar InferenceClient
+# URL alternativa de la Inference API (endpoint dedicado o el servidor falso de
+# benchmarks/fake_hf_server.py); vacía = API pública de HF
+HF_BASE_URL = os.getenv("HF_BASE_URL", "").strip()
+HF_TIMEOUT_SECONDS = float(os.getenv("HF_TIMEOUT_SECONDS", "30"))
+# Backend secundario al que se pasa cuando el primario falla o su circuito está abierto
+HF_FALLBACK_BACKEND = os.getenv("HF_FALLBACK_BACKEND", "").strip()
+HF_FALLBACK_BASE_URL = os.getenv("HF_FALLBACK_BASE_URL", "").strip()
+
+
+class HFInferenceBackend(EmbeddingBackend):
+    """
+    Backend remoto: Inference API de Hugging Face con InferenceClient (síncrono)
+    y AsyncInferenceClient (compartido por todos los requests async).
+    """
+    name = "hf"
+
+    def __init__(self, token: str, model_name: str = MODEL_NAME, base_url: str = "",
+                 timeout: float = HF_TIMEOUT_SECONDS):
+        self.model_name = model_name
+        # Con una URL como `model`, InferenceClient le hace el POST directamente
+        self.target = base_url or model_name
+        self.client = InferenceClient(api_key=token, timeout=timeout)
+        self.async_client = AsyncInferenceClient(api_key=token, timeout=timeout)
+        print(f"[OK] InferenceClient inicializado correctamente")
+
+    def embed(self, texts: List[str]):
+        return self.client.feature_extraction(text=texts, model=self.target)
+
+    async def aembed(self, texts: List[str]):
+        return await self.async_client.feature_extraction(text=texts, model=self.target)
+
+    async def close(self) -> None:
+        close = getattr(self.async_client, "close", None)
+        if close is not None:
+            await close()
+
+
+def _create_backend(name: str, model_name: str = MODEL_NAME, dimensions: int = MODEL_DIMENSIONS,
+                    base_url: str = "") -> EmbeddingBackend:
+    if name == "hf":
+        return HFInferenceBackend(HF_TOKEN, model_name, base_url)
+    if name == "local":
+        return LocalOnnxBackend(model_name, dimensions)
+    raise ValueError(f"EMBEDDING_BACKEND desconocido: {name}")
+
+
+# Inicializar el backend seleccionado
 try:
-    client = InferenceClient(api_key=HF_TOKEN)
-    print(f"[OK] InferenceClient inicializado correctamente")
+    backend = ResilientBackend(
+        _create_backend(EMBEDDING_BACKEND, base_url=HF_BASE_URL),
+        _create_backend(HF_FALLBACK_BACKEND, base_url=HF_FALLBACK_BASE_URL) if HF_FALLBACK_BACKEND else None,
+    )
 except Exception as e:
-    print(f"[ERROR] Error inicializando InferenceClient: {str(e)}")
+    print(f"[ERROR] Error inicializando el backend {EMBEDDING_BACKEND}: {str(e)}")
     raise
 
 
 # ============================================>
-# generar el embedding - FUNCIÓN SÍNCRONA
+# Coalescer: agrupa pedidos concurrentes en un solo batch
 # ============================================>
-def get_embeddings_from_hf(texts: List[str]) -> List[List[float]]:
+HF_COALESCE_WINDOW_MS = float(os.getenv("HF_COALESCE_WINDOW_MS", "10"))
+HF_COALESCE_MAX_BATCH = int(os.getenv("HF_COALESCE_MAX_BATCH", "32"))
+
+
+class RequestCoalescer:
+    """
+    Junta los textos que llegan desde distintos threads dentro de una ventana de tiempo
+    (window_ms) o hasta completar max_batch textos, y los envía a HF en una sola llamada.
+
+    No usa un thread de fondo: el primer pedido de cada ventana actúa como "líder",
+    espera la ventana (o a que el batch se llene) y despacha el batch de todos.
+    Así funciona igual en entornos serverless donde los threads de fondo se congelan.
+    """
+
+    def __init__(self, send, window_ms: float = HF_COALESCE_WINDOW_MS, max_batch: int = HF_COALESCE_MAX_BATCH):
+        self._send = send
+        self.window_ms = window_ms
+        self.max_batch = max(max_batch, 1)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_texts = 0
+        self._leader_active = False
+        self._batch_full = threading.Event()
+        self._fill_ratios = deque(maxlen=1000)
+        self._stats = {"requests": 0, "coalesced_requests": 0, "batches": 0, "texts": 0}
+
+    def submit(self, texts: List[str]) -> List[List[float]]:
+        """
+        Retorna los embeddings de `texts`, posiblemente calculados junto con otros pedidos.
+        Los pedidos con max_batch textos o más se envían directamente.
+        """
+        if not self._should_coalesce(texts):
+            return self._send(texts)
+
+        future = Future()
+        with self._lock:
+            is_leader, batch_full = self._enqueue(texts, future, threading.Event)
+
+        if is_leader:
+            # Aunque la espera se interrumpa, la ventana se cierra y los pedidos se resuelven:
+            # si no, _leader_active queda en True y los pedidos siguientes esperan para siempre
+            try:
+                batch_full.wait(self.window_ms / 1000)
+            finally:
+                groups = self._take_groups()
+                try:
+                    for group, unique in groups:
+                        self._send_group(group, unique)
+                finally:
+                    for group, _ in groups:
+                        self._fail(group, RuntimeError("El batch agrupado se interrumpió antes de enviarse"))
+
+        return future.result()
+
+    def _should_coalesce(self, texts: List[str]) -> bool:
+        with self._lock:
+            self._stats["requests"] += 1
+        return self.window_ms > 0 and len(texts) < self.max_batch
+
+    def _enqueue(self, texts: List[str], future, event_factory) -> tuple:
+        """
+        Agrega un pedido a la ventana actual. Retorna (es_lider, evento_batch_lleno).
+        Llamar con el lock tomado.
+        """
+        self._stats["coalesced_requests"] += 1
+        self._pending.append((texts, future))
+        self._pending_texts += len(texts)
+        is_leader = not self._leader_active
+        if is_leader:
+            self._leader_active = True
+            self._batch_full = event_factory()
+        if self._pending_texts >= self.max_batch:
+            self._batch_full.set()
+        return is_leader, self._batch_full
+
+    def _take_groups(self) -> List[tuple]:
+        """
+        Cierra la ventana actual y divide sus pedidos en batches de hasta max_batch
+        textos. Retorna [(pedidos, textos_sin_repetir)].
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+            self._pending_texts = 0
+            self._leader_active = False
+
+        groups = []
+        group = []
+        group_texts = 0
+        for texts, future in pending:
+            if group and group_texts + len(texts) > self.max_batch:
+                groups.append(group)
+                group = []
+                group_texts = 0
+            group.append((texts, future))
+            group_texts += len(texts)
+        if group:
+            groups.append(group)
+
+        result = []
+        for group in groups:
+            unique = list(dict.fromkeys(t for texts, _ in group for t in texts))
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["texts"] += len(unique)
+                self._fill_ratios.append(len(unique) / self.max_batch)
+            result.append((group, unique))
+        return result
+
+    def _send_group(self, group: List[tuple], unique: List[str]) -> None:
+        try:
+            vectors = dict(zip(unique, self._send(unique)))
+        except Exception as e:
+            self._fail(group, e)
+            return
+        self._resolve(group, vectors)
+
+    @staticmethod
+    def _resolve(group: List[tuple], vectors: Dict[str, List[float]]) -> None:
+        for texts, future in group:
+            # Un pedido cancelado mientras esperaba ya tiene su future resuelto
+            if not future.done():
+                future.set_result([vectors[t] for t in texts])
+
+    @staticmethod
+    def _fail(group: List[tuple], error: Exception) -> None:
+        for _, future in group:
+            if not future.done():
+                future.set_exception(error)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ratios = sorted(self._fill_ratios)
+            batches = self._stats["batches"]
+            return {
+                **self._stats,
+                "window_ms": self.window_ms,
+                "max_batch": self.max_batch,
+                "upstream_calls_saved": self._stats["coalesced_requests"] - batches if batches else 0,
+                "avg_texts_per_batch": round(self._stats["texts"] / batches, 2) if batches else 0.0,
+                "fill_ratio_avg": round(sum(ratios) / len(ratios), 4) if ratios else 0.0,
+                "fill_ratio_p50": round(ratios[len(ratios) // 2], 4) if ratios else 0.0,
+                "fill_ratio_last": round(self._fill_ratios[-1], 4) if ratios else 0.0,
+            }
+
+
+class AsyncRequestCoalescer(RequestCoalescer):
+    """
+    Variante asyncio del coalescer para los endpoints async: misma ventana, mismo
+    tamaño máximo y mismas métricas, pero el líder espera con asyncio sin bloquear el loop.
     """
-    Genera embeddings usando InferenceClient.
-    FUNCIÓN SÍNCRONA (no async) para evitar problemas con FastAPI.
-    
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Referencias a los envíos en curso (el loop solo guarda referencias débiles)
+        self._tasks = set()
+
+    async def submit(self, texts: List[str]) -> List[List[float]]:
+        if not self._should_coalesce(texts):
+            return await self._send(texts)
+
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            is_leader, batch_full = self._enqueue(texts, future, asyncio.Event)
+
+        if is_leader:
+            try:
+                await asyncio.wait_for(batch_full.wait(), self.window_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                # Los envíos son tareas propias y no del líder: si el líder se cancela (cliente
+                # desconectado, timeout) la ventana se cierra igual y los demás pedidos reciben
+                # su resultado
+                for group, unique in self._take_groups():
+                    task = asyncio.ensure_future(self._send_group(group, unique))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+        return await future
+
+    async def _send_group(self, group: List[tuple], unique: List[str]) -> None:
+        try:
+            vectors = dict(zip(unique, await self._send(unique)))
+        except Exception as e:
+            self._fail(group, e)
+            return
+        except BaseException:
+            self._fail(group, RuntimeError("El envío del batch agrupado se canceló"))
+            raise
+        self._resolve(group, vectors)
+
+
+def get_coalescer_stats() -> Dict[str, Any]:
+    """
+    Métricas del coalescer: ventana, tamaño máximo, batches enviados y su llenado.
+    """
+    return {"async": async_coalescer.stats(), "sync": coalescer.stats()}
+
+
+# ============================================>
+# Caché: separar textos cacheados de los que hay que pedir a HF
+# ============================================>
+def _split_cached(texts: List[str]) -> tuple:
+    """
+    Retorna (claves, encontrados, faltantes) donde faltantes es {clave: texto} sin repetidos.
+    """
+    keys = [cache_key(t) for t in texts]
+    found = embedding_cache.get_many(keys)
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    return keys, found, missing
+
+
+def _resolve_persisted(keys: List[str], found: Dict, missing: Dict, persisted: Dict[str, List[float]]) -> None:
+    """
+    Mueve de `missing` a `found` los textos encontrados en la capa persistente.
+    """
+    if not persisted:
+        return
+    resolved = {}
+    for key, text in list(missing.items()):
+        if text in persisted:
+            resolved[key] = persisted[text]
+            del missing[key]
+    embedding_cache.put_many(resolved)
+    embedding_cache.record_persistent_hits(sum(1 for k in keys if k in resolved))
+    found.update(resolved)
+
+
+def _store_fresh(found: Dict, missing: Dict, upstream: List[List[float]]) -> None:
+    fresh = dict(zip(missing.keys(), upstream))
+    embedding_cache.put_many(fresh)
+    found.update(fresh)
+
+
+# ============================================>
+# generar el embedding con caché - FUNCIÓN SÍNCRONA
+# ============================================>
+def get_embeddings_from_hf(texts: List[str], use_cache: bool = True) -> List[List[float]]:
+    """
+    Genera embeddings usando la caché en capas (embedding_cache.py) y, para los
+    textos no cacheados, InferenceClient.
+    FUNCIÓN SÍNCRONA: la usan scripts y workers que corren en threads.
+
+    Solo los misses se envían a HF (sin repetidos) y el resultado respeta el orden original.
+
     Args:
         texts: Lista de strings para convertir a embeddings
-        
+        use_cache: Si es False se consulta siempre a HF (por ejemplo en /health)
+
     Returns:
         Lista de embeddings (cada uno es una lista de floats)
     """
-    print(f"\n[DEBUG] Requesting embeddings for {len(texts)} texts")
-    print(f"[DEBUG] Model: {MODEL_NAME}")
-    
-    app_logger.info(f"Requesting embeddings for {len(texts)} texts to model {MODEL_NAME}")
-    
+    if not use_cache:
+        return _request_embeddings(texts)
+
+    keys, found, missing = _split_cached(texts)
+    if missing:
+        _resolve_persisted(keys, found, missing, lookup_persistent(list(missing.values())))
+    if missing:
+        _store_fresh(found, missing, coalescer.submit(list(missing.values())))
+    return [list(found[key]) for key in keys]
+
+
+# ============================================>
+# generar el embedding con caché - FUNCIÓN ASYNC
+# ============================================>
+async def aget_embeddings_from_hf(texts: List[str], use_cache: bool = True) -> List[List[float]]:
+    """
+    Variante async de get_embeddings_from_hf: misma caché, pero la capa persistente usa
+    el pool async de Postgres y los misses se envían con AsyncInferenceClient, sin
+    ocupar un thread del threadpool mientras se espera a HF.
+    """
+    if not use_cache:
+        return await _arequest_embeddings(texts)
+
+    keys, found, missing = _split_cached(texts)
+    if missing:
+        _resolve_persisted(keys, found, missing, await alookup_persistent(list(missing.values())))
+    if missing:
+        _store_fresh(found, missing, await async_coalescer.submit(list(missing.values())))
+    return [list(found[key]) for key in keys]
+
+
+async def arefresh_embeddings(texts: List[str]) -> List[List[float]]:
+    """
+    Vuelve a pedir los embeddings al backend sin leer la caché y reemplaza las entradas
+    cacheadas de esos textos (re-embed de documentos guardados, document_bulk.py).
+    """
+    upstream = await async_coalescer.submit(texts)
+    embedding_cache.put_many({cache_key(text): vector for text, vector in zip(texts, upstream)})
+    return upstream
+
+
+# ============================================>
+# División en chunks y envío concurrente
+# ============================================>
+HF_CHUNK_SIZE = int(os.getenv("HF_CHUNK_SIZE", "64"))
+HF_CHUNK_MAX_TOKENS = int(os.getenv("HF_CHUNK_MAX_TOKENS", "8192"))
+HF_MAX_CONCURRENCY = int(os.getenv("HF_MAX_CONCURRENCY", "4"))
+# Backoff, jitter y espera de carga del modelo en resilience.py
+HF_CHUNK_RETRIES = int(os.getenv("HF_CHUNK_RETRIES", "2"))
+# El modelo trunca en 512 tokens: un texto nunca aporta más que eso a un batch
+_MODEL_MAX_TOKENS = 512
+
+_chunk_executor = ThreadPoolExecutor(max_workers=max(HF_MAX_CONCURRENCY, 1), thread_name_prefix="hf-chunk")
+_async_chunk_semaphore = None
+
+
+def _estimate_tokens(text: str) -> int:
+    """
+    Estimación barata de tokens (~4 caracteres por token), acotada al máximo del modelo.
+    """
+    return min(len(text) // 4 + 2, _MODEL_MAX_TOKENS)
+
+
+def _split_chunks(texts: List[str]) -> List[List[str]]:
+    """
+    Divide los textos en chunks consecutivos de hasta HF_CHUNK_SIZE textos y
+    HF_CHUNK_MAX_TOKENS tokens estimados.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        tokens = _estimate_tokens(text)
+        if current and (len(current) >= HF_CHUNK_SIZE or current_tokens + tokens > HF_CHUNK_MAX_TOKENS):
+            chunks.append(current)
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _retry_delay(error: HTTPException, attempt: int, size: int, started: float):
+    """
+    Retorna la espera antes del próximo intento, o None si el error no se reintenta.
+    """
+    delay = retry_delay(error, attempt, time.monotonic() - started, HF_CHUNK_RETRIES)
+    if delay is not None:
+        app_logger.warning(f"Chunk de {size} textos falló con {error.status_code}, reintento {attempt + 1} en {delay:.2f}s")
+    return delay
+
+
+def _request_with_retries(texts: List[str]) -> List[List[float]]:
+    """
+    Envía un chunk a HF reintentando los errores transitorios con backoff exponencial y jitter.
+    """
+    attempt = 0
+    started = time.monotonic()
+    while True:
+        try:
+            return _request_embeddings(texts)
+        except HTTPException as e:
+            delay = _retry_delay(e, attempt, len(texts), started)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+
+
+async def _arequest_with_retries(texts: List[str]) -> List[List[float]]:
+    attempt = 0
+    started = time.monotonic()
+    while True:
+        try:
+            async with _async_chunk_semaphore:
+                return await _arequest_embeddings(texts)
+        except HTTPException as e:
+            delay = _retry_delay(e, attempt, len(texts), started)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def _request_embeddings_chunked(texts: List[str]) -> List[List[float]]:
+    """
+    Envía los textos a HF divididos en chunks, con hasta HF_MAX_CONCURRENCY chunks en
+    paralelo, y une los resultados en el orden original. Un lote de 2500 textos tarda
+    lo que el chunk más lento en lugar de una sola llamada gigante que expira.
+    """
+    chunks = _split_chunks(texts)
+    if len(chunks) == 1:
+        return _request_with_retries(chunks[0])
+
+    app_logger.info(f"Enviando {len(texts)} textos en {len(chunks)} chunks (concurrencia {HF_MAX_CONCURRENCY})")
+    futures = [_chunk_executor.submit(_request_with_retries, chunk) for chunk in chunks]
+    results = []
     try:
-        print(f"[DEBUG] Llamando a client.feature_extraction()...")
-        
-        # Llamada directa síncrona
-        result = client.feature_extraction(
-            text=texts,
-            model=MODEL_NAME
-        )
-        
-        print(f"[SUCCESS] Got embeddings")
-        print(f"[DEBUG] Result type: {type(result)}")
-        
-        # Convertir resultado a lista si es necesario
-        if hasattr(result, 'tolist'):
-            result = result.tolist()
-        
-        if isinstance(result, list):
-            print(f"[DEBUG] Result length: {len(result)}")
-            if len(result) > 0 and isinstance(result[0], list):
-                print(f"[DEBUG] First embedding length: {len(result[0])}")
-        
-        app_logger.info(f"Successfully got embeddings")
-        
-        return result
-        
+        for future in futures:
+            results.extend(future.result())
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
+    return results
+
+
+async def _arequest_embeddings_chunked(texts: List[str]) -> List[List[float]]:
+    """
+    Variante async: los chunks se envían con asyncio.gather y un semáforo global
+    limita a HF_MAX_CONCURRENCY las llamadas simultáneas a HF.
+    """
+    global _async_chunk_semaphore
+    if _async_chunk_semaphore is None:
+        _async_chunk_semaphore = asyncio.Semaphore(max(HF_MAX_CONCURRENCY, 1))
+
+    chunks = _split_chunks(texts)
+    tasks = [asyncio.ensure_future(_arequest_with_retries(chunk)) for chunk in chunks]
+    try:
+        chunk_results = await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        raise
+    return [vector for chunk in chunk_results for vector in chunk]
+
+
+# ============================================>
+# llamada directa al backend (sin caché) - FUNCIÓN SÍNCRONA
+# ============================================>
+def _request_embeddings(texts: List[str]) -> List[List[float]]:
+    """
+    Llama al backend configurado (client.feature_extraction() en HF) con la lista de textos recibida.
+    Los errores se traducen a HTTPException (503 modelo cargando, 504 timeout, 500 otros).
+    """
+    embedding_cache.record_upstream(len(texts))
+    app_logger.debug("Requesting embeddings for %d texts to model %s (backend %s)", len(texts), MODEL_NAME, backend.name)
+
+    try:
+        with timed("hf_call"):
+            result = backend.embed(texts)
+        return _to_embedding_list(result)
+
+    except Exception as e:
+        raise _to_http_exception(e)
+
+
+# ============================================>
+# llamada directa al backend (sin caché) - FUNCIÓN ASYNC
+# ============================================>
+async def _arequest_embeddings(texts: List[str]) -> List[List[float]]:
+    """
+    Igual que _request_embeddings pero con backend.aembed() (AsyncInferenceClient en HF).
+    """
+    embedding_cache.record_upstream(len(texts))
+    app_logger.debug("Requesting embeddings for %d texts to model %s (backend %s, async)", len(texts), MODEL_NAME, backend.name)
+
+    try:
+        with timed("hf_call"):
+            result = await backend.aembed(texts)
+        return _to_embedding_list(result)
+
     except Exception as e:
-        error_msg = str(e)
-        print(f"[ERROR] {type(e).__name__}: {error_msg}")
-        
-        app_logger.error(f"Error: {error_msg}")
-        
-        if "503" in error_msg or "loading" in error_msg.lower():
-            raise HTTPException(
-                status_code=503,
-                detail="Model is loading. Please try again in a few moments."
-            )
-        elif "timeout" in error_msg.lower() or "timed out" in error_msg.lower():
-            raise HTTPException(
-                status_code=504,
-                detail="Timeout connecting to Hugging Face API"
-            )
-        else:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error generating embeddings: {error_msg}"
-            )
+        raise _to_http_exception(e)
+
+
+async def close_async_client() -> None:
+    """
+    Cierra las sesiones HTTP del backend (se llama al apagar la app).
+    """
+    close = getattr(backend, "close", None)
+    if close is not None:
+        await close()
+
+
+def _to_embedding_list(result) -> List[List[float]]:
+    # Convertir resultado a lista si es necesario
+    if hasattr(result, 'tolist'):
+        result = result.tolist()
+
+    if app_logger.isEnabledFor(logging.DEBUG) and isinstance(result, list):
+        first = len(result[0]) if result and isinstance(result[0], list) else None
+        app_logger.debug("Got %d embeddings (dimensions: %s)", len(result), first)
+
+    return result
+
+
+def _to_http_exception(e: Exception) -> HTTPException:
+    """
+    Traduce un error del backend a HTTPException (ver resilience.classify_error).
+    """
+    if isinstance(e, HTTPException):
+        return e
+    app_logger.error(f"Error del backend de embeddings ({type(e).__name__}): {str(e)}")
+    return classify_error(e)
+
+
+def get_backend_stats() -> Dict[str, Any]:
+    """
+    Estado del circuit breaker, uso del backend secundario y hedging.
+    """
+    return backend.stats()
+
+
+coalescer = RequestCoalescer(_request_embeddings_chunked)
+async_coalescer = AsyncRequestCoalescer(_arequest_embeddings_chunked)
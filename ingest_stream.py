@@ -0,0 +1,186 @@
+import os
+import json
+import asyncio
+import logging
+from typing import AsyncIterator, AsyncGenerator, List, Dict, Any, Optional, Tuple
+from hf_client import aget_embeddings_from_hf
+from document_store import ainsert_documents, aupsert_documents, ainsert_chunked_documents, CONTENT_HASH_ENABLED
+from chunking import CHUNKING_ENABLED
+from ann_index import ann_index
+
+"""
+Ingesta en streaming (NDJSON) para corpus grandes: POST /embeddings/stream.
+
+Cada línea del cuerpo es un texto JSON ("hola") o un objeto {"text": "hola"}. Las líneas se
+leen a medida que llegan, se agrupan en chunks de STREAM_INGEST_CHUNK_SIZE y cada chunk pasa
+por embed -> INSERT multi-fila. Por cada línea se devuelve una línea NDJSON con su resultado
+({"line", "status", "id"} o {"line", "status", "error"}) apenas termina su chunk, y al final
+una línea {"summary": {...}}.
+
+La lectura del cuerpo corre en una tarea aparte con una cola acotada
+(STREAM_INGEST_PREFETCH_CHUNKS): mientras se procesa un chunk se lee el siguiente, y si el
+procesamiento se atrasa se deja de leer el cuerpo. La memoria queda acotada por
+chunk_size * (prefetch + 1) líneas, sin importar el tamaño total del upload.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+STREAM_INGEST_CHUNK_SIZE = int(os.getenv("STREAM_INGEST_CHUNK_SIZE", "256"))
+STREAM_INGEST_PREFETCH_CHUNKS = int(os.getenv("STREAM_INGEST_PREFETCH_CHUNKS", "2"))
+STREAM_INGEST_MAX_LINE_BYTES = int(os.getenv("STREAM_INGEST_MAX_LINE_BYTES", str(1024 * 1024)))
+
+# Cada item del chunk: (número de línea, texto o None, error o None)
+_Item = Tuple[int, Optional[str], Optional[str]]
+_END = object()
+
+
+def parse_line(raw: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Retorna (texto, None) si la línea es válida o (None, error) si no.
+    """
+    try:
+        value = json.loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None, "Línea JSON inválida"
+    if isinstance(value, dict):
+        value = value.get("text")
+    if not isinstance(value, str):
+        return None, "Se esperaba un string o un objeto con 'text'"
+    value = value.strip()
+    if not value:
+        return None, "El texto no puede estar vacío"
+    return value, None
+
+
+async def iter_lines(stream: AsyncIterator[bytes]) -> AsyncGenerator[Tuple[int, bytes], None]:
+    """
+    Separa el cuerpo en líneas (numeradas desde 1) sin acumularlo completo.
+    Las líneas vacías se saltean; las que superan STREAM_INGEST_MAX_LINE_BYTES se
+    devuelven truncadas a b"" para reportarlas como error sin guardarlas en memoria.
+    """
+    buffer = bytearray()
+    line_no = 0
+    oversized = False
+    async for data in stream:
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end == -1:
+                if not oversized:
+                    buffer += data[start:]
+                    if len(buffer) > STREAM_INGEST_MAX_LINE_BYTES:
+                        oversized = True
+                        buffer.clear()
+                break
+            if not oversized:
+                buffer += data[start:end]
+                oversized = len(buffer) > STREAM_INGEST_MAX_LINE_BYTES
+            line_no += 1
+            if oversized:
+                yield line_no, b""
+            elif buffer.strip():
+                yield line_no, bytes(buffer)
+            buffer.clear()
+            oversized = False
+            start = end + 1
+    if oversized or buffer.strip():
+        line_no += 1
+        yield line_no, b"" if oversized else bytes(buffer)
+
+
+async def _read_chunks(stream: AsyncIterator[bytes], queue: asyncio.Queue, chunk_size: int) -> None:
+    chunk: List[_Item] = []
+    try:
+        async for line_no, raw in iter_lines(stream):
+            if not raw:
+                chunk.append((line_no, None, f"La línea supera {STREAM_INGEST_MAX_LINE_BYTES} bytes"))
+            else:
+                text, error = parse_line(raw)
+                chunk.append((line_no, text, error))
+            if len(chunk) >= chunk_size:
+                await queue.put(chunk)
+                chunk = []
+        if chunk:
+            await queue.put(chunk)
+        await queue.put(_END)
+    except Exception as e:
+        # El error de lectura (ej. cliente desconectado) se entrega al consumidor
+        await queue.put(e)
+
+
+async def _process_chunk(chunk: List[_Item]) -> List[Dict[str, Any]]:
+    results: Dict[int, Dict[str, Any]] = {}
+    valid = []
+    for line_no, text, error in chunk:
+        if error:
+            results[line_no] = {"line": line_no, "status": "error", "error": error}
+        else:
+            valid.append((line_no, text))
+
+    if valid:
+        texts = [text for _, text in valid]
+        try:
+            statuses = None
+            if CONTENT_HASH_ENABLED:
+                # Con deduplicación los textos ya guardados devuelven su id sin embeberse
+                # (y con CHUNKING_ENABLED=1 los largos se guardan como padre + chunks)
+                result = await aupsert_documents(texts, aget_embeddings_from_hf, "skip")
+                document_ids, failures, statuses = result["document_ids"], result["failures"], result["statuses"]
+                ann_index.remove(result["removed_ids"])
+                ann_index.add(result["written_ids"], result["written_embeddings"])
+            elif CHUNKING_ENABLED:
+                # Los textos largos se guardan como padre + chunks (chunking.py)
+                result = await ainsert_chunked_documents(texts, aget_embeddings_from_hf)
+                document_ids, failures = result["document_ids"], result["failures"]
+                ann_index.add(result["written_ids"], result["written_embeddings"])
+            else:
+                embeddings = await aget_embeddings_from_hf(texts)
+                document_ids, failures = await ainsert_documents(texts, embeddings)
+                ann_index.add(document_ids, embeddings)
+            failed = {f["index"]: f["error"] for f in failures}
+            for i, (line_no, _) in enumerate(valid):
+                if i in failed:
+                    results[line_no] = {"line": line_no, "status": "error", "error": failed[i]}
+                else:
+                    results[line_no] = {"line": line_no, "status": "ok", "id": document_ids[i]}
+                    if statuses is not None:
+                        results[line_no]["dedupe"] = statuses[i]
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            app_logger.error(f"Falló el chunk de líneas {valid[0][0]}-{valid[-1][0]}: {detail}")
+            for line_no, _ in valid:
+                results[line_no] = {"line": line_no, "status": "error", "error": detail}
+
+    return [results[line_no] for line_no, _, _ in chunk]
+
+
+async def ingest_ndjson(stream: AsyncIterator[bytes],
+                        chunk_size: int = STREAM_INGEST_CHUNK_SIZE) -> AsyncGenerator[bytes, None]:
+    """
+    Consume un cuerpo NDJSON y genera las líneas NDJSON de resultado (ver docstring del módulo).
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(STREAM_INGEST_PREFETCH_CHUNKS, 1))
+    reader = asyncio.create_task(_read_chunks(stream, queue, max(chunk_size, 1)))
+    summary = {"lines": 0, "inserted": 0, "failed": 0, "chunks": 0}
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is _END:
+                break
+            if isinstance(chunk, Exception):
+                app_logger.error(f"Error leyendo el cuerpo NDJSON: {str(chunk)}")
+                summary["error"] = str(chunk)
+                break
+
+            results = await _process_chunk(chunk)
+            summary["chunks"] += 1
+            summary["lines"] += len(results)
+            ok = sum(1 for r in results if r["status"] == "ok")
+            summary["inserted"] += ok
+            summary["failed"] += len(results) - ok
+            yield "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in results).encode("utf-8")
+
+        yield (json.dumps({"summary": summary}) + "\n").encode("utf-8")
+    finally:
+        # Si el cliente corta la respuesta se deja de leer el cuerpo
+        reader.cancel()
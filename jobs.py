@@ -0,0 +1,446 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+from hf_client import get_embeddings_from_hf
+from document_store import insert_documents
+from ann_index import ann_index
+from search_cache import search_cache
+
+"""
+Jobs de embeddings en segundo plano (POST /jobs, GET /jobs/{id}, GET /jobs/{id}/stream).
+
+Un job se divide en chunks de JOBS_CHUNK_SIZE textos que se guardan en una cola
+(tablas embedding_jobs / embedding_job_chunks, ver sql/003_embedding_jobs.sql). Un pool de
+workers (JobWorkerPool) toma chunks, pide los embeddings, inserta los documentos y marca el
+chunk como hecho (checkpoint). Si un worker muere, su chunk queda "running" con un lease
+vencido (JOBS_CHUNK_LEASE_SECONDS) y otro worker lo retoma: el job sigue desde el último
+chunk hecho en lugar de empezar de nuevo.
+
+Colas disponibles (JOBS_BACKEND):
+- "postgres" (default): las tablas viven en Neon y los chunks se toman con
+  FOR UPDATE SKIP LOCKED. El INSERT de los documentos y el checkpoint del chunk se hacen
+  en la misma transacción, por lo que cada chunk se guarda exactamente una vez.
+- "sqlite": cola local en JOBS_SQLITE_PATH para desarrollo y pruebas sin Neon. Los
+  documentos se siguen guardando en Neon y el checkpoint va después del INSERT, por lo
+  que un crash entre ambos puede repetir ese chunk.
+
+Workers: JOBS_WORKERS threads dentro de la app (default 0) o un proceso aparte con
+`python -m jobs`.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+JOBS_BACKEND = os.getenv("JOBS_BACKEND", "postgres")
+JOBS_SQLITE_PATH = os.getenv("JOBS_SQLITE_PATH", "jobs.sqlite3")
+JOBS_CHUNK_SIZE = int(os.getenv("JOBS_CHUNK_SIZE", "256"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "0"))
+JOBS_POLL_INTERVAL_SECONDS = float(os.getenv("JOBS_POLL_INTERVAL_SECONDS", "1"))
+JOBS_CHUNK_LEASE_SECONDS = float(os.getenv("JOBS_CHUNK_LEASE_SECONDS", "300"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+
+TERMINAL_STATUSES = ("done", "failed")
+
+# ============================================>
+# Sentencias comunes (placeholders %s; SQLite los traduce a ?)
+# ============================================>
+_INSERT_JOB_SQL = "INSERT INTO embedding_jobs (status, total, chunks) VALUES ('queued', %s, %s) RETURNING id;"
+_INSERT_CHUNK_SQL = "INSERT INTO embedding_job_chunks (job_id, chunk_index, size, texts) VALUES (%s, %s, %s, %s);"
+_START_JOB_SQL = """
+    UPDATE embedding_jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP
+    WHERE id = %s AND status = 'queued';
+"""
+_COMPLETE_CHUNK_SQL = """
+    UPDATE embedding_job_chunks
+    SET status = 'done', document_ids = %s, failures = %s, texts = NULL, locked_by = NULL
+    WHERE job_id = %s AND chunk_index = %s AND status = 'running' AND locked_by = %s;
+"""
+_RETRY_CHUNK_SQL = """
+    UPDATE embedding_job_chunks SET status = 'pending', error = %s, locked_by = NULL
+    WHERE job_id = %s AND chunk_index = %s AND status = 'running' AND locked_by = %s;
+"""
+_FAIL_CHUNK_SQL = """
+    UPDATE embedding_job_chunks SET status = 'failed', error = %s, locked_by = NULL
+    WHERE job_id = %s AND chunk_index = %s AND status = 'running' AND locked_by = %s;
+"""
+# Suma el avance del chunk y cierra el job cuando no quedan chunks pendientes
+_PROGRESS_JOB_SQL = """
+    UPDATE embedding_jobs
+    SET processed = processed + %s,
+        failed = failed + %s,
+        error = COALESCE(%s, error),
+        updated_at = CURRENT_TIMESTAMP,
+        status = CASE
+            WHEN EXISTS (SELECT 1 FROM embedding_job_chunks
+                         WHERE job_id = %s AND status IN ('pending', 'running')) THEN status
+            WHEN EXISTS (SELECT 1 FROM embedding_job_chunks
+                         WHERE job_id = %s AND status = 'failed') THEN 'failed'
+            ELSE 'done'
+        END
+    WHERE id = %s;
+"""
+_GET_JOB_SQL = """
+    SELECT id, status, total, chunks, processed, failed, error, created_at, updated_at
+    FROM embedding_jobs WHERE id = %s;
+"""
+_GET_CHUNKS_SQL = """
+    SELECT chunk_index, status, attempts, document_ids, failures, error
+    FROM embedding_job_chunks WHERE job_id = %s ORDER BY chunk_index;
+"""
+
+
+def _from_json(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+
+class JobStore:
+    """
+    Cola de jobs. Las subclases definen _connect(), _sql() y claim_chunk().
+    """
+    name = "base"
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def _sql(self, sql: str) -> str:
+        return sql
+
+    def create_job(self, texts: List[str], chunk_size: int = JOBS_CHUNK_SIZE) -> int:
+        """Guarda el job y sus chunks; retorna el id del job."""
+        chunk_size = max(chunk_size, 1)
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        with self._connect() as conn:
+            cur = conn.cursor()
+            cur.execute(self._sql(_INSERT_JOB_SQL), (len(texts), len(chunks)))
+            job_id = cur.fetchone()["id"]
+            for index, chunk in enumerate(chunks):
+                cur.execute(self._sql(_INSERT_CHUNK_SQL), (job_id, index, len(chunk), json.dumps(chunk)))
+            conn.commit()
+        return job_id
+
+    def claim_chunk(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Toma un chunk pendiente (o con lease vencido); None si no hay."""
+        raise NotImplementedError
+
+    def process_chunk(self, chunk: Dict[str, Any], worker_id: str) -> None:
+        """Embed + INSERT del chunk y checkpoint."""
+        texts = chunk["texts"]
+        embeddings = get_embeddings_from_hf(texts)
+        # Sin content_hash: los jobs no pasan por la deduplicación de aupsert_documents
+        document_ids, failures = insert_documents(texts, embeddings)
+        with self._connect() as conn:
+            if self._complete(conn, chunk, worker_id, document_ids, failures):
+                conn.commit()
+        ann_index.add(document_ids, embeddings)
+
+    def _complete(self, conn, chunk: Dict[str, Any], worker_id: str,
+                  document_ids: List[Optional[int]], failures: List[Dict[str, Any]]) -> bool:
+        cur = conn.cursor()
+        cur.execute(self._sql(_COMPLETE_CHUNK_SQL), (
+            json.dumps(document_ids), json.dumps(failures), chunk["job_id"], chunk["chunk_index"], worker_id
+        ))
+        if cur.rowcount != 1:
+            # El lease venció y otro worker tomó el chunk
+            app_logger.warning(f"Chunk {chunk['job_id']}/{chunk['chunk_index']} ya no pertenece a {worker_id}")
+            return False
+        self._progress(cur, chunk["job_id"], len(document_ids) - len(failures), len(failures), None)
+        return True
+
+    def fail_chunk(self, chunk: Dict[str, Any], worker_id: str, error: str) -> None:
+        """Devuelve el chunk a la cola o, agotados los intentos, lo marca como fallido."""
+        with self._connect() as conn:
+            cur = conn.cursor()
+            if chunk["attempts"] < JOBS_MAX_ATTEMPTS:
+                cur.execute(self._sql(_RETRY_CHUNK_SQL), (error, chunk["job_id"], chunk["chunk_index"], worker_id))
+            else:
+                cur.execute(self._sql(_FAIL_CHUNK_SQL), (error, chunk["job_id"], chunk["chunk_index"], worker_id))
+                if cur.rowcount == 1:
+                    self._progress(cur, chunk["job_id"], 0, chunk["size"], error)
+            conn.commit()
+
+    def _progress(self, cur, job_id: int, processed: int, failed: int, error: Optional[str]) -> None:
+        cur.execute(self._sql(_PROGRESS_JOB_SQL), (processed, failed, error, job_id, job_id, job_id))
+
+    def get_job(self, job_id: int, include_chunks: bool = False) -> Optional[Dict[str, Any]]:
+        """Estado y avance del job (None si no existe)."""
+        with self._connect() as conn:
+            cur = conn.cursor()
+            cur.execute(self._sql(_GET_JOB_SQL), (job_id,))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            for key in ("created_at", "updated_at"):
+                if hasattr(job[key], "isoformat"):
+                    job[key] = job[key].isoformat()
+            job["progress"] = round((job["processed"] + job["failed"]) / job["total"], 4) if job["total"] else 1.0
+            if include_chunks:
+                cur.execute(self._sql(_GET_CHUNKS_SQL), (job_id,))
+                job["chunks_detail"] = [
+                    {**dict(r), "document_ids": _from_json(r["document_ids"]), "failures": _from_json(r["failures"])}
+                    for r in cur.fetchall()
+                ]
+        return job
+
+
+# ============================================>
+# Cola en Postgres (Neon)
+# ============================================>
+class PostgresJobStore(JobStore):
+    name = "postgres"
+
+    _CLAIM_SQL = """
+        UPDATE embedding_job_chunks
+        SET status = 'running', attempts = attempts + 1, locked_by = %s, locked_at = %s
+        WHERE (job_id, chunk_index) = (
+            SELECT job_id, chunk_index FROM embedding_job_chunks
+            WHERE status = 'pending' OR (status = 'running' AND locked_at < %s)
+            ORDER BY job_id, chunk_index
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING job_id, chunk_index, size, texts, attempts;
+    """
+
+    @contextmanager
+    def _connect(self):
+        from database import connection
+        with connection() as conn:
+            yield conn
+
+    def claim_chunk(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(self._CLAIM_SQL, (worker_id, now, now - JOBS_CHUNK_LEASE_SECONDS))
+                row = cur.fetchone()
+                if row is not None:
+                    cur.execute(_START_JOB_SQL, (row["job_id"],))
+            conn.commit()
+        return _claimed(row)
+
+    def process_chunk(self, chunk: Dict[str, Any], worker_id: str) -> None:
+        # Documentos y checkpoint en la misma transacción: si el lease venció, no se guarda nada
+        texts = chunk["texts"]
+        embeddings = get_embeddings_from_hf(texts)
+        with self._connect() as conn:
+            document_ids, failures = insert_documents(texts, embeddings, conn=conn)
+            if not self._complete(conn, chunk, worker_id, document_ids, failures):
+                conn.rollback()
+                return
+            conn.commit()
+        search_cache.invalidate()
+        ann_index.add(document_ids, embeddings)
+
+
+# ============================================>
+# Cola local en SQLite (desarrollo / pruebas offline)
+# ============================================>
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embedding_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    chunks INTEGER NOT NULL,
+    processed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS embedding_job_chunks (
+    job_id INTEGER NOT NULL REFERENCES embedding_jobs (id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    texts TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    locked_by TEXT,
+    locked_at REAL,
+    document_ids TEXT,
+    failures TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, chunk_index)
+);
+CREATE INDEX IF NOT EXISTS embedding_job_chunks_status_idx ON embedding_job_chunks (status, job_id, chunk_index);
+"""
+
+
+class SqliteJobStore(JobStore):
+    name = "sqlite"
+
+    _SELECT_CLAIMABLE_SQL = """
+        SELECT job_id, chunk_index FROM embedding_job_chunks
+        WHERE status = 'pending' OR (status = 'running' AND locked_at < ?)
+        ORDER BY job_id, chunk_index
+        LIMIT 1;
+    """
+    _CLAIM_SQL = """
+        UPDATE embedding_job_chunks
+        SET status = 'running', attempts = attempts + 1, locked_by = ?, locked_at = ?
+        WHERE job_id = ? AND chunk_index = ?
+        RETURNING job_id, chunk_index, size, texts, attempts;
+    """
+
+    def __init__(self, path: str = JOBS_SQLITE_PATH):
+        self.path = path
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.executescript(_SQLITE_SCHEMA)
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            # Transacción explícita: BEGIN IMMEDIATE serializa a los workers al tomar chunks
+            conn.execute("BEGIN IMMEDIATE;")
+            yield _SqliteTransaction(conn)
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.close()
+
+    def _sql(self, sql: str) -> str:
+        return sql.replace("%s", "?")
+
+    def claim_chunk(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.cursor()
+            cur.execute(self._SELECT_CLAIMABLE_SQL, (now - JOBS_CHUNK_LEASE_SECONDS,))
+            target = cur.fetchone()
+            row = None
+            if target is not None:
+                cur.execute(self._CLAIM_SQL, (worker_id, now, target["job_id"], target["chunk_index"]))
+                row = dict(cur.fetchone())
+                cur.execute(self._sql(_START_JOB_SQL), (row["job_id"],))
+            conn.commit()
+        return _claimed(row)
+
+
+class _SqliteTransaction:
+    """Envuelve la conexión para que commit() abra la siguiente transacción, como psycopg2."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def cursor(self):
+        return self._conn.cursor()
+
+    def commit(self):
+        if self._conn.in_transaction:
+            self._conn.commit()
+
+    def rollback(self):
+        if self._conn.in_transaction:
+            self._conn.rollback()
+
+
+def _claimed(row) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    chunk = dict(row)
+    chunk["texts"] = _from_json(chunk["texts"])
+    return chunk
+
+
+# ============================================>
+# Pool de workers
+# ============================================>
+class JobWorkerPool:
+    """
+    Threads que toman chunks de la cola hasta que se llama a stop().
+    """
+
+    def __init__(self, store: JobStore, workers: int = JOBS_WORKERS,
+                 poll_interval: float = JOBS_POLL_INTERVAL_SECONDS):
+        self.store = store
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._stats_lock = threading.Lock()
+        self.chunks_done = 0
+        self.chunks_failed = 0
+
+    def start(self) -> None:
+        prefix = f"{socket.gethostname()}-{os.getpid()}"
+        for i in range(self.workers):
+            worker_id = f"{prefix}-{i}-{uuid.uuid4().hex[:6]}"
+            thread = threading.Thread(target=self._run, args=(worker_id,), name=f"embedding-job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        app_logger.info(f"{self.workers} workers de jobs iniciados (cola: {self.store.name})")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_once(self, worker_id: str = "inline") -> bool:
+        """Procesa un chunk si hay; retorna False si la cola está vacía."""
+        chunk = self.store.claim_chunk(worker_id)
+        if chunk is None:
+            return False
+        try:
+            self.store.process_chunk(chunk, worker_id)
+            with self._stats_lock:
+                self.chunks_done += 1
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            app_logger.error(f"Falló el chunk {chunk['job_id']}/{chunk['chunk_index']} (intento {chunk['attempts']}): {detail}")
+            self.store.fail_chunk(chunk, worker_id, str(detail))
+            with self._stats_lock:
+                self.chunks_failed += 1
+        return True
+
+    def _run(self, worker_id: str) -> None:
+        while not self._stop.is_set():
+            try:
+                if not self.run_once(worker_id):
+                    self._stop.wait(self.poll_interval)
+            except Exception as e:
+                app_logger.error(f"Error en el worker {worker_id}: {str(e)}")
+                self._stop.wait(self.poll_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.store.name,
+            "workers": len(self._threads),
+            "chunks_done": self.chunks_done,
+            "chunks_failed": self.chunks_failed,
+        }
+
+
+def _create_store(name: str) -> JobStore:
+    if name == "sqlite":
+        return SqliteJobStore()
+    if name == "postgres":
+        return PostgresJobStore()
+    raise RuntimeError(f"JOBS_BACKEND desconocido: {name} (usar 'postgres' o 'sqlite')")
+
+
+job_store = _create_store(JOBS_BACKEND)
+job_workers = JobWorkerPool(job_store)
+
+
+if __name__ == "__main__":
+    # Worker dedicado: python -m jobs
+    logging.basicConfig(level=logging.INFO)
+    job_workers.workers = max(JOBS_WORKERS, 1)
+    job_workers.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        job_workers.stop()
@@ -1,11 +1,17 @@
+import os
+import time
 import logging
 import json
-from fastapi import FastAPI, HTTPException, logger, Path, Query
-from fastapi.responses import HTMLResponse, JSONResponse
-from schemas import Contact, TextRequest, EmbeddingResponse, DocumentRecord
+import asyncio
+from fastapi import FastAPI, HTTPException, logger, Path, Query, Request, Header
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.routing import Match
+from schemas import Contact, TextRequest, EmbeddingResponse, DocumentRecord, BatchSearchRequest, SearchFilters, DocumentSelection
 from constants import MODEL_NAME, MODEL_DIMENSIONS, MAX_SEQUENCE_LENGTH, MODEL_DESCRIPTION, MODEL_USE_CASE, MODEL_LANGUAGE
-from database import get_connection
+from database import get_pool_stats
+from database_async import async_connection, close_async_pool, get_async_pool_stats
 from datetime import datetime
+from typing import Optional
 
 # ============================================
 # CARGAR .ENV SI EXISTE (SOLO LOCAL)
@@ -17,6 +23,8 @@ try:
 except ImportError:
     print("✓ Production: Using system environment variables")
 
+# Los mensajes de debug (ej. detalle de cada llamada a HF) solo se emiten con LOG_LEVEL=DEBUG
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 app_logger = logging.getLogger(__name__)
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -50,14 +58,71 @@ app.add_middleware(
 app.title = "Embeddings con FastAPI"
 app.version = "0.1.9"
 
-from hf_client import get_embeddings_from_hf
-from search_service import search_similar_documents
+from hf_client import aget_embeddings_from_hf, arefresh_embeddings, get_coalescer_stats, get_backend_stats, close_async_client
+from search_service import asearch_similar_documents, asearch_similar_documents_batch, CHUNK_SEARCH_AGGREGATE
+from document_store import ainsert_documents, aupsert_documents, ainsert_chunked_documents, CONTENT_HASH_ENABLED
+from chunking import CHUNKING_ENABLED
+from embedding_cache import get_cache_stats
+from ingest_stream import ingest_ndjson
+from response_formats import resolve_format, pack_embeddings, pack_search_results, embeddings_base64, binary_response, DTYPES
+from model_migration import aembed_for_search, aget_migration_status
+from jobs import job_store, job_workers, JOBS_WORKERS, JOBS_POLL_INTERVAL_SECONDS, TERMINAL_STATUSES
+from ann_index import ann_index, ANN_INDEX_ENABLED, ANN_INDEX_NPROBE
+from document_listing import afetch_page, aexport_documents, document_stats, DOCUMENTS_PAGE_MAX
+from search_cache import search_cache, search_scope
+from document_bulk import adelete_documents, areembed_documents, DOCUMENTS_BULK_MAX_ROWS, REEMBED_BATCH_SIZE
+from metrics import start_request, server_timing_header, observe_request, render_prometheus, SERVER_TIMING_ENABLED
+
+# ============================================
+# Carga del índice ANN en memoria (en segundo plano)
+# ============================================
+@app.on_event("startup")
+async def startup():
+    if ANN_INDEX_ENABLED:
+        ann_index.start_background_load()
+    if JOBS_WORKERS > 0:
+        job_workers.start()
+
+
+# ============================================
+# Cierre de recursos compartidos (workers de jobs, pool async y cliente HF)
+# ============================================
+@app.on_event("shutdown")
+async def shutdown():
+    await asyncio.to_thread(job_workers.stop)
+    await close_async_pool()
+    await close_async_client()
+
+
+# ============================================
+# Tiempos por request (Server-Timing) e histogramas para /metrics
+# ============================================
+def _route_label(request: Request) -> str:
+    """Path de la ruta (ej. /jobs/{job_id}) para no abrir una serie por cada id."""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+@app.middleware("http")
+async def request_timing(request: Request, call_next):
+    timings = start_request()
+    start = time.perf_counter()
+    response = await call_next(request)
+    total = time.perf_counter() - start
+    if SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = server_timing_header(timings, total)
+    observe_request(request.method, _route_label(request), response.status_code, total)
+    return response
+
 
 # ============================================
 # Endpoint raiz
 # ============================================
 @app.get('/', tags=['Home'])
-def message():
+async def message():
     """ 
         Get sin parametros a la ruta raiz.
         Devuelve un mensaje de bienvenida.
@@ -94,13 +159,13 @@ async def model_info():
 # Endpoint de info sobre la salud del modelo
 # ============================================
 @app.get("/health", tags=['Embeddings'])
-def health_check():
+async def health_check():
     """
     Verificar el estado de la API y conexión con Hugging Face
     """
     try:
         # Test simple con un texto pequeño
-        test_result = get_embeddings_from_hf(["test"])
+        test_result = await aget_embeddings_from_hf(["test"], use_cache=False)
         
         return {
             "status": "healthy",
@@ -114,48 +179,128 @@ def health_check():
             "error": str(e)
         }
 
+# ============================================
+# Endpoint de estadísticas de la caché de embeddings
+# ============================================
+@app.get("/cache/stats", tags=['Embeddings'])
+async def cache_stats():
+    """
+    Contadores de la caché de embeddings: hits en memoria y en la tabla documents,
+    misses, llamadas a Hugging Face efectivamente realizadas, tamaño y desalojos.
+    """
+    return get_cache_stats()
+
+# ============================================
+# Endpoint de métricas del coalescer de pedidos a Hugging Face
+# ============================================
+@app.get("/coalescer/stats", tags=['Embeddings'])
+async def coalescer_stats():
+    """
+    Métricas del agrupamiento de pedidos concurrentes: ventana (ms), tamaño máximo
+    de batch, batches enviados, llamadas ahorradas y porcentaje de llenado de cada batch.
+    """
+    return get_coalescer_stats()
+
+# ============================================
+# Endpoint de estado del backend (circuit breaker, fallback, hedging)
+# ============================================
+@app.get("/backend/stats", tags=['Embeddings'])
+async def backend_stats():
+    """
+    Estado del circuit breaker del backend de embeddings (closed/open/half_open), llamadas
+    desviadas al backend secundario, requests duplicados por hedging y p95 reciente.
+    """
+    return get_backend_stats()
+
+def _resolve_on_conflict(on_conflict: Optional[str]) -> Optional[str]:
+    """Modo de deduplicación de la ingesta (None = INSERT sin content_hash)."""
+    if on_conflict is None:
+        return "skip" if CONTENT_HASH_ENABLED else None
+    if on_conflict not in ("skip", "update"):
+        raise HTTPException(status_code=400, detail="on_conflict debe ser skip o update")
+    if not CONTENT_HASH_ENABLED:
+        raise HTTPException(status_code=400, detail="on_conflict requiere CONTENT_HASH_ENABLED=1 (sql/006_content_hash.sql)")
+    return on_conflict
+
+
 # ============================================================
 # Endpoint para generar un embedding a partir de UN solo texto 
 # ============================================================
 @app.post("/embedding", tags=['Embeddings'])
-def create_single_embedding(text: str):
+async def create_single_embedding(
+    text: str,
+    format: Optional[str] = Query(None, description="json (default), base64 o binary"),
+    dtype: str = Query("float32", description="float32 o float16 (formatos base64 y binary)"),
+    echo_text: bool = Query(True, description="Incluir el texto en la respuesta JSON"),
+    on_conflict: Optional[str] = Query(None, description="skip (default con CONTENT_HASH_ENABLED=1) o update"),
+    accept: Optional[str] = Header(None)
+):
     """
     Crear embedding para UN SOLO TEXTO (endpoint simplificado)
     - **text**: String para convertir a embedding
+    - **format**: `json`, `base64` o `binary` (application/octet-stream, ver response_formats.py).
+      Sin `format`, `Accept: application/octet-stream` devuelve binario.
+    - **on_conflict**: con deduplicación activa, `skip` devuelve el documento existente sin
+      llamar a Hugging Face y `update` lo vuelve a embeber
+    Con CHUNKING_ENABLED=1 un texto más largo que el límite del modelo se divide en chunks;
+    `embedding` es entonces el promedio normalizado de los chunks y `chunks` su cantidad.
     """
     try:
         if not text or not text.strip():
             raise HTTPException(status_code=400, detail="El texto no puede estar vacío")
-        
-        embeddings = get_embeddings_from_hf([text.strip()])
+        response_format = resolve_format(format, accept)
+        dedupe_mode = _resolve_on_conflict(on_conflict)
+        status = "inserted"
+        chunks = None
 
         # Guardar en Neon
-        embedding_str = "[" + ",".join(str(x) for x in embeddings[0]) + "]"
-        metadata = {"model": MODEL_NAME, "timestamp": datetime.utcnow().isoformat()}
         try:
-            conn = get_connection()
-            try:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        "INSERT INTO documents (content, embedding, metadata) VALUES (%s, %s::vector, %s) RETURNING id;",
-                        (text.strip(), embedding_str, json.dumps(metadata))
-                    )
-                    document_id = cur.fetchone()['id']
-                conn.commit()
-            finally:
-                conn.close()
+            if dedupe_mode:
+                result = await aupsert_documents([text.strip()], aget_embeddings_from_hf, dedupe_mode)
+                embeddings, document_ids, failures = result["embeddings"], result["document_ids"], result["failures"]
+                status = result["statuses"][0]
+                if CHUNKING_ENABLED:
+                    chunks = result["chunks"][0]
+                ann_index.remove(result["removed_ids"])
+                ann_index.add(result["written_ids"], result["written_embeddings"])
+            elif CHUNKING_ENABLED:
+                result = await ainsert_chunked_documents([text.strip()], aget_embeddings_from_hf)
+                embeddings, document_ids, failures = result["embeddings"], result["document_ids"], result["failures"]
+                chunks = result["chunks"][0]
+                ann_index.add(result["written_ids"], result["written_embeddings"])
+            else:
+                embeddings = await aget_embeddings_from_hf([text.strip()])
+                document_ids, failures = await ainsert_documents([text.strip()], embeddings)
+                ann_index.add(document_ids, embeddings)
+        except HTTPException:
+            raise
         except Exception as e:
             app_logger.error(f"Error saving to Neon: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Failed to save document: {str(e)}")
+        if failures:
+            raise HTTPException(status_code=500, detail=f"Failed to save document: {failures[0]['error']}")
+        document_id = document_ids[0]
 
-        return {
+        if response_format == "binary":
+            return binary_response(pack_embeddings(embeddings, dtype, ids=document_ids),
+                                   headers={"X-Model": MODEL_NAME})
+
+        response = {
             "embedding": embeddings[0] if embeddings else [],
             "text": text.strip(),
             "count": len(embeddings),
             "model": MODEL_NAME,
             "dimensions": len(embeddings[0]) if embeddings else 0,
-            "document_id": document_id
+            "document_id": document_id,
+            "status": status
         }
+        if chunks is not None:
+            response["chunks"] = chunks
+        if response_format == "base64":
+            response["embedding"] = embeddings_base64(embeddings, dtype)
+        if not echo_text:
+            del response["text"]
+        return response
         """ return JSONResponse(content={"message": "Embedding created", 
                                      "model": "BAAI/bge-small-en-v1.5",
                                      "count": len(embeddings),
@@ -173,50 +318,85 @@ def create_single_embedding(text: str):
 # Endpoint para generar embeddings de una lista de textos
 # =======================================================
 @app.post("/embeddings", response_model=EmbeddingResponse, tags=['Embeddings'])
-def create_embeddings(request: TextRequest):
+async def create_embeddings(
+    request: TextRequest,
+    format: Optional[str] = Query(None, description="json (default), base64 o binary"),
+    dtype: str = Query("float32", description="float32 o float16 (formatos base64 y binary)"),
+    echo_texts: bool = Query(True, description="Incluir 'texto original' en la respuesta JSON"),
+    on_conflict: Optional[str] = Query(None, description="skip (default con CONTENT_HASH_ENABLED=1) o update"),
+    accept: Optional[str] = Header(None)
+):
     """
     Crear embeddings para una LISTA de textos
     - **texts**: Lista de strings para convertir a embeddings
+    - **format**: `json`, `base64` o `binary` (application/octet-stream con los ids y la
+      matriz, ver response_formats.py). Sin `format`, `Accept: application/octet-stream`
+      devuelve binario.
+    - **echo_texts**: `false` para no repetir los textos de entrada en la respuesta
+    - **on_conflict**: con deduplicación activa (CONTENT_HASH_ENABLED=1) los textos repetidos
+      se embeben una sola vez; `skip` devuelve el id de los ya guardados sin llamar a Hugging
+      Face y `update` los vuelve a embeber
+    - Con CHUNKING_ENABLED=1 los textos que superan el límite de tokens del modelo se guardan
+      divididos en chunks; `chunks` trae la cantidad por texto
     Retorna embeddings de 384 dimensiones para cada texto.
     """
     try:
         if not request.texts:
             raise HTTPException(status_code=400, detail="La lista de textos no puede estar vacia")
+        response_format = resolve_format(format, accept)
         
         if len(request.texts) > 2500:  # Límite razonable
             raise HTTPException(status_code=400, detail="Maximum 250 texts allowed per request")
 
-        app_logger.info(f"Processing {len(request.texts)} texts for embeddings")
-
-        embeddings = get_embeddings_from_hf(request.texts)
+        dedupe_mode = _resolve_on_conflict(on_conflict)
 
-        # Guardar en Neon
-        document_ids = []
-        conn = get_connection()
-        try:
-            with conn.cursor() as cur:
-                for i, emb in enumerate(embeddings):
-                    embedding_str = "[" + ",".join(str(x) for x in emb) + "]"
-                    metadata = {"model": MODEL_NAME, "timestamp": datetime.utcnow().isoformat()}
-                    try:
-                        cur.execute(
-                            "INSERT INTO documents (content, embedding, metadata) VALUES (%s, %s::vector, %s) RETURNING id;",
-                            (request.texts[i], embedding_str, json.dumps(metadata))
-                        )
-                        document_ids.append(cur.fetchone()['id'])
-                    except Exception as e:
-                        app_logger.error(f"Error saving document {i} to Neon: {str(e)}")
-                        document_ids.append(None)
-            conn.commit()
-        finally:
-            conn.close()
+        app_logger.info(f"Processing {len(request.texts)} texts for embeddings")
 
-        return JSONResponse(content={"message": "Embeddings created",
-                                     "model": MODEL_NAME,
-                                     "count": len(embeddings),
-                                     "texto original": request.texts,
-                                     "data": embeddings,
-                                     "document_ids": document_ids}, status_code=200)
+        statuses = None
+        chunks = None
+        if dedupe_mode:
+            # Deduplicación por content_hash: solo se embeben los textos nuevos y únicos
+            # (con CHUNKING_ENABLED=1 los largos también se dividen en chunks)
+            result = await aupsert_documents(request.texts, aget_embeddings_from_hf, dedupe_mode)
+            embeddings, document_ids, failures = result["embeddings"], result["document_ids"], result["failures"]
+            statuses = result["statuses"]
+            if CHUNKING_ENABLED:
+                chunks = result["chunks"]
+            ann_index.remove(result["removed_ids"])
+            ann_index.add(result["written_ids"], result["written_embeddings"])
+        elif CHUNKING_ENABLED:
+            # Los textos largos se dividen en chunks y todos se embeben en los mismos batches
+            result = await ainsert_chunked_documents(request.texts, aget_embeddings_from_hf)
+            embeddings, document_ids, failures = result["embeddings"], result["document_ids"], result["failures"]
+            chunks = result["chunks"]
+            ann_index.add(result["written_ids"], result["written_embeddings"])
+        else:
+            embeddings = await aget_embeddings_from_hf(request.texts)
+
+            # Guardar en Neon (INSERT multi-fila por páginas)
+            document_ids, failures = await ainsert_documents(request.texts, embeddings)
+            ann_index.add(document_ids, embeddings)
+
+        if response_format == "binary":
+            # Las filas que no se guardaron llevan id -1; el detalle va en X-Failures
+            return binary_response(pack_embeddings(embeddings, dtype, ids=document_ids),
+                                   headers={"X-Model": MODEL_NAME, "X-Failures": str(len(failures))})
+
+        content = {"message": "Embeddings created",
+                   "model": MODEL_NAME,
+                   "count": len(embeddings),
+                   "texto original": request.texts,
+                   "data": embeddings_base64(embeddings, dtype) if response_format == "base64" else embeddings,
+                   "document_ids": document_ids,
+                   "failures": failures}
+        if statuses is not None:
+            content["statuses"] = statuses
+            content["dedupe"] = {status: statuses.count(status) for status in set(statuses)}
+        if chunks is not None:
+            content["chunks"] = chunks
+        if not echo_texts:
+            del content["texto original"]
+        return JSONResponse(content=content, status_code=200)
         
     except HTTPException:
         # Re-raise HTTP exceptions as-is
@@ -226,31 +406,175 @@ def create_embeddings(request: TextRequest):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+# =======================================================
+# Endpoint de ingesta en streaming (NDJSON)
+# =======================================================
+@app.post("/embeddings/stream", tags=['Embeddings'])
+async def create_embeddings_stream(request: Request):
+    """
+    Ingestar un corpus de cualquier tamaño enviado como NDJSON (una línea por texto:
+    `"texto"` o `{"text": "texto"}`).
+    Las líneas se procesan en chunks acotados (embed -> INSERT) a medida que llegan y la
+    respuesta es NDJSON: una línea por texto con `line`, `status` e `id` (o `error`) y una
+    línea final con `summary`. No se devuelven textos ni vectores.
+    """
+    return StreamingResponse(ingest_ndjson(request.stream()), media_type="application/x-ndjson")
+
+
+# =======================================================
+# Jobs de embeddings en segundo plano
+# =======================================================
+@app.post("/jobs", status_code=202, tags=['Jobs'])
+async def submit_job(request: TextRequest):
+    """
+    Encolar una LISTA de textos para generar y guardar sus embeddings en segundo plano.
+    Retorna el `job_id` enseguida; el avance se consulta en `GET /jobs/{job_id}` o
+    `GET /jobs/{job_id}/stream`.
+    """
+    try:
+        texts = [t.strip() for t in request.texts]
+        if any(not t for t in texts):
+            raise HTTPException(status_code=400, detail="Los textos no pueden estar vacíos")
+
+        job_id = await asyncio.to_thread(job_store.create_job, texts)
+        job = await asyncio.to_thread(job_store.get_job, job_id)
+        return {"job_id": job_id, "status": job["status"], "total": job["total"], "chunks": job["chunks"],
+                "queue": job_store.name, "workers": job_workers.stats()["workers"]}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        app_logger.error(f"Error in submit_job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@app.get("/jobs/workers", tags=['Jobs'])
+async def job_worker_stats():
+    """Workers de jobs corriendo en este proceso y chunks procesados."""
+    return job_workers.stats()
+
+
+@app.get("/jobs/{job_id}", tags=['Jobs'])
+async def get_job(job_id: int = Path(..., ge=1), include_chunks: bool = False):
+    """
+    Estado de un job: `status` (queued, running, done, failed), textos procesados y
+    fallidos y `progress` (0-1). Con `include_chunks=true` incluye los `document_ids` por chunk.
+    """
+    try:
+        job = await asyncio.to_thread(job_store.get_job, job_id, include_chunks)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+        return job
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        app_logger.error(f"Error in get_job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@app.get("/jobs/{job_id}/stream", tags=['Jobs'])
+async def stream_job(job_id: int = Path(..., ge=1)):
+    """
+    Avance de un job como NDJSON: una línea cada vez que cambia, hasta que termina.
+    """
+    job = await asyncio.to_thread(job_store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    async def progress_lines():
+        current = job
+        last = None
+        while True:
+            snapshot = (current["status"], current["processed"], current["failed"])
+            if snapshot != last:
+                yield json.dumps(current) + "\n"
+                last = snapshot
+            if current["status"] in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(JOBS_POLL_INTERVAL_SECONDS)
+            current = await asyncio.to_thread(job_store.get_job, job_id)
+
+    return StreamingResponse(progress_lines(), media_type="application/x-ndjson")
+
+
 # ============================================
 # Endpoint para buscar documentos similares
 # ============================================
 @app.post("/search", tags=['Search'])
-def search_documents(text: str, limit: int = Query(5, ge=1, le=20)):
+async def search_documents(
+    text: str,
+    limit: int = Query(5, ge=1, le=20),
+    metadata: Optional[str] = Query(None, description='JSON que debe contener metadata, ej: {"lang": "es"}'),
+    created_from: Optional[datetime] = Query(None, description="Solo documentos con created_at >= created_from"),
+    created_to: Optional[datetime] = Query(None, description="Solo documentos con created_at < created_to"),
+    keyword: Optional[str] = Query(None, description="Consulta de texto completo sobre content"),
+    mode: str = Query("vector", pattern="^(vector|hybrid)$", description="vector o hybrid (RRF con keyword)"),
+    aggregate: str = Query(CHUNK_SEARCH_AGGREGATE, pattern="^(max|sum)$", description="Con chunking: max o sum de los chunks por documento"),
+    format: Optional[str] = Query(None, description="json (default) o binary (solo ids y similitudes)"),
+    accept: Optional[str] = Header(None)
+):
     """
     Buscar documentos similares en la base de datos usando similitud coseno.
     - **text**: Texto de consulta para generar embedding y buscar similares
     - **limit**: Número máximo de resultados (1-20, default 5)
+    - **metadata**, **created_from**, **created_to**, **keyword**: prefiltros opcionales (indexados)
+    - **mode**: "vector" rankea solo por similitud; "hybrid" fusiona (RRF) el ranking vectorial
+      con el de texto completo de **keyword**
+    - **aggregate**: con CHUNKING_ENABLED=1, cada documento se rankea por su mejor chunk (`max`)
+      o por la suma de sus chunks encontrados (`sum`); los resultados traen `chunk_hits`
+    Las consultas repetidas (o, con SEARCH_CACHE_MAX_DISTANCE, muy parecidas) se responden
+    desde la caché de resultados hasta la próxima escritura (ver /search/cache/stats).
+    - **format**: `binary` devuelve solo ids y similitudes empaquetados (SIM1, ver response_formats.py)
     """
     try:
         if not text or not text.strip():
             raise HTTPException(status_code=400, detail="El texto no puede estar vacío")
+        response_format = resolve_format(format, accept)
 
-        # Generar embedding del texto de consulta
-        embeddings = get_embeddings_from_hf([text.strip()])
-
-        # Buscar documentos similares
-        results = search_similar_documents(embeddings[0], limit)
+        try:
+            metadata_filter = json.loads(metadata) if metadata else None
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="metadata debe ser un objeto JSON válido")
+        if metadata_filter is not None and not isinstance(metadata_filter, dict):
+            raise HTTPException(status_code=400, detail="metadata debe ser un objeto JSON válido")
+
+        keyword = keyword.strip() if keyword else None
+        if mode == "hybrid" and not keyword:
+            raise HTTPException(status_code=400, detail="El modo hybrid requiere keyword")
+
+        filters = SearchFilters(
+            metadata=metadata_filter, created_from=created_from, created_to=created_to, keyword=keyword
+        )
+
+        # Caché de resultados (search_cache.py): la capa exacta evita también el embedding
+        scope = search_scope(limit, mode, aggregate, filters.model_dump(exclude_none=True))
+        generation = search_cache.generation
+        results = search_cache.get(scope, text)
+        if results is None:
+            # Generar embedding del texto de consulta
+            # Durante una migración de modelo, tras el cutover la consulta usa el modelo destino
+            started = time.perf_counter()
+            embeddings = await aembed_for_search([text.strip()])
+            embedded = time.perf_counter()
+
+            results = search_cache.get_similar(scope, embeddings[0])
+            if results is None:
+                # Buscar documentos similares
+                results = await asearch_similar_documents(embeddings[0], limit, filters=filters, mode=mode, aggregate=aggregate)
+                search_cache.put(scope, text, embeddings[0], results, generation,
+                                 embed_seconds=embedded - started, search_seconds=time.perf_counter() - embedded)
+
+        if response_format == "binary":
+            return binary_response(pack_search_results([results], limit), headers={"X-Model": MODEL_NAME})
 
         return {
             "query_text": text.strip(),
             "results": results,
             "model": MODEL_NAME,
-            "limit": limit
+            "limit": limit,
+            "mode": mode,
+            "filters": filters.model_dump(exclude_none=True)
         }
 
     except HTTPException:
@@ -260,71 +584,189 @@ def search_documents(text: str, limit: int = Query(5, ge=1, le=20)):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+# ============================================
+# Endpoint para buscar documentos similares a VARIAS consultas
+# ============================================
+@app.post("/search/batch", tags=['Search'])
+async def search_documents_batch(
+    request: BatchSearchRequest,
+    format: Optional[str] = Query(None, description="json (default) o binary (solo ids y similitudes)"),
+    accept: Optional[str] = Header(None)
+):
+    """
+    Buscar documentos similares para una LISTA de consultas en una sola llamada.
+    - **texts**: Textos de consulta (hasta 1000)
+    - **limit**: Resultados por consulta (1-20, default 5)
+    - **format**: `binary` devuelve una matriz consultas x limit de ids y otra de similitudes
+      (SIM1, ver response_formats.py)
+    Los embeddings se piden en un solo batch y todas las consultas se resuelven juntas.
+    """
+    try:
+        texts = [t.strip() for t in request.texts]
+        if any(not t for t in texts):
+            raise HTTPException(status_code=400, detail="Los textos no pueden estar vacíos")
+        response_format = resolve_format(format, accept)
+
+        embeddings = await aembed_for_search(texts)
+        results = await asearch_similar_documents_batch(embeddings, request.limit)
+
+        if response_format == "binary":
+            return binary_response(pack_search_results(results, request.limit), headers={"X-Model": MODEL_NAME})
+
+        return {
+            "results": [
+                {"query_text": text, "results": query_results}
+                for text, query_results in zip(texts, results)
+            ],
+            "count": len(texts),
+            "model": MODEL_NAME,
+            "limit": request.limit
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        app_logger.error(f"Error in search_documents_batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+# ============================================
+# Estadísticas de la caché de resultados de /search
+# ============================================
+@app.get("/search/cache/stats", tags=['Search'])
+async def search_cache_stats():
+    """
+    Hits exactos y por similitud, misses, invalidaciones por escrituras y segundos ahorrados
+    (embedding + búsqueda de cada hit exacto, búsqueda de cada hit por similitud).
+    """
+    return search_cache.stats()
+
+
+# ============================================
+# Estado de la migración de modelo (model_migration.py)
+# ============================================
+@app.get("/migration/status", tags=['Search'])
+async def migration_status():
+    """
+    Migración de modelo/dimensiones en curso: modelo y columna destino, cobertura,
+    throughput del backfill, ETA y columna que usa /search.
+    """
+    try:
+        return await aget_migration_status()
+    except Exception as e:
+        app_logger.error(f"Error in migration_status: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+# ============================================
+# Endpoints del índice ANN en memoria
+# ============================================
+@app.get("/search/index", tags=['Search'])
+async def search_index_status():
+    """
+    Estado del índice ANN: habilitado, listo (cargado y no vencido), cantidad de vectores,
+    listas IVF, nprobe, antigüedad de la carga y cantidad de búsquedas que cayeron a pgvector.
+    """
+    return ann_index.status()
+
+
+@app.get("/search/index/recall", tags=['Search'])
+async def search_index_recall(k: int = Query(10, ge=1, le=100), samples: int = Query(100, ge=1, le=1000),
+                              nprobe: int = Query(ANN_INDEX_NPROBE, ge=1)):
+    """
+    Mide recall@k del índice ANN contra la búsqueda exacta, con vectores del propio índice
+    como consultas. Sirve para elegir nprobe (recall vs latencia).
+    """
+    result = await asyncio.to_thread(ann_index.recall_at_k, k=k, samples=samples, nprobe=nprobe)
+    if "error" in result:
+        raise HTTPException(status_code=409, detail=result["error"])
+    return result
+
+
+@app.post("/search/index/reload", tags=['Search'])
+async def search_index_reload():
+    """
+    Recarga el índice ANN desde la tabla documents en segundo plano.
+    """
+    if not ANN_INDEX_ENABLED:
+        raise HTTPException(status_code=409, detail="El índice ANN está deshabilitado; requiere ANN_INDEX_ENABLED=1")
+    ann_index.start_background_load()
+    return {"reloading": True}
+
+
 # ============================================
 # Endpoint para obtener información de la tabla documents
 # ============================================
 @app.get("/documents/info", tags=['Documents'])
-def documents_info():
+async def documents_info():
     """
     Retorna métricas básicas de la tabla `documents` necesarias para un dashboard:
     - count: cantidad de registros
     - earliest_created_at: fecha del registro más antiguo (created_at)
     - latest_created_at: fecha del registro más reciente (created_at)
 
-    Nota: Implementación mínima usando el cliente `supabase` ya presente en el proyecto.
+    Con DOCUMENT_COUNTERS_ENABLED=1 se leen de la tabla de contadores, sin recorrer documents
+    (document_counters.py); se cachean por DOCUMENTS_STATS_TTL_SECONDS.
     """
     try:
-        conn = get_connection()
-        try:
-            with conn.cursor() as cur:
-                # Cantidad total de registros
-                cur.execute("SELECT COUNT(*) AS total FROM documents;")
-                total_count = cur.fetchone()['total']
-
-                # Fecha del registro más antiguo
-                cur.execute("SELECT created_at FROM documents ORDER BY created_at ASC LIMIT 1;")
-                row = cur.fetchone()
-                earliest = str(row['created_at']) if row else None
-
-                # Fecha del registro más reciente
-                cur.execute("SELECT created_at FROM documents ORDER BY created_at DESC LIMIT 1;")
-                row = cur.fetchone()
-                latest = str(row['created_at']) if row else None
-        finally:
-            conn.close()
+        stats = await document_stats.aget()
+        return {key: stats[key] for key in ("count", "earliest_created_at", "latest_created_at")}
+    except Exception as e:
+        app_logger.exception(f"Error fetching documents info: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-        return {
-            'count': total_count,
-            'earliest_created_at': earliest,
-            'latest_created_at': latest
-        }
+
+@app.get("/documents/stats", tags=['Documents'])
+async def documents_stats():
+    """
+    Estadísticas para el dashboard: las de /documents/info más el largo promedio de content
+    (`avg_content_length`), la cantidad por modelo (`by_model`) y el origen (`counters` o `scan`).
+    """
+    try:
+        return await document_stats.aget()
     except Exception as e:
-        import traceback
-        tb = traceback.format_exc()
-        app_logger.error(f"Error fetching documents info: {str(e)}\n{tb}")
-        print(f"TRACEBACK ERROR: {tb}")
+        app_logger.error(f"Error fetching documents stats: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+# ============================================
+# Endpoint de métricas en formato Prometheus
+# ============================================
+@app.get("/metrics", tags=['Home'])
+async def metrics():
+    """
+    Histogramas de latencia por etapa (hf_call, serialize, db_connect, db_query, encode) y
+    por ruta HTTP, en el formato de texto de Prometheus.
+    """
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+# ============================================
+# Endpoint de métricas del pool de conexiones a Neon
+# ============================================
+@app.get("/db/pool-stats", tags=['Documents'])
+async def db_pool_stats():
+    """
+    Métricas del pool de conexiones: modo (pool/oneshot), checkouts, tiempo de espera
+    promedio y máximo, conexiones abiertas, ociosas y recicladas.
+    """
+    return {"async": get_async_pool_stats(), "sync": get_pool_stats()}
+
 # ============================================
 # Endpoint para obtener los n últimos registros de documents
 # ============================================
 from fastapi import Query
 
 @app.get("/documents/latest", tags=['Documents'])
-def documents_latest(n: int = Query(5, ge=1)):
+async def documents_latest(n: int = Query(5, ge=1, le=DOCUMENTS_PAGE_MAX), cursor: Optional[str] = None):
     """
     Devuelve los n últimos registros de la tabla documents, ordenados por created_at descendente.
-    - n: cantidad de registros a devolver (default 5, sin límite máximo)
+    - n: cantidad de registros a devolver (default 5, máximo DOCUMENTS_PAGE_MAX)
+    - cursor: `next_cursor` de la respuesta anterior para pedir la página siguiente
     """
     try:
-        conn = get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT id, content, metadata, created_at FROM documents ORDER BY created_at DESC LIMIT %s;", (n,))
-                rows = [dict(r) for r in cur.fetchall()]
-        finally:
-            conn.close()
-        return {'latest_documents': rows}
+        rows, next_cursor = await afetch_page("created_desc", n, cursor)
+        return {'latest_documents': rows, 'next_cursor': next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         app_logger.error(f"Error fetching latest documents: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -333,20 +775,17 @@ def documents_latest(n: int = Query(5, ge=1)):
 # Endpoint para obtener los n primeros registros de documents
 # ============================================
 @app.get("/documents/earliest", tags=['Documents'])
-def documents_earliest(n: int = Query(5, ge=1)):
+async def documents_earliest(n: int = Query(5, ge=1, le=DOCUMENTS_PAGE_MAX), cursor: Optional[str] = None):
     """
     Devuelve los n primeros registros de la tabla documents, ordenados por created_at ascendente.
-    - n: cantidad de registros a devolver (default 5, sin límite máximo)
+    - n: cantidad de registros a devolver (default 5, máximo DOCUMENTS_PAGE_MAX)
+    - cursor: `next_cursor` de la respuesta anterior para pedir la página siguiente
     """
     try:
-        conn = get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT id, content, metadata, created_at FROM documents ORDER BY created_at ASC LIMIT %s;", (n,))
-                rows = [dict(r) for r in cur.fetchall()]
-        finally:
-            conn.close()
-        return {'earliest_documents': rows}
+        rows, next_cursor = await afetch_page("created_asc", n, cursor)
+        return {'earliest_documents': rows, 'next_cursor': next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         app_logger.error(f"Error fetching earliest documents: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -357,20 +796,25 @@ def documents_earliest(n: int = Query(5, ge=1)):
 from fastapi import Path
 
 @app.delete("/documents/{id}", tags=['Documents'])
-def delete_document(id: int = Path(..., description="ID del documento a borrar")):
+async def delete_document(id: int = Path(..., description="ID del documento a borrar")):
     """
     Elimina un registro de la tabla documents por su id.
     """
     try:
-        conn = get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute("DELETE FROM documents WHERE id = %s RETURNING id;", (id,))
-                deleted_row = cur.fetchone()
-            conn.commit()
-        finally:
-            conn.close()
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                if CHUNKING_ENABLED:
+                    # Los chunks también se borran (y se sacan del índice ANN) junto con su padre
+                    await cur.execute("DELETE FROM documents WHERE id = %s OR parent_id = %s RETURNING id;", (id, id))
+                else:
+                    await cur.execute("DELETE FROM documents WHERE id = %s RETURNING id;", (id,))
+                deleted_ids = [row["id"] for row in await cur.fetchall()]
+            await conn.commit()
+        deleted_row = id in deleted_ids
         if deleted_row:
+            ann_index.remove(deleted_ids)
+            document_stats.invalidate()
+            search_cache.invalidate()
             return {"deleted": True, "id": id}
         else:
             raise HTTPException(status_code=404, detail=f"Documento con id {id} no encontrado")
@@ -380,32 +824,102 @@ def delete_document(id: int = Path(..., description="ID del documento a borrar")
         app_logger.error(f"Error deleting document: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+# ============================================
+# Borrado y re-embed en lote (document_bulk.py)
+# ============================================
+@app.post("/documents/delete", tags=['Documents'])
+async def delete_documents_bulk(selection: DocumentSelection,
+                                limit: int = Query(DOCUMENTS_BULK_MAX_ROWS, ge=1, le=DOCUMENTS_BULK_MAX_ROWS)):
+    """
+    Borra en una sola sentencia los documentos seleccionados por lista de ids (`ids`), rango
+    (`start_id`, `end_id`) y/o filtro de metadata (`metadata`), combinados con AND.
+    - **limit**: máximo de documentos a borrar; con `has_more` se repite el request
+    Retorna `count` e `ids` de los documentos borrados.
+    """
+    try:
+        if selection.is_empty():
+            raise HTTPException(status_code=400, detail="Indicar ids, start_id/end_id o metadata")
+        result = await adelete_documents(selection, limit)
+        ann_index.remove(result.pop("removed_ids"))
+        document_stats.invalidate()
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        app_logger.error(f"Error in delete_documents_bulk: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@app.post("/documents/reembed", tags=['Documents'])
+async def reembed_documents(selection: DocumentSelection,
+                            batch_size: int = Query(REEMBED_BATCH_SIZE, ge=1, le=1000, description="Filas por pasada"),
+                            max_rows: int = Query(DOCUMENTS_BULK_MAX_ROWS, ge=1, le=DOCUMENTS_BULK_MAX_ROWS),
+                            after_id: int = Query(0, ge=0, description="next_after_id de la respuesta anterior")):
+    """
+    Recalcula en su lugar los embeddings de los documentos seleccionados (misma selección que
+    /documents/delete), en pasadas de `batch_size` filas con un commit por pasada. Los vectores
+    se piden de nuevo al backend sin usar la caché, y la caché y el índice ANN se actualizan
+    con los nuevos. Si se llega a `max_rows`, `next_after_id` indica desde dónde seguir.
+    """
+    try:
+        if selection.is_empty():
+            raise HTTPException(status_code=400, detail="Indicar ids, start_id/end_id o metadata")
+        try:
+            result = await areembed_documents(selection, arefresh_embeddings, batch_size, max_rows, after_id,
+                                              on_pass=ann_index.add)
+        finally:
+            document_stats.invalidate()
+        return {**result, "model": MODEL_NAME}
+    except HTTPException:
+        raise
+    except Exception as e:
+        app_logger.error(f"Error in reembed_documents: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
 # ============================================
 # Endpoint para obtener un rango de registros por id en documents
 # ============================================
 @app.get("/documents/range", tags=['Documents'])
-def documents_range(start_id: int = Query(..., description="ID del registro inicial"), limit: int = Query(..., ge=1, description="Cantidad de registros a recuperar")):
+async def documents_range(start_id: Optional[int] = Query(None, description="ID del registro inicial"),
+                          limit: int = Query(..., ge=1, le=DOCUMENTS_PAGE_MAX, description="Cantidad de registros a recuperar"),
+                          cursor: Optional[str] = Query(None, description="next_cursor de la respuesta anterior")):
     """
     Devuelve una cantidad específica de registros a partir de un ID inicial.
-    - start_id: ID del registro desde donde comenzar
-    - limit: Cantidad de registros a recuperar (mínimo 1, sin límite máximo)
+    - start_id: ID del registro desde donde comenzar (no hace falta si se pasa cursor)
+    - limit: Cantidad de registros a recuperar (mínimo 1, máximo DOCUMENTS_PAGE_MAX)
+    - cursor: `next_cursor` de la respuesta anterior para seguir desde ahí
     """
     try:
-        conn = get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT id, content, metadata, created_at FROM documents WHERE id >= %s ORDER BY id ASC LIMIT %s;",
-                    (start_id, limit)
-                )
-                rows = [dict(r) for r in cur.fetchall()]
-        finally:
-            conn.close()
-        return {'documents_range': rows, 'start_id': start_id, 'limit': limit, 'count': len(rows)}
+        if start_id is None and not cursor:
+            raise HTTPException(status_code=400, detail="Se requiere start_id o cursor")
+        rows, next_cursor = await afetch_page("id_asc", limit, cursor, start_id=start_id)
+        return {'documents_range': rows, 'start_id': start_id, 'limit': limit, 'count': len(rows),
+                'next_cursor': next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         app_logger.error(f"Error fetching documents range: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+# ============================================
+# Endpoint de exportación de documents (NDJSON en streaming)
+# ============================================
+@app.get("/documents/export", tags=['Documents'])
+async def documents_export(include_embeddings: bool = False,
+                           dtype: str = Query("float32", description="float32 o float16 (con include_embeddings)"),
+                           after_id: int = Query(0, ge=0, description="Exportar solo los id mayores (para retomar)")):
+    """
+    Exporta toda la tabla documents como NDJSON (una línea por documento, ordenadas por id),
+    leyendo con un cursor del lado del servidor. Con include_embeddings cada línea trae
+    `embedding` como base64 de la matriz little-endian en el dtype pedido.
+    """
+    if dtype not in DTYPES:
+        raise HTTPException(status_code=400, detail=f"dtype debe ser uno de {', '.join(DTYPES)}")
+    return StreamingResponse(
+        aexport_documents(include_embeddings, dtype, after_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="documents.ndjson"'},
+    )
 
 if __name__ == "__main__":
     import uvicorn
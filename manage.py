@@ -0,0 +1,220 @@
+"""
+Comandos de mantenimiento de la base (se corren a mano o desde un cron, no desde la app).
+
+Uso (desde la raíz del repo):
+    python manage.py quantize-backfill --kind halfvec --batch-size 1000
+    python manage.py quantize-status --kind bit
+    python manage.py migrate-start --model BAAI/bge-base-en-v1.5 --dimensions 768
+    python manage.py migrate-run --batch-size 64 --rate 50
+    python manage.py migrate-status
+    python manage.py stats-reconcile --dry-run
+    python manage.py import-corpus corpus.jsonl --batch-size 256 --workers 4
+    python manage.py export-snapshot snapshots/documents --dtype float16
+"""
+import sys
+import json
+import time
+import argparse
+import logging
+from database import connection
+from quantization import QUANTIZERS, QUANTIZED_STORAGE, backfill_sql, status_sql
+import model_migration
+import document_counters
+
+app_logger = logging.getLogger(__name__)
+
+
+# ============================================>
+# Cuantización (quantization.py)
+# ============================================>
+def quantize_status(args) -> int:
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(status_sql(args.kind))
+            row = cur.fetchone()
+    pending = row["total"] - row["quantized"]
+    print(f"[{args.kind}] {row['quantized']}/{row['total']} filas cuantizadas, {pending} pendientes")
+    return 0
+
+
+def quantize_backfill(args) -> int:
+    """
+    Completa la columna cuantizada de las filas existentes en lotes (un commit por lote),
+    para no bloquear la tabla. Se puede cortar y volver a correr: retoma por las filas en NULL.
+    """
+    sql = backfill_sql(args.kind)
+    updated = 0
+    start = time.monotonic()
+    while True:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (args.batch_size,))
+                batch = len(cur.fetchall())
+            conn.commit()
+        updated += batch
+        elapsed = time.monotonic() - start
+        print(f"[{args.kind}] {updated} filas actualizadas ({updated / elapsed if elapsed else 0:.0f} filas/s)")
+        if batch < args.batch_size:
+            break
+        if args.sleep:
+            time.sleep(args.sleep)
+    return quantize_status(args)
+
+
+# ============================================>
+# Migración de modelo / dimensiones (model_migration.py)
+# ============================================>
+def _print_status(status) -> None:
+    print(json.dumps(status, indent=2, ensure_ascii=False, default=str))
+
+
+def migrate_start(args) -> int:
+    _print_status(model_migration.start_migration(args.model, args.dimensions, args.column, args.backend))
+    return 0
+
+
+def migrate_run(args) -> int:
+    try:
+        _print_status(model_migration.run_backfill(args.batch_size, args.rate, cutover=not args.no_cutover))
+    except KeyboardInterrupt:
+        print("Interrumpido; volver a correr migrate-run para continuar")
+        _print_status(model_migration.get_migration_status())
+        return 130
+    return 0
+
+
+def migrate_status(args) -> int:
+    _print_status(model_migration.get_migration_status())
+    return 0
+
+
+def migrate_cutover(args) -> int:
+    migration = model_migration.active_migration()
+    if migration is None or migration["status"] != "backfilling":
+        print("No hay una migración en backfill")
+        return 1
+    if not model_migration.try_cutover(migration):
+        print("La cobertura todavía no es del 100%; correr migrate-run")
+        return 1
+    _print_status(model_migration.get_migration_status())
+    return 0
+
+
+def migrate_close(args) -> int:
+    migration = model_migration.set_status(args.status)
+    if migration is None:
+        print("No hay una migración activa")
+        return 1
+    print(f"Migración {migration['id']} ({migration['target_model']}) -> {args.status}")
+    return 0
+
+
+# ============================================>
+# Contadores de /documents/info y /documents/stats (document_counters.py)
+# ============================================>
+def stats_reconcile(args) -> int:
+    result = document_counters.reconcile(dry_run=args.dry_run)
+    _print_status(result)
+    if not result["drift"]:
+        print("document_counters coincide con documents")
+    elif args.dry_run:
+        print("Sin cambios (--dry-run); correr sin --dry-run para corregir")
+    return 0
+
+
+# ============================================>
+# Corpus offline: importación y snapshots (corpus_import.py, vector_snapshot.py)
+# ============================================>
+def import_corpus(args) -> int:
+    # Import diferido: hf_client exige HF_TOKEN y los demás comandos no lo necesitan
+    import corpus_import
+
+    try:
+        result = corpus_import.import_file(args.path, fmt=args.format, text_field=args.text_field,
+                                           batch_size=args.batch_size or corpus_import.IMPORT_BATCH_SIZE,
+                                           workers=args.workers or corpus_import.IMPORT_WORKERS,
+                                           offset=args.offset, limit=args.limit, checkpoint=args.checkpoint)
+    except KeyboardInterrupt:
+        print("Interrumpido; volver a correr import-corpus para retomar desde el checkpoint")
+        return 130
+    _print_status(result)
+    return 0
+
+
+def export_snapshot(args) -> int:
+    import vector_snapshot
+
+    _print_status(vector_snapshot.export_snapshot(args.prefix, dtype=args.dtype, batch_size=args.batch_size))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Mantenimiento de la tabla documents")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    kinds = list(QUANTIZERS)
+    default_kind = QUANTIZED_STORAGE or "halfvec"
+
+    backfill = commands.add_parser("quantize-backfill", help="Completar la columna cuantizada de las filas existentes")
+    backfill.add_argument("--kind", choices=kinds, default=default_kind)
+    backfill.add_argument("--batch-size", type=int, default=1000)
+    backfill.add_argument("--sleep", type=float, default=0.0, help="Pausa entre lotes (segundos)")
+    backfill.set_defaults(handler=quantize_backfill)
+
+    status = commands.add_parser("quantize-status", help="Filas cuantizadas y pendientes")
+    status.add_argument("--kind", choices=kinds, default=default_kind)
+    status.set_defaults(handler=quantize_status)
+
+    start = commands.add_parser("migrate-start", help="Agregar la columna del modelo nuevo y empezar el dual-write")
+    start.add_argument("--model", required=True)
+    start.add_argument("--dimensions", type=int, required=True)
+    start.add_argument("--column", help="Nombre de la columna nueva (default: embedding_<modelo>)")
+    start.add_argument("--backend", choices=["hf", "local"], default=model_migration.EMBEDDING_BACKEND)
+    start.set_defaults(handler=migrate_start)
+
+    run = commands.add_parser("migrate-run", help="Recalcular los documentos existentes y hacer el cutover")
+    run.add_argument("--batch-size", type=int, default=64)
+    run.add_argument("--rate", type=float, default=0.0, help="Máximo de textos por segundo (0 = sin límite)")
+    run.add_argument("--no-cutover", action="store_true", help="No pasar /search a la columna nueva al terminar")
+    run.set_defaults(handler=migrate_run)
+
+    commands.add_parser("migrate-status", help="Cobertura, throughput y ETA").set_defaults(handler=migrate_status)
+    commands.add_parser("migrate-cutover", help="Pasar /search a la columna nueva (requiere 100%% de cobertura)").set_defaults(handler=migrate_cutover)
+
+    finish = commands.add_parser("migrate-finish", help="Cerrar la migración (después de renombrar columnas y actualizar constants.py)")
+    finish.set_defaults(handler=migrate_close, status="finished")
+    abort = commands.add_parser("migrate-abort", help="Cancelar la migración (la columna nueva queda sin usar)")
+    abort.set_defaults(handler=migrate_close, status="aborted")
+
+    reconcile = commands.add_parser("stats-reconcile", help="Recalcular document_counters desde documents")
+    reconcile.add_argument("--dry-run", action="store_true", help="Solo mostrar la diferencia")
+    reconcile.set_defaults(handler=stats_reconcile)
+
+    corpus = commands.add_parser("import-corpus", help="Importar un archivo txt/jsonl/csv a documents")
+    corpus.add_argument("path")
+    corpus.add_argument("--format", choices=["txt", "jsonl", "csv"], help="Default: según la extensión")
+    corpus.add_argument("--text-field", default="text", help="Campo (jsonl) o columna (csv) con el texto")
+    corpus.add_argument("--batch-size", type=int, default=None, help="Registros por lote (default IMPORT_BATCH_SIZE)")
+    corpus.add_argument("--workers", type=int, default=None, help="Lotes embebidos en paralelo (default IMPORT_WORKERS)")
+    corpus.add_argument("--offset", type=int, help="Registro desde el que empezar (default: el del checkpoint)")
+    corpus.add_argument("--limit", type=int, help="Máximo de registros a procesar en esta corrida")
+    corpus.add_argument("--checkpoint", help="Archivo de checkpoint (default: <path>.import.json)")
+    corpus.set_defaults(handler=import_corpus)
+
+    snapshot = commands.add_parser("export-snapshot", help="Exportar los embeddings a un snapshot .npy")
+    snapshot.add_argument("prefix", help="Ruta sin extensión (genera <prefix>.npy, .ids.npy y .json)")
+    snapshot.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    snapshot.add_argument("--batch-size", type=int, default=5000)
+    snapshot.set_defaults(handler=export_snapshot)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO)
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+"""
+Tiempos por etapa del pipeline de embeddings/búsqueda y endpoint /metrics (Prometheus).
+
+Cada etapa se mide con `with timed("etapa"):` y se acumula en dos lugares:
+- Un histograma global por etapa (embeddings_stage_seconds{stage=...}), expuesto en
+  formato de texto de Prometheus por render_prometheus().
+- Los tiempos del request en curso (ContextVar), que el middleware de main.py devuelve en
+  el header Server-Timing (ej. `hf_call;dur=182.4, db_query;dur=6.1, total;dur=195.0`).
+  Si una etapa corre varias veces en el mismo request (chunks en paralelo), se suma.
+
+Etapas: hf_call (backend de embeddings), serialize (vectores a literales de pgvector),
+db_connect (checkout del pool o conexión nueva), db_query (sentencias de búsqueda e
+inserción) y encode (empaquetado base64/binario de la respuesta).
+
+Sin dependencias externas: los histogramas son contadores por bucket protegidos por un lock.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "1") == "1"
+
+# Límites superiores de los buckets (segundos)
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """
+    Histograma con buckets fijos y una serie por combinación de labels.
+    """
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets=_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [conteos por bucket (+Inf al final), suma, cantidad]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, labels: Tuple[str, ...], seconds: float) -> None:
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(snapshot.items()):
+            base = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = base + "," if base else ""
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            suffix = f"{{{base}}}" if base else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+stage_seconds = Histogram("embeddings_stage_seconds", "Duración de cada etapa del pipeline", ("stage",))
+request_seconds = Histogram("embeddings_http_request_seconds", "Duración de los requests HTTP",
+                            ("method", "route", "status"))
+
+
+# ============================================>
+# Medición de etapas
+# ============================================>
+def observe_stage(stage: str, seconds: float) -> None:
+    if not METRICS_ENABLED:
+        return
+    stage_seconds.observe((stage,), seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Mide el bloque como la etapa `stage` (también dentro de funciones async).
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+# ============================================>
+# Tiempos por request (Server-Timing)
+# ============================================>
+def start_request() -> Dict[str, float]:
+    """
+    Abre el registro de tiempos del request en curso (lo llama el middleware).
+    """
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings: Dict[str, float], total: float) -> str:
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float) -> None:
+    if METRICS_ENABLED:
+        request_seconds.observe((method, route, str(status)), seconds)
+
+
+def render_prometheus() -> str:
+    return "\n".join(stage_seconds.render() + request_seconds.render()) + "\n"
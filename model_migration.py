@@ -0,0 +1,536 @@
+import os
+import re
+import time
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+import psycopg2.extras
+from constants import MODEL_NAME
+from database import connection
+from database_async import async_connection
+from embedding_backends import EMBEDDING_BACKEND
+from vectors import as_matrix, to_pgvector_literals
+from search_cache import search_cache
+
+"""
+Migración online de modelo / dimensiones de embedding (sin cortar el servicio).
+
+Reemplaza el procedimiento manual de investigacion_modelos_embeddings.md (agregar columna,
+regenerar, borrar la vieja) por una migración registrada en la tabla embedding_migrations
+(sql/005_embedding_migrations.sql):
+
+1. `python manage.py migrate-start --model BAAI/bge-base-en-v1.5 --dimensions 768`
+   agrega la columna nueva (vector(768)) y registra la migración en estado "backfilling".
+2. Mientras tanto, cada INSERT de document_store escribe también la columna nueva
+   (dual-write) con el modelo destino. Si falla, la fila queda en NULL y la cubre el backfill.
+3. `python manage.py migrate-run --rate 50` recalcula los documentos existentes en lotes,
+   con límite de textos/segundo. Guarda el último id procesado en cada lote, así que se puede
+   cortar y volver a correr. Reporta throughput y ETA.
+4. Cuando la cobertura llega al 100%, un único UPDATE pasa la migración a "cutover" (solo si
+   no queda ninguna fila en NULL). Desde ese momento /search embebe la consulta con el modelo
+   destino y busca sobre la columna nueva. Cada instancia lo toma en a lo sumo
+   MODEL_MIGRATION_STATE_TTL_SECONDS. El dual-write sigue activo, y `migrate-run` se puede
+   volver a correr para cubrir las filas cuyo dual-write falló después del cutover.
+5. Para terminar: actualizar MODEL_NAME / MODEL_DIMENSIONS, renombrar columnas y correr
+   `python manage.py migrate-finish`.
+
+Con MODEL_MIGRATION_ENABLED=0 (default) la app no consulta la tabla y nada de esto corre.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+MODEL_MIGRATION_ENABLED = os.getenv("MODEL_MIGRATION_ENABLED", "0") == "1"
+MODEL_MIGRATION_STATE_TTL_SECONDS = float(os.getenv("MODEL_MIGRATION_STATE_TTL_SECONDS", "30"))
+# Pasadas en las que una fila puede fallar antes de que el backfill la saltee
+MODEL_MIGRATION_MAX_ROW_FAILURES = int(os.getenv("MODEL_MIGRATION_MAX_ROW_FAILURES", "3"))
+
+ACTIVE_STATUSES = ("backfilling", "cutover")
+SOURCE_COLUMN = "embedding"
+
+_COLUMN_RE = re.compile(r"^[a-z_][a-z0-9_]{0,62}$")
+
+_ACTIVE_SQL = """
+    SELECT id, target_model, target_dimensions, target_column, backend, status, last_id,
+           processed, throughput, started_at, updated_at, cutover_at
+    FROM embedding_migrations
+    WHERE status IN ('backfilling', 'cutover')
+    ORDER BY id DESC
+    LIMIT 1;
+"""
+_START_SQL = """
+    INSERT INTO embedding_migrations (target_model, target_dimensions, target_column, backend, status)
+    VALUES (%s, %s, %s, %s, 'backfilling')
+    RETURNING id;
+"""
+_PENDING_SQL = """
+    SELECT id, content FROM documents
+    WHERE id > %s AND {column} IS NULL AND embedding IS NOT NULL AND NOT (id = ANY(%s))
+    ORDER BY id
+    LIMIT %s;
+"""
+_WRITE_SQL = """
+    UPDATE documents SET {column} = v.vec::vector
+    FROM (VALUES %s) AS v(id, vec)
+    WHERE documents.id = v.id;
+"""
+_PROGRESS_SQL = """
+    UPDATE embedding_migrations
+    SET last_id = %s, processed = processed + %s, throughput = %s, updated_at = now()
+    WHERE id = %s;
+"""
+_RESTART_PASS_SQL = "UPDATE embedding_migrations SET last_id = 0, updated_at = now() WHERE id = %s;"
+# Cutover atómico: solo pasa si no queda ninguna fila sin la columna nueva.
+# Las filas padre de documentos divididos en chunks (chunking.py) no tienen embedding y no cuentan.
+_CUTOVER_SQL = """
+    UPDATE embedding_migrations
+    SET status = 'cutover', cutover_at = now(), updated_at = now()
+    WHERE id = %s AND status = 'backfilling'
+      AND NOT EXISTS (SELECT 1 FROM documents WHERE {column} IS NULL AND embedding IS NOT NULL)
+    RETURNING id;
+"""
+_COVERAGE_SQL = "SELECT COUNT(embedding) AS total, COUNT({column}) AS covered FROM documents;"
+_SET_STATUS_SQL = "UPDATE embedding_migrations SET status = %s, updated_at = now() WHERE id = %s AND status IN ('backfilling', 'cutover') RETURNING id;"
+
+
+# ============================================>
+# Estado de la migración activa (cacheado por proceso)
+# ============================================>
+class MigrationState:
+    """
+    Migración activa leída de embedding_migrations, refrescada cada
+    MODEL_MIGRATION_STATE_TTL_SECONDS. None si no hay migración (o está desactivado).
+    """
+
+    def __init__(self, ttl: float = MODEL_MIGRATION_STATE_TTL_SECONDS):
+        self.ttl = ttl
+        self._state: Optional[Dict[str, Any]] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _fresh(self) -> bool:
+        return time.monotonic() - self._loaded_at < self.ttl
+
+    def _store(self, row) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            previous = search_column(self._state)
+            self._state = dict(row) if row else None
+            self._loaded_at = time.monotonic()
+            state = self._state
+        # Cutover (o fin de la migración) hecho desde manage.py: los resultados cacheados son de la otra columna
+        if search_column(state) != previous:
+            search_cache.invalidate()
+        return state
+
+    def current(self) -> Optional[Dict[str, Any]]:
+        if not MODEL_MIGRATION_ENABLED:
+            return None
+        if self._fresh():
+            return self._state
+        try:
+            with connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(_ACTIVE_SQL)
+                    return self._store(cur.fetchone())
+        except Exception as e:
+            app_logger.error(f"No se pudo leer la migración activa: {str(e)}")
+            return self._state
+
+    async def acurrent(self) -> Optional[Dict[str, Any]]:
+        if not MODEL_MIGRATION_ENABLED:
+            return None
+        if self._fresh():
+            return self._state
+        try:
+            async with async_connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(_ACTIVE_SQL)
+                    return self._store(await cur.fetchone())
+        except Exception as e:
+            app_logger.error(f"No se pudo leer la migración activa: {str(e)}")
+            return self._state
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded_at = 0.0
+
+
+migration_state = MigrationState()
+
+_target_backends: Dict[tuple, Any] = {}
+_target_lock = threading.Lock()
+
+
+def target_backend(migration: Dict[str, Any]):
+    """Backend de embeddings del modelo destino (uno por modelo, creado en el primer uso)."""
+    from hf_client import _create_backend
+
+    key = (migration["backend"], migration["target_model"], migration["target_dimensions"])
+    with _target_lock:
+        if key not in _target_backends:
+            _target_backends[key] = _create_backend(*key)
+        return _target_backends[key]
+
+
+def _target_literals(migration: Dict[str, Any], result) -> List[str]:
+    matrix = as_matrix(result)
+    if matrix.shape[1] != migration["target_dimensions"]:
+        raise RuntimeError(
+            f"{migration['target_model']} produjo {matrix.shape[1]} dimensiones y la columna "
+            f"{migration['target_column']} espera {migration['target_dimensions']}"
+        )
+    return to_pgvector_literals(matrix)
+
+
+def search_column(migration: Optional[Dict[str, Any]]) -> str:
+    """Columna sobre la que busca /search: la nueva solo después del cutover."""
+    if migration and migration["status"] == "cutover":
+        return migration["target_column"]
+    return SOURCE_COLUMN
+
+
+async def aembed_for_search(texts: List[str]) -> List[List[float]]:
+    """
+    Embeddings de consultas con el modelo que corresponde a la columna de búsqueda:
+    el de MODEL_NAME hasta el cutover y el modelo destino después.
+    """
+    from hf_client import aget_embeddings_from_hf, _to_http_exception
+
+    migration = await migration_state.acurrent()
+    if search_column(migration) == SOURCE_COLUMN:
+        return await aget_embeddings_from_hf(texts)
+    try:
+        result = await target_backend(migration).aembed(texts)
+    except Exception as e:
+        raise _to_http_exception(e)
+    return as_matrix(result).tolist()
+
+
+# ============================================>
+# Dual-write (llamado desde document_store y corpus_import)
+# ============================================>
+# Los embeddings del modelo destino se piden *antes* de abrir la transacción del INSERT
+# (prepare_dual_write) y dentro solo se escriben (dual_write): los triggers de
+# document_counters toman un lock por modelo al insertar, y esperar al modelo destino con
+# ese lock tomado serializaría toda la ingesta concurrente detrás de la latencia del backend.
+def prepare_dual_write(texts: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Embeddings de `texts` con el modelo de la migración activa: {'migration', 'literals'}
+    (literals: texto -> vector pgvector), o None si no hay migración o el backend falló (las
+    filas quedan en NULL y las cubre el backfill).
+    """
+    migration = migration_state.current()
+    if migration is None or not texts:
+        return None
+    unique = list(dict.fromkeys(texts))
+    try:
+        literals = _target_literals(migration, target_backend(migration).embed(unique))
+    except Exception as e:
+        app_logger.warning(f"Dual-write a {migration['target_column']} falló, lo cubrirá el backfill: {str(e)}")
+        return None
+    return {"migration": migration, "literals": dict(zip(unique, literals))}
+
+
+async def aprepare_dual_write(texts: List[str]) -> Optional[Dict[str, Any]]:
+    """Variante async de prepare_dual_write."""
+    migration = await migration_state.acurrent()
+    if migration is None or not texts:
+        return None
+    unique = list(dict.fromkeys(texts))
+    try:
+        literals = _target_literals(migration, await target_backend(migration).aembed(unique))
+    except Exception as e:
+        app_logger.warning(f"Dual-write a {migration['target_column']} falló, lo cubrirá el backfill: {str(e)}")
+        return None
+    return {"migration": migration, "literals": dict(zip(unique, literals))}
+
+
+def _dual_write_pairs(prepared: Optional[Dict[str, Any]], document_ids: List[Optional[int]], texts: List[str]) -> list:
+    if prepared is None:
+        return []
+    literals = prepared["literals"]
+    return [(doc_id, literals[text]) for doc_id, text in zip(document_ids, texts)
+            if doc_id is not None and text in literals]
+
+
+def dual_write(cur, document_ids: List[Optional[int]], texts: List[str], prepared: Optional[Dict[str, Any]]) -> None:
+    """
+    Escribe la columna de la migración activa para las filas recién insertadas, en la misma
+    transacción, con los vectores de prepare_dual_write. Los errores se registran y no cortan
+    el INSERT: el backfill cubre esas filas.
+    """
+    pairs = _dual_write_pairs(prepared, document_ids, texts)
+    if not pairs:
+        return
+    column = prepared["migration"]["target_column"]
+    cur.execute("SAVEPOINT dual_write;")
+    try:
+        psycopg2.extras.execute_values(cur, _WRITE_SQL.format(column=column), pairs,
+                                       template="(%s::bigint, %s)", page_size=len(pairs))
+        cur.execute("RELEASE SAVEPOINT dual_write;")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT dual_write;")
+        app_logger.warning(f"Dual-write a {column} falló, lo cubrirá el backfill: {str(e)}")
+
+
+async def adual_write(cur, document_ids: List[Optional[int]], texts: List[str],
+                      prepared: Optional[Dict[str, Any]]) -> None:
+    """Variante async de dual_write (psycopg 3)."""
+    pairs = _dual_write_pairs(prepared, document_ids, texts)
+    if not pairs:
+        return
+    column = prepared["migration"]["target_column"]
+    await cur.execute("SAVEPOINT dual_write;")
+    try:
+        values = ",".join(["(%s::bigint, %s)"] * len(pairs))
+        params = [value for pair in pairs for value in pair]
+        await cur.execute(_WRITE_SQL.format(column=column).replace("%s", values), params)
+        await cur.execute("RELEASE SAVEPOINT dual_write;")
+    except Exception as e:
+        await cur.execute("ROLLBACK TO SAVEPOINT dual_write;")
+        app_logger.warning(f"Dual-write a {column} falló, lo cubrirá el backfill: {str(e)}")
+
+
+# ============================================>
+# Operaciones de la migración (manage.py)
+# ============================================>
+def start_migration(model: str, dimensions: int, column: Optional[str] = None,
+                    backend: str = EMBEDDING_BACKEND) -> Dict[str, Any]:
+    """Agrega la columna nueva y registra la migración."""
+    column = column or "embedding_" + re.sub(r"[^a-z0-9]+", "_", model.split("/")[-1].lower()).strip("_")
+    if not _COLUMN_RE.match(column) or column == SOURCE_COLUMN:
+        raise ValueError(f"Nombre de columna inválido: {column}")
+    if model == MODEL_NAME:
+        raise ValueError(f"{model} ya es el modelo actual")
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_ACTIVE_SQL)
+            active = cur.fetchone()
+            if active:
+                raise RuntimeError(f"Ya hay una migración activa (id {active['id']}, {active['target_model']})")
+            cur.execute(f"ALTER TABLE documents ADD COLUMN IF NOT EXISTS {column} vector({int(dimensions)});")
+            cur.execute(_START_SQL, (model, dimensions, column, backend))
+            migration_id = cur.fetchone()["id"]
+        conn.commit()
+    migration_state.invalidate()
+    return get_migration_status()
+
+
+def skipped_ids(migration: Dict[str, Any]) -> List[int]:
+    """Filas que fallaron MODEL_MIGRATION_MAX_ROW_FAILURES pasadas y el backfill ya no intenta."""
+    failures = migration.get("row_failures", {})
+    return sorted(doc_id for doc_id, count in failures.items() if count >= MODEL_MIGRATION_MAX_ROW_FAILURES)
+
+
+def _embed_rows(migration: Dict[str, Any], rows: list) -> List[tuple]:
+    """
+    (id, vector) de las filas que el modelo destino pudo embeber. Si el lote falla se reintenta
+    fila por fila para aislar los textos que fallan siempre; si fallan todas, es el backend y
+    el error sube.
+    """
+    backend = target_backend(migration)
+    try:
+        literals = _target_literals(migration, backend.embed([row["content"] for row in rows]))
+        return [(row["id"], literal) for row, literal in zip(rows, literals)]
+    except Exception as e:
+        if len(rows) == 1:
+            batch_error = e
+        else:
+            app_logger.warning(f"Lote de backfill falló, reintentando fila por fila: {str(e)}")
+            batch_error = None
+
+    pairs, errors = [], {}
+    for row in rows:
+        try:
+            if batch_error is not None:
+                raise batch_error
+            pairs.append((row["id"], _target_literals(migration, backend.embed([row["content"]]))[0]))
+        except Exception as e:
+            errors[row["id"]] = e
+    if not pairs and len(rows) > 1:
+        raise next(iter(errors.values()))
+
+    failures = migration.setdefault("row_failures", {})
+    for doc_id, error in errors.items():
+        failures[doc_id] = failures.get(doc_id, 0) + 1
+        app_logger.warning(f"Backfill de la fila {doc_id} falló ({failures[doc_id]}/"
+                           f"{MODEL_MIGRATION_MAX_ROW_FAILURES}): {str(error)}")
+    return pairs
+
+
+def backfill_batch(migration: Dict[str, Any], batch_size: int) -> int:
+    """
+    Recalcula el siguiente lote de filas sin la columna nueva (id > last_id) y guarda el
+    avance. Retorna la cantidad de filas recorridas (0 = fin de la pasada); las que fallan
+    quedan en NULL para la pasada siguiente, hasta que se saltean (skipped_ids).
+    """
+    column = migration["target_column"]
+    start = time.monotonic()
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_PENDING_SQL.format(column=column), (migration["last_id"], skipped_ids(migration), batch_size))
+            rows = cur.fetchall()
+        conn.commit()
+    if not rows:
+        return 0
+
+    pairs = _embed_rows(migration, rows)
+    last_id = rows[-1]["id"]
+    with connection() as conn:
+        with conn.cursor() as cur:
+            if pairs:
+                psycopg2.extras.execute_values(cur, _WRITE_SQL.format(column=column), pairs,
+                                               template="(%s::bigint, %s)", page_size=len(pairs))
+            throughput = len(pairs) / max(time.monotonic() - start, 1e-6)
+            cur.execute(_PROGRESS_SQL, (last_id, len(pairs), throughput, migration["id"]))
+        conn.commit()
+    migration["last_id"] = last_id
+    migration["throughput"] = throughput
+    return len(rows)
+
+
+def restart_pass(migration: Dict[str, Any]) -> None:
+    """Vuelve a recorrer desde el principio (filas insertadas fuera de orden o con dual-write fallido)."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_RESTART_PASS_SQL, (migration["id"],))
+        conn.commit()
+    migration["last_id"] = 0
+
+
+def try_cutover(migration: Dict[str, Any]) -> bool:
+    """Pasa la migración a "cutover" si la cobertura es del 100%, en un único UPDATE."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_CUTOVER_SQL.format(column=migration["target_column"]), (migration["id"],))
+            done = cur.fetchone() is not None
+        conn.commit()
+    migration_state.invalidate()
+    if done:
+        search_cache.invalidate()
+    return done
+
+
+def set_status(status: str) -> Optional[Dict[str, Any]]:
+    """Cierra la migración activa ("finished" o "aborted")."""
+    migration = active_migration()
+    if migration is None:
+        return None
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_SET_STATUS_SQL, (status, migration["id"]))
+        conn.commit()
+    migration_state.invalidate()
+    search_cache.invalidate()
+    return migration
+
+
+def active_migration() -> Optional[Dict[str, Any]]:
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_ACTIVE_SQL)
+            row = cur.fetchone()
+    return dict(row) if row else None
+
+
+def _status_from(migration: Optional[Dict[str, Any]], coverage: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if migration is None:
+        return {"active": False, "search_column": SOURCE_COLUMN, "model": MODEL_NAME}
+    total, covered = coverage["total"], coverage["covered"]
+    remaining = total - covered
+    throughput = float(migration["throughput"] or 0)
+    status = {
+        "active": True,
+        "id": migration["id"],
+        "status": migration["status"],
+        "source_model": MODEL_NAME,
+        "target_model": migration["target_model"],
+        "target_dimensions": migration["target_dimensions"],
+        "target_column": migration["target_column"],
+        "search_column": search_column(migration),
+        "total": total,
+        "covered": covered,
+        "remaining": remaining,
+        "coverage": round(covered / total, 4) if total else 1.0,
+        "processed": migration["processed"],
+        "last_id": migration["last_id"],
+        "throughput_rows_per_second": round(throughput, 2),
+        "eta_seconds": round(remaining / throughput) if throughput and remaining else (0 if not remaining else None),
+    }
+    for key in ("started_at", "updated_at", "cutover_at"):
+        value = migration.get(key)
+        status[key] = value.isoformat() if hasattr(value, "isoformat") else value
+    return status
+
+
+def get_migration_status() -> Dict[str, Any]:
+    """Estado de la migración activa: cobertura, throughput del último lote y ETA."""
+    migration = active_migration()
+    coverage = None
+    if migration is not None:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(_COVERAGE_SQL.format(column=migration["target_column"]))
+                coverage = cur.fetchone()
+    return _status_from(migration, coverage)
+
+
+async def aget_migration_status() -> Dict[str, Any]:
+    """Variante async de get_migration_status (para GET /migration/status)."""
+    async with async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_ACTIVE_SQL)
+            migration = await cur.fetchone()
+            coverage = None
+            if migration is not None:
+                await cur.execute(_COVERAGE_SQL.format(column=migration["target_column"]))
+                coverage = await cur.fetchone()
+    return _status_from(dict(migration) if migration else None, coverage)
+
+
+def run_backfill(batch_size: int = 64, rate: float = 0.0, cutover: bool = True,
+                 report_every: float = 10.0) -> Dict[str, Any]:
+    """
+    Corre el backfill hasta cubrir todas las filas (o hasta Ctrl+C; se retoma donde quedó).
+    `rate` limita los textos por segundo enviados al modelo destino (0 = sin límite).
+    Después del cutover sigue cubriendo las filas cuyo dual-write falló. Las filas que fallan
+    MODEL_MIGRATION_MAX_ROW_FAILURES pasadas se saltean y se reportan en "skipped_ids".
+    """
+    migration = active_migration()
+    if migration is None:
+        raise RuntimeError("No hay una migración activa (python manage.py migrate-start ...)")
+
+    started = time.monotonic()
+    last_report = started
+    done = 0
+    while True:
+        batch_start = time.monotonic()
+        count = backfill_batch(migration, batch_size)
+        done += count
+
+        if count == 0:
+            status = get_migration_status()
+            if status["remaining"] <= len(skipped_ids(migration)):
+                break
+            # Quedaron filas detrás del cursor (inserts concurrentes o dual-write fallido)
+            app_logger.info(f"Quedan {status['remaining']} filas sin {migration['target_column']}, nueva pasada")
+            restart_pass(migration)
+            time.sleep(1)
+            continue
+
+        if rate > 0:
+            time.sleep(max(count / rate - (time.monotonic() - batch_start), 0))
+        if time.monotonic() - last_report >= report_every:
+            last_report = time.monotonic()
+            status = get_migration_status()
+            print(f"[{status['coverage']:.1%}] {status['covered']}/{status['total']} filas, "
+                  f"{done / (last_report - started):.1f} filas/s, ETA {status['eta_seconds']} s")
+
+    skipped = skipped_ids(migration)
+    if skipped:
+        app_logger.error(f"{len(skipped)} filas no se pudieron embeber con {migration['target_model']}: {skipped}")
+    elif cutover and migration["status"] == "backfilling" and try_cutover(migration):
+        print(f"[OK] Cutover: /search usa {migration['target_column']} ({migration['target_model']})")
+    status = get_migration_status()
+    status["skipped_ids"] = skipped
+    return status
@@ -0,0 +1,148 @@
+import os
+import logging
+from typing import Dict, Optional
+from constants import MODEL_DIMENSIONS
+
+"""
+Almacenamiento cuantizado de embeddings junto a la columna `embedding` (vector(384)).
+
+Con QUANTIZED_STORAGE activo, cada INSERT escribe además una versión cuantizada del vector
+y la búsqueda por SQL hace una primera pasada barata sobre esa columna (con su índice HNSW)
+para obtener limit * QUANTIZED_RESCORE_FACTOR candidatos, que después se reordenan con la
+distancia coseno exacta sobre `embedding`.
+
+- "halfvec": float16 (pgvector >= 0.7), mitad de espacio, recall casi idéntico.
+- "bit": cuantización binaria (1 bit por dimensión, 32x menos espacio) con distancia de
+  Hamming; necesita un factor de rescoring más alto.
+
+Columnas e índices en sql/004_quantized_vectors.sql. Las filas existentes se completan con
+`python manage.py quantize-backfill` y el recall/latencia de cada factor se mide con
+`python -m benchmarks.bench_quantization`.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+QUANTIZED_STORAGE = os.getenv("QUANTIZED_STORAGE", "").strip().lower()
+QUANTIZED_RESCORE_FACTOR = int(os.getenv("QUANTIZED_RESCORE_FACTOR", "4"))
+QUANTIZED_MIN_CANDIDATES = int(os.getenv("QUANTIZED_MIN_CANDIDATES", "40"))
+
+# columna, expresión a partir de `embedding`, operador de distancia, expresión de la consulta
+QUANTIZERS: Dict[str, Dict[str, str]] = {
+    "halfvec": {
+        "column": "embedding_half",
+        "expression": f"embedding::halfvec({MODEL_DIMENSIONS})",
+        "operator": "<=>",
+        "query": f"%(query_vector)s::vector::halfvec({MODEL_DIMENSIONS})",
+    },
+    "bit": {
+        "column": "embedding_bit",
+        "expression": f"binary_quantize(embedding)::bit({MODEL_DIMENSIONS})",
+        "operator": "<~>",
+        "query": f"binary_quantize(%(query_vector)s::vector)::bit({MODEL_DIMENSIONS})",
+    },
+}
+
+if QUANTIZED_STORAGE and QUANTIZED_STORAGE not in QUANTIZERS:
+    raise RuntimeError(f"QUANTIZED_STORAGE desconocido: {QUANTIZED_STORAGE} (usar 'halfvec' o 'bit')")
+
+# Primera pasada sobre la columna cuantizada y rescoring exacto de los candidatos
+_QUANTIZED_SEARCH_SQL = """
+    SELECT id, content, embedding <=> %(query_vector)s::vector AS distance
+    FROM (
+        SELECT id, content, embedding
+        FROM documents
+        {where}
+        ORDER BY {column} {operator} {query}
+        LIMIT %(candidates)s
+    ) candidates
+    ORDER BY distance
+    LIMIT %(limit)s;
+"""
+
+
+def quantizer(kind: Optional[str] = None) -> Optional[Dict[str, str]]:
+    """Configuración del tipo de cuantización pedido (o el de QUANTIZED_STORAGE)."""
+    return QUANTIZERS.get(kind if kind is not None else QUANTIZED_STORAGE)
+
+
+def insert_sql(values: str = "%s", content_hash: bool = False, on_conflict: Optional[str] = None,
+               returning: Optional[str] = None, chunk_columns: bool = False) -> str:
+    """
+    INSERT multi-fila de documents con `values` como lista de VALUES (default: el %s de
+    execute_values). Con cuantización activa la columna cuantizada se calcula en la base a
+    partir del mismo vector, sin reenviarlo.
+
+    Con content_hash=True cada fila de VALUES trae además el hash del contenido y
+    `on_conflict` ("skip" o "update") decide qué hacer si ya existe (document_store.aupsert_documents).
+    Con chunk_columns=True cada fila trae además parent_id y chunk_index (chunks de un documento
+    largo, sql/008_document_chunks.sql).
+    """
+    columns = ["content", "embedding", "metadata"] + (["content_hash"] if content_hash else [])
+    columns += ["parent_id", "chunk_index"] if chunk_columns else []
+    q = quantizer()
+    if q is None:
+        sql = f"INSERT INTO documents ({', '.join(columns)}) VALUES {values}"
+    else:
+        sql = (
+            f"INSERT INTO documents ({', '.join(columns)}, {q['column']}) "
+            f"SELECT {', '.join(columns)}, {q['expression']} "
+            f"FROM (VALUES {values}) AS v({', '.join(columns)})"
+        )
+    if on_conflict == "skip":
+        sql += " ON CONFLICT (content_hash) DO NOTHING"
+    elif on_conflict == "update":
+        updates = ["embedding = EXCLUDED.embedding", "metadata = EXCLUDED.metadata"]
+        if q is not None:
+            updates.append(f"{q['column']} = EXCLUDED.{q['column']}")
+        sql += f" ON CONFLICT (content_hash) DO UPDATE SET {', '.join(updates)}"
+    returning = returning or ("id, content_hash" if content_hash else "id")
+    return f"{sql} RETURNING {returning};"
+
+
+def update_embeddings_sql(values: str) -> str:
+    """
+    UPDATE de embeddings existentes a partir de VALUES (id, vector) (re-embed, document_bulk.py);
+    el primer parámetro es el JSON que se mezcla en metadata. Con cuantización activa la columna
+    cuantizada se recalcula a partir del vector nuevo.
+    """
+    updates = ["embedding = v.embedding", "metadata = COALESCE(documents.metadata, '{}'::jsonb) || %s::jsonb"]
+    q = quantizer()
+    if q is not None:
+        updates.append(f"{q['column']} = {q['expression'].replace('embedding', 'v.embedding')}")
+    return (
+        f"UPDATE documents SET {', '.join(updates)} "
+        f"FROM (VALUES {values}) AS v(id, embedding) "
+        f"WHERE documents.id = v.id RETURNING documents.id;"
+    )
+
+
+def quantized_search_sql(where: str, kind: Optional[str] = None) -> str:
+    """Sentencia de búsqueda en dos pasadas (usa %(query_vector)s, %(candidates)s y %(limit)s)."""
+    q = quantizer(kind)
+    return _QUANTIZED_SEARCH_SQL.format(where=where, column=q["column"], operator=q["operator"], query=q["query"])
+
+
+def rescore_candidates(limit: int, factor: Optional[int] = None) -> int:
+    """Candidatos de la primera pasada para un limit dado."""
+    factor = QUANTIZED_RESCORE_FACTOR if factor is None else factor
+    return max(limit * factor, QUANTIZED_MIN_CANDIDATES, limit)
+
+
+def backfill_sql(kind: Optional[str] = None) -> str:
+    """UPDATE por lotes de las filas sin columna cuantizada (params: batch_size)."""
+    q = quantizer(kind)
+    return f"""
+        UPDATE documents SET {q['column']} = {q['expression']}
+        WHERE id IN (
+            SELECT id FROM documents
+            WHERE {q['column']} IS NULL AND embedding IS NOT NULL
+            ORDER BY id
+            LIMIT %s
+        )
+        RETURNING id;
+    """
+
+
+def status_sql(kind: Optional[str] = None) -> str:
+    q = quantizer(kind)
+    return f"SELECT COUNT(*) AS total, COUNT({q['column']}) AS quantized FROM documents;"
@@ -0,0 +1,381 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import List, Dict, Any, Optional
+from fastapi import HTTPException
+from embedding_backends import EmbeddingBackend
+
+"""
+Capa de resiliencia frente al backend de embeddings (hf_client.py).
+
+- Clasificación de errores: classify_error() mira el status HTTP de la respuesta (y el
+  `estimated_time` que devuelve HF mientras el modelo carga) o el tipo de excepción de
+  timeout, en lugar de buscar "503" o "timeout" en el mensaje. Solo si no hay ninguno de
+  los dos cae al texto del error.
+- Reintentos: retry_delay() da un backoff exponencial con jitter completo; si HF informó
+  que el modelo está cargando se espera ese tiempo (acotado por HF_MODEL_LOADING_MAX_WAIT_SECONDS).
+  Los reintentos de un chunk no superan HF_RETRY_MAX_ELAPSED_SECONDS en total.
+- Circuit breaker: tras HF_BREAKER_FAILURES fallas seguidas el circuito se abre y durante
+  HF_BREAKER_RESET_SECONDS las llamadas fallan al instante (503) o, si hay un backend
+  secundario (HF_FALLBACK_BACKEND), van a ese backend. Pasado ese tiempo se deja pasar
+  una llamada de prueba (half-open) que lo vuelve a cerrar si sale bien.
+- Hedging (solo en aembed): con HF_HEDGE_ENABLED=1, si una llamada tarda más que el p95
+  de las últimas HF_HEDGE_WINDOW se lanza una segunda llamada idéntica y se usa la que
+  termine primero.
+
+Todo se puede probar contra el servidor falso de benchmarks/fake_hf_server.py (HF_BASE_URL).
+"""
+
+app_logger = logging.getLogger(__name__)
+
+HF_RETRY_BACKOFF_SECONDS = float(os.getenv("HF_RETRY_BACKOFF_SECONDS", "1"))
+HF_RETRY_MAX_BACKOFF_SECONDS = float(os.getenv("HF_RETRY_MAX_BACKOFF_SECONDS", "20"))
+HF_RETRY_MAX_ELAPSED_SECONDS = float(os.getenv("HF_RETRY_MAX_ELAPSED_SECONDS", "60"))
+HF_MODEL_LOADING_MAX_WAIT_SECONDS = float(os.getenv("HF_MODEL_LOADING_MAX_WAIT_SECONDS", "30"))
+
+HF_BREAKER_FAILURES = int(os.getenv("HF_BREAKER_FAILURES", "5"))
+HF_BREAKER_RESET_SECONDS = float(os.getenv("HF_BREAKER_RESET_SECONDS", "30"))
+
+HF_HEDGE_ENABLED = os.getenv("HF_HEDGE_ENABLED", "0") == "1"
+HF_HEDGE_WINDOW = int(os.getenv("HF_HEDGE_WINDOW", "200"))
+# Muestras mínimas antes de confiar en el p95 y piso del umbral de hedging
+HF_HEDGE_MIN_SAMPLES = int(os.getenv("HF_HEDGE_MIN_SAMPLES", "20"))
+HF_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("HF_HEDGE_MIN_DELAY_SECONDS", "0.05"))
+
+_RETRYABLE_STATUS = (429, 502, 503, 504)
+
+
+# ============================================>
+# Clasificación de errores
+# ============================================>
+class UpstreamError(HTTPException):
+    """
+    Error del backend de embeddings ya traducido a HTTP.
+    retryable indica si vale la pena reintentar; retry_after es la espera sugerida (segundos).
+    """
+
+    def __init__(self, status_code: int, detail: str, retryable: bool = False, retry_after: Optional[float] = None):
+        headers = {"Retry-After": str(max(int(retry_after + 0.999), 1))} if retry_after else None
+        super().__init__(status_code=status_code, detail=detail, headers=headers)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamError):
+    def __init__(self, retry_after: float):
+        super().__init__(503, "Embedding backend unavailable (circuit open). Please try again later.",
+                         retryable=False, retry_after=retry_after)
+
+
+def _status_code(e: Exception) -> Optional[int]:
+    for attr in ("status_code", "status"):
+        value = getattr(e, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(e, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _estimated_time(e: Exception) -> Optional[float]:
+    """`estimated_time` del cuerpo JSON de un 503 de HF (modelo cargando), si vino."""
+    response = getattr(e, "response", None)
+    try:
+        value = response.json().get("estimated_time") if response is not None else None
+        return float(value) if value is not None else None
+    except Exception:
+        return None
+
+
+def _is_timeout(e: Exception) -> bool:
+    return isinstance(e, (TimeoutError, asyncio.TimeoutError)) or "Timeout" in type(e).__name__
+
+
+def _is_connection_error(e: Exception) -> bool:
+    return isinstance(e, ConnectionError) or "ConnectError" in type(e).__name__ or "ConnectionError" in type(e).__name__
+
+
+def classify_error(e: Exception) -> HTTPException:
+    """
+    Traduce un error del backend a HTTPException (503 modelo cargando o no disponible,
+    504 timeout, 429 rate limit, 500 otros).
+    """
+    if isinstance(e, HTTPException):
+        return e
+
+    error_msg = str(e)
+    lowered = error_msg.lower()
+    status = _status_code(e)
+    # Sin respuesta HTTP asociada, el texto del error es el último recurso
+    if _is_timeout(e) or (status is None and ("timeout" in lowered or "timed out" in lowered)):
+        return UpstreamError(504, "Timeout connecting to Hugging Face API", retryable=True)
+    if status is None and _is_connection_error(e):
+        return UpstreamError(503, "Could not connect to the embeddings API", retryable=True)
+    if status is None and ("503" in error_msg or "loading" in lowered):
+        status = 503
+    if status == 503:
+        return UpstreamError(503, "Model is loading. Please try again in a few moments.",
+                             retryable=True, retry_after=_estimated_time(e))
+    if status in _RETRYABLE_STATUS:
+        return UpstreamError(status, f"Hugging Face API unavailable ({status})", retryable=True)
+    return UpstreamError(500, f"Error generating embeddings: {error_msg}")
+
+
+def retry_delay(error: HTTPException, attempt: int, elapsed: float, max_retries: int) -> Optional[float]:
+    """
+    Espera antes del reintento `attempt` (0 = primer reintento), o None si no se reintenta.
+    """
+    if not getattr(error, "retryable", False) or attempt >= max_retries:
+        return None
+    ceiling = min(HF_RETRY_MAX_BACKOFF_SECONDS, HF_RETRY_BACKOFF_SECONDS * (2 ** attempt))
+    delay = random.uniform(0, ceiling)
+    if getattr(error, "retry_after", None):
+        # El modelo está cargando: no tiene sentido volver antes de lo que informa HF
+        delay = max(delay, min(error.retry_after, HF_MODEL_LOADING_MAX_WAIT_SECONDS))
+    if elapsed + delay > HF_RETRY_MAX_ELAPSED_SECONDS:
+        return None
+    return delay
+
+
+# ============================================>
+# Circuit breaker
+# ============================================>
+class CircuitBreaker:
+    """
+    closed -> (failure_threshold fallas seguidas) -> open -> (reset_seconds) -> half_open
+    -> una llamada de prueba: si sale bien closed, si falla open otra vez.
+
+    acquire() retorna un token (None si rechaza) que la llamada pasa a record_failure y
+    release: solo la dueña de la prueba half-open puede liberar su lugar.
+    """
+
+    # Token de una llamada admitida con el circuito cerrado (no es la prueba half-open)
+    NO_PROBE = 0
+
+    def __init__(self, failure_threshold: int = HF_BREAKER_FAILURES, reset_seconds: float = HF_BREAKER_RESET_SECONDS):
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe = None  # token de la prueba half-open en curso
+        self._probe_seq = 0
+        self._stats = {"opened": 0, "rejected": 0}
+
+    def acquire(self) -> Optional[int]:
+        """Token si la llamada puede ir al backend primario, None si el circuito la rechaza."""
+        with self._lock:
+            if self._state == "closed":
+                return self.NO_PROBE
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._state = "half_open"
+            if self._state == "half_open" and self._probe is None:
+                self._probe_seq += 1
+                self._probe = self._probe_seq
+                return self._probe
+            self._stats["rejected"] += 1
+            return None
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(self.reset_seconds - (time.monotonic() - self._opened_at), 0.0)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != "closed":
+                app_logger.info("Circuit breaker cerrado: el backend primario respondió")
+            self._state = "closed"
+            self._failures = 0
+            self._probe = None
+
+    def release(self, token: Optional[int] = NO_PROBE) -> None:
+        """
+        Termina una llamada sin contarla como éxito ni como falla. Libera el lugar de la
+        prueba half-open solo si `token` es el de esa prueba (no-op para las demás llamadas).
+        """
+        with self._lock:
+            self._release_probe(token)
+
+    def record_failure(self, token: Optional[int] = NO_PROBE) -> None:
+        with self._lock:
+            self._failures += 1
+            self._release_probe(token)
+            if self._state == "half_open" or (self._state == "closed" and self._failures >= self.failure_threshold):
+                if self._state == "closed":
+                    self._stats["opened"] += 1
+                    app_logger.warning(f"Circuit breaker abierto tras {self._failures} fallas seguidas")
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+    def _release_probe(self, token: Optional[int]) -> None:
+        """Llamar con el lock tomado."""
+        if token and token == self._probe:
+            self._probe = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self._state, "consecutive_failures": self._failures, **self._stats}
+
+
+# ============================================>
+# Latencias recientes (umbral de hedging)
+# ============================================>
+class LatencyTracker:
+    def __init__(self, window: int = HF_HEDGE_WINDOW):
+        self._samples = deque(maxlen=max(window, 1))
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < HF_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+# ============================================>
+# Backend con breaker, fallback y hedging
+# ============================================>
+class ResilientBackend(EmbeddingBackend):
+    """
+    Envuelve al backend primario con el circuit breaker, el backend secundario opcional
+    y el hedging. Expone la misma interfaz (embed / aembed) que cualquier backend.
+    """
+
+    def __init__(self, primary: EmbeddingBackend, secondary: Optional[EmbeddingBackend] = None,
+                 breaker: Optional[CircuitBreaker] = None, hedge: bool = HF_HEDGE_ENABLED):
+        self.primary = primary
+        self.secondary = secondary
+        self.name = primary.name
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge
+        self.latencies = LatencyTracker()
+        self._stats = {"fallback_calls": 0, "hedged_calls": 0, "hedge_wins": 0}
+
+    def _fallback(self, error: Optional[Exception] = None) -> EmbeddingBackend:
+        """Backend secundario para esta llamada, o la excepción si no hay."""
+        if self.secondary is None:
+            if error is not None:
+                raise error
+            raise CircuitOpenError(self.breaker.retry_after())
+        self._stats["fallback_calls"] += 1
+        return self.secondary
+
+    def _record_error(self, error: Exception, token: int) -> bool:
+        """
+        Registra la falla en el breaker. Solo cuentan los errores de disponibilidad
+        (retryable) que no sean el modelo cargando; un 4xx por un input inválido no abre el
+        circuito. Retorna True si conviene pasar la llamada al backend secundario.
+        """
+        classified = classify_error(error)
+        if not getattr(classified, "retryable", False):
+            # No es una caída del backend, pero tampoco un éxito: no cierra un circuito half-open
+            self.breaker.release(token)
+            return False
+        if getattr(classified, "retry_after", None):
+            # Modelo cargando: el backend responde, no es una caída; se espera con los reintentos
+            self.breaker.release(token)
+        else:
+            self.breaker.record_failure(token)
+        return self.secondary is not None
+
+    def embed(self, texts: List[str]):
+        token = self.breaker.acquire()
+        if token is None:
+            return self._fallback().embed(texts)
+        start = time.monotonic()
+        try:
+            result = self.primary.embed(texts)
+        except Exception as e:
+            if not self._record_error(e, token):
+                raise
+            app_logger.warning(f"Backend primario falló ({type(e).__name__}), usando {self.secondary.name}")
+            return self._fallback(e).embed(texts)
+        else:
+            self.breaker.record_success()
+        finally:
+            # Una llamada de prueba interrumpida (KeyboardInterrupt, cancelación) no deja el
+            # circuito half-open rechazando todo; no-op si ya se registró éxito o falla o si
+            # esta llamada no era la prueba
+            self.breaker.release(token)
+        self.latencies.record(time.monotonic() - start)
+        return result
+
+    async def aembed(self, texts: List[str]):
+        token = self.breaker.acquire()
+        if token is None:
+            return await self._fallback().aembed(texts)
+        start = time.monotonic()
+        try:
+            result = await self._ahedged(texts)
+        except Exception as e:
+            if not self._record_error(e, token):
+                raise
+            app_logger.warning(f"Backend primario falló ({type(e).__name__}), usando {self.secondary.name}")
+            return await self._fallback(e).aembed(texts)
+        else:
+            self.breaker.record_success()
+        finally:
+            # CancelledError es BaseException: sin esto la prueba half-open quedaría tomada
+            self.breaker.release(token)
+        self.latencies.record(time.monotonic() - start)
+        return result
+
+    async def _ahedged(self, texts: List[str]):
+        """
+        Llamada al primario; si supera el p95 reciente se lanza una copia y gana la primera.
+        """
+        threshold = self.latencies.percentile(0.95) if self.hedge else None
+        if threshold is None:
+            return await self.primary.aembed(texts)
+
+        first = asyncio.ensure_future(self.primary.aembed(texts))
+        pending = {first}
+        error = None
+        try:
+            done, _ = await asyncio.wait({first}, timeout=max(threshold, HF_HEDGE_MIN_DELAY_SECONDS))
+            if done:
+                return first.result()
+
+            self._stats["hedged_calls"] += 1
+            second = asyncio.ensure_future(self.primary.aembed(texts))
+            pending = {first, second}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # También si se cancela la llamada externa mientras se espera
+            for task in pending:
+                task.cancel()
+
+    async def close(self) -> None:
+        for backend in (self.primary, self.secondary):
+            close = getattr(backend, "close", None)
+            if close is not None:
+                await close()
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.latencies.percentile(0.95)
+        return {
+            "primary": self.primary.name,
+            "secondary": self.secondary.name if self.secondary is not None else None,
+            "breaker": self.breaker.stats(),
+            "hedging": self.hedge,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            **self._stats,
+        }
@@ -0,0 +1,114 @@
+import base64
+import struct
+from typing import List, Dict, Any, Optional, Sequence
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import Response
+from vectors import as_matrix
+from metrics import timed
+
+"""
+Formatos compactos para devolver vectores (content negotiation).
+
+Los endpoints que devuelven embeddings o resultados de búsqueda aceptan `format`:
+- "json" (default): listas de floats, como siempre.
+- "base64": JSON con la matriz empaquetada (float32/float16 little-endian) en base64.
+- "binary": application/octet-stream con un header de 16 bytes seguido de los arrays.
+Si no se pasa `format`, un header `Accept: application/octet-stream` equivale a "binary".
+
+Header binario (little-endian, 16 bytes):
+    magic    4s  b"EMB1" (embeddings) o b"SIM1" (resultados de búsqueda)
+    dtype    B   1 = float32, 2 = float16
+    flags    B   bit 0: hay ids int64 antes de la matriz
+    reserved H
+    rows     I
+    cols     I
+
+EMB1: [ids int64 * rows si flags & 1] + matriz rows x cols (dtype).
+SIM1: ids int64 rows x cols (-1 = sin resultado) + similitudes rows x cols (dtype, NaN = sin
+resultado). rows = consultas, cols = limit.
+
+Los arrays se escriben directamente desde el buffer de NumPy (memoryview), sin pasar
+por floats de Python.
+"""
+
+OCTET_STREAM = "application/octet-stream"
+FORMATS = ("json", "base64", "binary")
+DTYPES = {"float32": (1, np.dtype("<f4")), "float16": (2, np.dtype("<f2"))}
+
+_HEADER = struct.Struct("<4sBBHII")
+_FLAG_IDS = 1
+
+
+def resolve_format(requested: Optional[str], accept: Optional[str]) -> str:
+    """
+    Decide el formato de respuesta a partir de `format` o, si no vino, del header Accept.
+    """
+    if requested:
+        if requested not in FORMATS:
+            raise HTTPException(status_code=400, detail=f"format debe ser uno de {', '.join(FORMATS)}")
+        return requested
+    if accept and OCTET_STREAM in accept:
+        return "binary"
+    return "json"
+
+
+def _dtype(name: str):
+    if name not in DTYPES:
+        raise HTTPException(status_code=400, detail=f"dtype debe ser uno de {', '.join(DTYPES)}")
+    return DTYPES[name]
+
+
+def pack_embeddings(embeddings, dtype: str = "float32", ids: Optional[Sequence[Optional[int]]] = None) -> bytes:
+    """
+    Empaqueta una matriz de embeddings (y opcionalmente sus ids) en formato EMB1.
+    """
+    code, np_dtype = _dtype(dtype)
+    with timed("encode"):
+        matrix = np.ascontiguousarray(as_matrix(embeddings), dtype=np_dtype)
+        parts = [_HEADER.pack(b"EMB1", code, _FLAG_IDS if ids is not None else 0, 0, matrix.shape[0], matrix.shape[1])]
+        if ids is not None:
+            parts.append(memoryview(_ids_array(ids)))
+        parts.append(memoryview(matrix))
+        return b"".join(parts)
+
+
+def pack_search_results(results_per_query: List[List[Dict[str, Any]]], limit: int, dtype: str = "float32") -> bytes:
+    """
+    Empaqueta ids y similitudes de una o varias consultas en formato SIM1.
+    """
+    code, np_dtype = _dtype(dtype)
+    with timed("encode"):
+        rows = len(results_per_query)
+        ids = np.full((rows, limit), -1, dtype="<i8")
+        similarities = np.full((rows, limit), np.nan, dtype=np_dtype)
+        for row, results in enumerate(results_per_query):
+            hits = results[:limit]
+            ids[row, :len(hits)] = [hit["id"] for hit in hits]
+            similarities[row, :len(hits)] = [hit["similarity"] for hit in hits]
+        header = _HEADER.pack(b"SIM1", code, _FLAG_IDS, 0, rows, limit)
+        return b"".join((header, memoryview(ids), memoryview(similarities)))
+
+
+def embeddings_base64(embeddings, dtype: str = "float32") -> Dict[str, Any]:
+    """
+    Matriz de embeddings como base64 (sin header) más su dtype y shape.
+    """
+    _, np_dtype = _dtype(dtype)
+    with timed("encode"):
+        matrix = np.ascontiguousarray(as_matrix(embeddings), dtype=np_dtype)
+        return {
+            "encoding": "base64",
+            "dtype": dtype,
+            "byteorder": "little",
+            "shape": list(matrix.shape),
+            "data": base64.b64encode(memoryview(matrix)).decode("ascii"),
+        }
+
+
+def binary_response(payload: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(content=payload, media_type=OCTET_STREAM, headers=headers)
+
+
+def _ids_array(ids: Sequence[Optional[int]]) -> np.ndarray:
+    return np.array([-1 if i is None else i for i in ids], dtype="<i8")
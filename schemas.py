@@ -22,6 +22,30 @@ class Contact(BaseModel):
 class TextRequest(BaseModel):
     texts: List[str] = Field(min_items=1, example=["Hola mundo", "FastAPI es genial"])
     
+class SearchFilters(BaseModel):
+    """Prefiltros de /search: se aplican antes del ranking vectorial."""
+    metadata: Optional[Dict[str, Any]] = Field(None, description="Pares que debe contener metadata (JSONB @>)")
+    created_from: Optional[datetime] = Field(None, description="created_at >= created_from")
+    created_to: Optional[datetime] = Field(None, description="created_at < created_to")
+    keyword: Optional[str] = Field(None, description="Consulta de texto completo sobre content")
+
+    def is_empty(self) -> bool:
+        return not (self.metadata or self.created_from or self.created_to or self.keyword)
+
+class DocumentSelection(BaseModel):
+    """Documentos de /documents/delete y /documents/reembed: los criterios presentes se combinan con AND."""
+    ids: Optional[List[int]] = Field(None, min_length=1, max_length=10000, description="Lista de ids")
+    start_id: Optional[int] = Field(None, ge=1, description="id >= start_id")
+    end_id: Optional[int] = Field(None, ge=1, description="id <= end_id")
+    metadata: Optional[Dict[str, Any]] = Field(None, description="Pares que debe contener metadata (JSONB @>)")
+
+    def is_empty(self) -> bool:
+        return self.ids is None and self.start_id is None and self.end_id is None and not self.metadata
+
+class BatchSearchRequest(BaseModel):
+    texts: List[str] = Field(min_length=1, max_length=1000, example=["departamento en alquiler", "casa con patio"])
+    limit: int = Field(5, ge=1, le=20, description="Resultados por consulta")
+
 class EmbeddingResponse(BaseModel):
     embeddings: List[List[float]] = Field(..., example=[[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]])
     model: str
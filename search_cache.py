@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+import numpy as np
+from embedding_cache import normalize_text
+
+"""
+Caché de resultados de /search, delante de asearch_similar_documents (search_service.py).
+
+Capa exacta: clave (texto de consulta normalizado, limit, mode, aggregate, filtros). Un hit
+evita tanto la llamada al backend de embeddings como la búsqueda.
+
+Capa por similitud (opcional, SEARCH_CACHE_MAX_DISTANCE > 0): si no hay hit exacto, una vez
+calculado el embedding de la consulta se compara contra los embeddings de las consultas
+cacheadas con los mismos parámetros; si alguno está a distancia coseno <= SEARCH_CACHE_MAX_DISTANCE
+se reutilizan sus resultados. Los vectores se guardan cuantizados a int8 (4x menos memoria
+que float32; el error en el coseno es del orden de 1e-3).
+
+Invalidación por generación: cada escritura en documents (inserts de document_store.py,
+borrados, re-embed, jobs) llama a invalidate(), que incrementa un contador. Cada entrada
+guarda la generación vigente al *empezar* la búsqueda, así una búsqueda que corre en paralelo
+con una escritura no deja resultados viejos después de la invalidación. El contador es por proceso: con varias
+instancias, las escrituras hechas por otra se ven al vencer SEARCH_CACHE_TTL_SECONDS. Por eso
+viene desactivada (SEARCH_CACHE_ENABLED=0): activarla acepta hasta ese retraso entre instancias.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "0") == "1"
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2048"))
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "30"))
+SEARCH_CACHE_MAX_DISTANCE = float(os.getenv("SEARCH_CACHE_MAX_DISTANCE", "0"))
+
+_INT8_SCALE = 127.0
+
+
+def quantize(vector) -> np.ndarray:
+    """Vector normalizado L2 y cuantizado a int8 (componentes en [-127, 127])."""
+    vector = np.asarray(vector, dtype=np.float32)
+    vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+    return np.round(vector * _INT8_SCALE).astype(np.int8)
+
+
+def search_scope(limit: int, mode: str, aggregate: str, filters: Optional[Dict[str, Any]] = None) -> str:
+    """Parámetros de la búsqueda que deben coincidir para reutilizar un resultado."""
+    return json.dumps([limit, mode, aggregate, filters or {}], sort_keys=True, default=str)
+
+
+class SearchResultCache:
+    """
+    LRU thread-safe de resultados de búsqueda. Cada entrada guarda los resultados, la
+    generación, el vencimiento, el embedding cuantizado de la consulta y lo que costó
+    calcularla (embedding y búsqueda), que es lo que se ahorra en cada hit.
+    """
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_MAX_ENTRIES, ttl_seconds: float = SEARCH_CACHE_TTL_SECONDS,
+                 max_distance: float = SEARCH_CACHE_MAX_DISTANCE):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.generation = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # scope -> (claves, matriz int8) para la capa por similitud, se rearma al cambiar
+        self._matrices: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return SEARCH_CACHE_ENABLED and self.max_entries > 0
+
+    def invalidate(self) -> None:
+        """Descarta todas las entradas (una escritura cambió documents)."""
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            self.stale += len(self._entries)
+            self._entries.clear()
+            self._matrices.clear()
+
+    def get(self, scope: str, text: str) -> Optional[List[Dict[str, Any]]]:
+        """Capa exacta; no cuenta el miss (puede seguir la capa por similitud)."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._live(scope + "\n" + normalize_text(text))
+            if entry is None:
+                return None
+            self.exact_hits += 1
+            self.saved_seconds += entry["embed_seconds"] + entry["search_seconds"]
+            return entry["results"]
+
+    def get_similar(self, scope: str, embedding) -> Optional[List[Dict[str, Any]]]:
+        """Capa por similitud; cuenta el miss si tampoco hay una consulta cercana."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self.max_distance > 0:
+                entry = self._nearest(scope, quantize(embedding))
+                if entry is not None:
+                    self.similar_hits += 1
+                    self.saved_seconds += entry["search_seconds"]
+                    return entry["results"]
+            self.misses += 1
+            return None
+
+    def put(self, scope: str, text: str, embedding, results: List[Dict[str, Any]], generation: int,
+            embed_seconds: float = 0.0, search_seconds: float = 0.0) -> None:
+        """Guarda resultados calculados con la generación `generation` (leída antes de buscar)."""
+        if not self.enabled:
+            return
+        key = scope + "\n" + normalize_text(text)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = {
+                "scope": scope,
+                "results": results,
+                "generation": generation,
+                "expires_at": time.monotonic() + self.ttl_seconds,
+                "vector": quantize(embedding),
+                "embed_seconds": embed_seconds,
+                "search_seconds": search_seconds,
+            }
+            self._matrices.pop(scope, None)
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._matrices.pop(evicted["scope"], None)
+
+    def _live(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["expires_at"] < time.monotonic():
+            self.expired += 1
+            del self._entries[key]
+            self._matrices.pop(entry["scope"], None)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _nearest(self, scope: str, query: np.ndarray) -> Optional[Dict[str, Any]]:
+        if scope not in self._matrices:
+            keys = [key for key, entry in self._entries.items() if entry["scope"] == scope]
+            if not keys:
+                return None
+            self._matrices[scope] = (keys, np.stack([self._entries[key]["vector"] for key in keys]))
+        keys, matrix = self._matrices[scope]
+        # int32 para que el producto de int8 no desborde
+        similarity = (matrix.astype(np.int32) @ query.astype(np.int32)) / (_INT8_SCALE * _INT8_SCALE)
+        best = int(np.argmax(similarity))
+        if 1.0 - float(similarity[best]) > self.max_distance:
+            return None
+        # Si la más cercana venció se descarta (y la matriz se rearma en la próxima consulta)
+        return self._live(keys[best])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrices.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.exact_hits + self.similar_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "max_distance": self.max_distance,
+                "generation": self.generation,
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.exact_hits + self.similar_hits) / lookups, 4) if lookups else 0.0,
+                "invalidated_entries": self.stale,
+                "expired": self.expired,
+                "invalidations": self.invalidations,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+
+search_cache = SearchResultCache()
@@ -1,55 +1,432 @@
+import os
+import json
 import logging
-from typing import List, Dict, Any
-from database import get_connection
+from typing import List, Dict, Any, Optional
+from database import connection
+from database_async import async_connection
+from ann_index import ann_index, ANN_INDEX_ENABLED
+from vectors import to_pgvector_literal, to_pgvector_literals
+from schemas import SearchFilters
+from quantization import quantizer, quantized_search_sql, rescore_candidates
+from model_migration import migration_state, search_column, SOURCE_COLUMN
+from metrics import timed
+from chunking import CHUNKING_ENABLED
 
 app_logger = logging.getLogger(__name__)
 
-def search_similar_documents(query_embedding: List[float], limit: int = 5) -> List[Dict[str, Any]]:
+# Constante k de Reciprocal Rank Fusion y candidatos que aporta cada ranking en modo híbrido
+SEARCH_RRF_K = int(os.getenv("SEARCH_RRF_K", "60"))
+SEARCH_HYBRID_CANDIDATES = int(os.getenv("SEARCH_HYBRID_CANDIDATES", "50"))
+# Con chunking se buscan limit * factor chunks y se agrupan por documento padre (max o sum)
+CHUNK_SEARCH_CANDIDATE_FACTOR = int(os.getenv("CHUNK_SEARCH_CANDIDATE_FACTOR", "4"))
+CHUNK_SEARCH_AGGREGATE = os.getenv("CHUNK_SEARCH_AGGREGATE", "max")
+CHUNK_AGGREGATES = ("max", "sum")
+
+# Debe coincidir con la expresión del índice GIN de sql/002_search_filters.sql
+_TSVECTOR = "to_tsvector('simple', content)"
+_TSQUERY = "plainto_tsquery('simple', %(keyword)s)"
+
+# El vector de consulta se envía una sola vez: ORDER BY usa el alias de la distancia.
+# {where} recibe los prefiltros (metadata, fechas, texto) para no rankear toda la tabla y
+# {column} es `embedding` salvo después del cutover de una migración de modelo (model_migration.py).
+_SEARCH_SQL = """
+    SELECT
+        id,
+        content,
+        {column} <=> %(query_vector)s::vector AS distance
+    FROM documents
+    {where}
+    ORDER BY distance
+    LIMIT %(limit)s;
+"""
+
+# Modo híbrido: top-N vectorial y top-N de texto completo fusionados con RRF
+_HYBRID_SEARCH_SQL = """
+    WITH vector_ranked AS (
+        SELECT id, row_number() OVER (ORDER BY distance) AS rank
+        FROM (
+            SELECT id, {column} <=> %(query_vector)s::vector AS distance
+            FROM documents
+            {where}
+            ORDER BY distance
+            LIMIT %(candidates)s
+        ) nearest
+    ),
+    text_ranked AS (
+        SELECT id, row_number() OVER (ORDER BY text_rank DESC) AS rank
+        FROM (
+            SELECT id, ts_rank({tsvector}, {tsquery}) AS text_rank
+            FROM documents
+            {where_text}
+            ORDER BY text_rank DESC
+            LIMIT %(candidates)s
+        ) matched
+    ),
+    fused AS (
+        SELECT COALESCE(v.id, t.id) AS id,
+               COALESCE(1.0 / (%(rrf_k)s + v.rank), 0) + COALESCE(1.0 / (%(rrf_k)s + t.rank), 0) AS score
+        FROM vector_ranked v
+        FULL OUTER JOIN text_ranked t ON v.id = t.id
+    )
+    SELECT d.id, d.content, d.{column} <=> %(query_vector)s::vector AS distance, f.score
+    FROM fused f
+    JOIN documents d ON d.id = f.id
+    ORDER BY f.score DESC
+    LIMIT %(limit)s;
+"""
+
+_CONTENT_BY_ID_SQL = "SELECT id, content FROM documents WHERE id = ANY(%s);"
+
+# Documento padre de cada resultado (el mismo id si no es un chunk) con su contenido completo
+_PARENTS_SQL = """
+    SELECT c.id, p.id AS parent_id, p.content
+    FROM documents c
+    JOIN documents p ON p.id = COALESCE(c.parent_id, c.id)
+    WHERE c.id = ANY(%s);
+"""
+
+# Búsqueda de varias consultas en una sola sentencia: un LATERAL top-k por consulta
+_BATCH_SEARCH_SQL = """
+    SELECT q.ord, d.id, d.content, d.distance
+    FROM unnest(%s::text[]) WITH ORDINALITY AS q(query_vector, ord)
+    CROSS JOIN LATERAL (
+        SELECT id, content, {column} <=> q.query_vector::vector AS distance
+        FROM documents
+        {where}
+        ORDER BY distance
+        LIMIT %s
+    ) d
+    ORDER BY q.ord, d.distance;
+"""
+
+
+def search_similar_documents(query_embedding: List[float], limit: int = 5,
+                             filters: Optional[SearchFilters] = None, mode: str = "vector",
+                             aggregate: str = CHUNK_SEARCH_AGGREGATE) -> List[Dict[str, Any]]:
     """ ==========================================================================================
     Busca documentos similares en la tabla 'documents' usando similitud coseno (pgvector).
     Args:
         query_embedding: Vector de embedding para la consulta (lista de floats).
         limit: Número máximo de resultados a retornar (default 5).
+        filters: Prefiltros opcionales (metadata, rango de created_at, keyword).
+        mode: "vector" (default) o "hybrid" (RRF entre ranking vectorial y de texto; requiere keyword).
+        aggregate: Con CHUNKING_ENABLED, cómo se rankea un documento a partir de sus chunks:
+            "max" (el mejor chunk) o "sum" (suma de los chunks encontrados).
     Returns:
-        Lista de diccionarios con 'id', 'content', 'similarity' (similitud coseno).
-        Usa el operador <=> de pgvector directamente sobre la columna 'embedding'.
+        Lista de diccionarios con 'id', 'content', 'similarity' (similitud coseno) y, en modo
+        híbrido, 'score' (RRF). Con chunking, uno por documento padre con 'chunk_hits'.
+        Sin filtros, si el índice ANN en memoria está listo (ann_index.py) se usa ese índice y
+        solo se leen de la base los contenidos; si no, se usa el operador <=> de pgvector
+        directamente sobre la columna 'embedding'.
     =========================================================================================== """
     try:
         app_logger.info(f"Buscando documentos similares. Dimensiones del embedding: {len(query_embedding)}, limit: {limit}")
 
-        # Convertir el vector a formato string de pgvector: '[0.1, 0.2, ...]'
-        embedding_str = "[" + ",".join(str(x) for x in query_embedding) + "]"
+        column = search_column(migration_state.current())
+        unfiltered = mode == "vector" and (filters is None or filters.is_empty()) and column == SOURCE_COLUMN
+        fetch_limit = _fetch_limit(limit)
+        if unfiltered and ann_index.ready():
+            hits = ann_index.search(query_embedding, fetch_limit)
+            with connection() as conn:
+                with conn.cursor() as cur:
+                    with timed("db_query"):
+                        cur.execute(_content_sql(), ([doc_id for doc_id, _ in hits],))
+                        rows = cur.fetchall()
+            return _group_by_parent(_hits_to_results(hits, rows), rows, limit, aggregate)
+        if unfiltered and ANN_INDEX_ENABLED:
+            ann_index.record_fallback()
 
-        sql = """
-            SELECT
-                id,
-                content,
-                1 - (embedding <=> %s::vector) AS similarity
-            FROM documents
-            ORDER BY embedding <=> %s::vector
-            LIMIT %s;
-        """
-
-        conn = get_connection()
-        try:
+        sql, params = _build_search_query(query_embedding, fetch_limit, filters, mode, column)
+        with connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(sql, (embedding_str, embedding_str, limit))
-                rows = cur.fetchall()
-        finally:
-            conn.close()
-
-        results = [
-            {
-                'id': row['id'],
-                'content': row['content'],
-                'similarity': float(row['similarity'])
-            }
-            for row in rows
-        ]
+                with timed("db_query"):
+                    cur.execute(sql, params)
+                    rows = cur.fetchall()
+                    parents = _fetch_parents(cur, rows)
+
+        results = _group_by_parent(_to_results(rows), parents, limit, aggregate)
+        app_logger.info(f"Documentos similares encontrados: {len(results)}")
+        return results
+
+    except Exception as e:
+        app_logger.error(f"Error buscando documentos similares: {str(e)}")
+        raise
+
 
+async def asearch_similar_documents(query_embedding: List[float], limit: int = 5,
+                                    filters: Optional[SearchFilters] = None, mode: str = "vector",
+                                    aggregate: str = CHUNK_SEARCH_AGGREGATE) -> List[Dict[str, Any]]:
+    """ ==========================================================================================
+    Variante async de search_similar_documents (pool async de Postgres).
+    =========================================================================================== """
+    try:
+        app_logger.info(f"Buscando documentos similares. Dimensiones del embedding: {len(query_embedding)}, limit: {limit}")
+
+        column = search_column(await migration_state.acurrent())
+        unfiltered = mode == "vector" and (filters is None or filters.is_empty()) and column == SOURCE_COLUMN
+        fetch_limit = _fetch_limit(limit)
+        if unfiltered and ann_index.ready():
+            hits = await ann_index.asearch(query_embedding, fetch_limit)
+            async with async_connection() as conn:
+                async with conn.cursor() as cur:
+                    with timed("db_query"):
+                        await cur.execute(_content_sql(), ([doc_id for doc_id, _ in hits],))
+                        rows = await cur.fetchall()
+            return _group_by_parent(_hits_to_results(hits, rows), rows, limit, aggregate)
+        if unfiltered and ANN_INDEX_ENABLED:
+            ann_index.record_fallback()
+
+        sql, params = _build_search_query(query_embedding, fetch_limit, filters, mode, column)
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                with timed("db_query"):
+                    await cur.execute(sql, params)
+                    rows = await cur.fetchall()
+                    parents = await _afetch_parents(cur, rows)
+
+        results = _group_by_parent(_to_results(rows), parents, limit, aggregate)
         app_logger.info(f"Documentos similares encontrados: {len(results)}")
         return results
 
     except Exception as e:
         app_logger.error(f"Error buscando documentos similares: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+
+def search_similar_documents_batch(query_embeddings: List[List[float]], limit: int = 5,
+                                   aggregate: str = CHUNK_SEARCH_AGGREGATE) -> List[List[Dict[str, Any]]]:
+    """ ==========================================================================================
+    Busca documentos similares para varias consultas a la vez.
+    Args:
+        query_embeddings: Embeddings de las consultas.
+        limit: Resultados por consulta.
+    Returns:
+        Una lista de resultados por consulta, cada una con la forma de search_similar_documents.
+        Con el índice ANN listo se resuelve en memoria; si no, con una sola sentencia SQL
+        (unnest + LATERAL) en lugar de una consulta por texto.
+    =========================================================================================== """
+    try:
+        column = search_column(migration_state.current())
+        fetch_limit = _fetch_limit(limit)
+        if column == SOURCE_COLUMN and ann_index.ready():
+            hits = ann_index.search_many(query_embeddings, fetch_limit)
+            with connection() as conn:
+                with conn.cursor() as cur:
+                    with timed("db_query"):
+                        cur.execute(_content_sql(), (_hit_ids(hits),))
+                        rows = cur.fetchall()
+            return [_group_by_parent(_hits_to_results(query_hits, rows), rows, limit, aggregate) for query_hits in hits]
+        if column == SOURCE_COLUMN and ANN_INDEX_ENABLED:
+            ann_index.record_fallback()
+
+        with connection() as conn:
+            with conn.cursor() as cur:
+                with timed("db_query"):
+                    cur.execute(_batch_sql(column), (to_pgvector_literals(query_embeddings), fetch_limit))
+                    rows = cur.fetchall()
+                    parents = _fetch_parents(cur, rows)
+        return [_group_by_parent(results, parents, limit, aggregate)
+                for results in _group_batch_rows(rows, len(query_embeddings))]
+
+    except Exception as e:
+        app_logger.error(f"Error en la búsqueda por lotes: {str(e)}")
+        raise
+
+
+async def asearch_similar_documents_batch(query_embeddings: List[List[float]], limit: int = 5,
+                                          aggregate: str = CHUNK_SEARCH_AGGREGATE) -> List[List[Dict[str, Any]]]:
+    """ ==========================================================================================
+    Variante async de search_similar_documents_batch (pool async de Postgres).
+    =========================================================================================== """
+    try:
+        column = search_column(await migration_state.acurrent())
+        fetch_limit = _fetch_limit(limit)
+        if column == SOURCE_COLUMN and ann_index.ready():
+            hits = await ann_index.asearch_many(query_embeddings, fetch_limit)
+            async with async_connection() as conn:
+                async with conn.cursor() as cur:
+                    with timed("db_query"):
+                        await cur.execute(_content_sql(), (_hit_ids(hits),))
+                        rows = await cur.fetchall()
+            return [_group_by_parent(_hits_to_results(query_hits, rows), rows, limit, aggregate) for query_hits in hits]
+        if column == SOURCE_COLUMN and ANN_INDEX_ENABLED:
+            ann_index.record_fallback()
+
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                with timed("db_query"):
+                    await cur.execute(_batch_sql(column), (to_pgvector_literals(query_embeddings), fetch_limit))
+                    rows = await cur.fetchall()
+                    parents = await _afetch_parents(cur, rows)
+        return [_group_by_parent(results, parents, limit, aggregate)
+                for results in _group_batch_rows(rows, len(query_embeddings))]
+
+    except Exception as e:
+        app_logger.error(f"Error en la búsqueda por lotes: {str(e)}")
+        raise
+
+
+def _hit_ids(hits) -> List[int]:
+    return list({doc_id for query_hits in hits for doc_id, _ in query_hits})
+
+
+def _group_batch_rows(rows, count: int) -> List[List[Dict[str, Any]]]:
+    """
+    Reparte las filas del LATERAL por consulta (ord empieza en 1).
+    """
+    grouped = [[] for _ in range(count)]
+    for row in rows:
+        grouped[row['ord'] - 1].append(row)
+    return [_to_results(query_rows) for query_rows in grouped]
+
+
+def _build_search_query(query_embedding: List[float], limit: int, filters: Optional[SearchFilters],
+                        mode: str, column: str = SOURCE_COLUMN) -> tuple:
+    """
+    Arma la sentencia de búsqueda (vectorial o híbrida) con sus prefiltros y parámetros.
+    """
+    filters = filters or SearchFilters()
+    params = {
+        # Convertir el vector a formato string de pgvector: '[0.1,0.2,...]'
+        "query_vector": to_pgvector_literal(query_embedding),
+        "limit": limit,
+    }
+    if mode == "hybrid":
+        if not filters.keyword:
+            raise ValueError("El modo híbrido requiere keyword")
+        clauses = _filter_clauses(filters, params, include_keyword=False) + _embedding_clauses(column)
+        text_clauses = clauses + [f"{_TSVECTOR} @@ {_TSQUERY}"]
+        params["keyword"] = filters.keyword
+        params["candidates"] = max(SEARCH_HYBRID_CANDIDATES, limit)
+        params["rrf_k"] = SEARCH_RRF_K
+        sql = _HYBRID_SEARCH_SQL.format(
+            where=_where(clauses), where_text=_where(text_clauses), tsvector=_TSVECTOR, tsquery=_TSQUERY, column=column
+        )
+        return sql, params
+
+    clauses = _filter_clauses(filters, params, include_keyword=True) + _embedding_clauses(column)
+    if quantizer() is not None and column == SOURCE_COLUMN:
+        # Primera pasada sobre la columna cuantizada y rescoring exacto (quantization.py)
+        params["candidates"] = rescore_candidates(limit)
+        return quantized_search_sql(_where(clauses)), params
+    return _SEARCH_SQL.format(where=_where(clauses), column=column), params
+
+
+def _filter_clauses(filters: SearchFilters, params: Dict[str, Any], include_keyword: bool) -> List[str]:
+    clauses = []
+    if filters.metadata:
+        clauses.append("metadata @> %(metadata)s::jsonb")
+        params["metadata"] = json.dumps(filters.metadata)
+    if filters.created_from:
+        clauses.append("created_at >= %(created_from)s")
+        params["created_from"] = filters.created_from
+    if filters.created_to:
+        clauses.append("created_at < %(created_to)s")
+        params["created_to"] = filters.created_to
+    if include_keyword and filters.keyword:
+        clauses.append(f"{_TSVECTOR} @@ {_TSQUERY}")
+        params["keyword"] = filters.keyword
+    return clauses
+
+
+def _where(clauses: List[str]) -> str:
+    return "WHERE " + " AND ".join(clauses) if clauses else ""
+
+
+def _to_results(rows) -> List[Dict[str, Any]]:
+    results = []
+    for row in rows:
+        result = {
+            'id': row['id'],
+            'content': row['content'],
+            'similarity': 1 - float(row['distance'])
+        }
+        if 'score' in row:
+            result['score'] = float(row['score'])
+        results.append(result)
+    return results
+
+
+def _hits_to_results(hits, rows) -> List[Dict[str, Any]]:
+    """
+    Une los resultados del índice ANN con los contenidos leídos de la base, en el orden
+    del índice. Los ids que ya no existen en la base (borrados por otra instancia) se omiten.
+    """
+    contents = {row['id']: row['content'] for row in rows}
+    return [
+        {'id': doc_id, 'content': contents[doc_id], 'similarity': similarity}
+        for doc_id, similarity in hits
+        if doc_id in contents
+    ]
+
+
+# ============================================>
+# Chunks: agrupación de resultados por documento padre (chunking.py)
+# ============================================>
+def _fetch_limit(limit: int) -> int:
+    """Resultados a pedir al índice o a la base: con chunking, varios chunks por documento."""
+    return limit * CHUNK_SEARCH_CANDIDATE_FACTOR if CHUNKING_ENABLED else limit
+
+
+def _embedding_clauses(column: str) -> List[str]:
+    # Las filas padre de un documento dividido no tienen embedding; se filtran siempre, también
+    # con CHUNKING_ENABLED=0, porque pueden quedar filas padre de cuando estaba activo
+    return [f"{column} IS NOT NULL"]
+
+
+def _batch_sql(column: str) -> str:
+    return _BATCH_SEARCH_SQL.format(column=column, where=_where(_embedding_clauses(column)))
+
+
+def _content_sql() -> str:
+    return _PARENTS_SQL if CHUNKING_ENABLED else _CONTENT_BY_ID_SQL
+
+
+def _fetch_parents(cur, rows) -> list:
+    if not CHUNKING_ENABLED or not rows:
+        return []
+    cur.execute(_PARENTS_SQL, (list({row['id'] for row in rows}),))
+    return cur.fetchall()
+
+
+async def _afetch_parents(cur, rows) -> list:
+    if not CHUNKING_ENABLED or not rows:
+        return []
+    await cur.execute(_PARENTS_SQL, (list({row['id'] for row in rows}),))
+    return await cur.fetchall()
+
+
+def _group_by_parent(results: List[Dict[str, Any]], parents, limit: int, aggregate: str) -> List[Dict[str, Any]]:
+    """
+    Junta los chunks encontrados de un mismo documento en un resultado con el id y el contenido
+    del padre. 'similarity' (y 'score' en modo híbrido) es la del mejor chunk y 'chunk_hits' la
+    cantidad de chunks encontrados. Con aggregate="sum" el ranking es por la suma de los chunks
+    ('aggregate_score'), que favorece a los documentos con varios pasajes relevantes.
+    """
+    if not CHUNKING_ENABLED:
+        return results
+    by_id = {row['id']: row for row in parents}
+    grouped: Dict[int, Dict[str, Any]] = {}
+    for result in results:
+        parent = by_id.get(result['id'])
+        if parent is None:
+            continue
+        value = result.get('score', result['similarity'])
+        entry = grouped.get(parent['parent_id'])
+        if entry is None:
+            entry = grouped[parent['parent_id']] = {**result, 'id': parent['parent_id'], 'content': parent['content'],
+                                                    'chunk_hits': 0, 'aggregate_score': 0.0}
+        else:
+            entry['similarity'] = max(entry['similarity'], result['similarity'])
+            if 'score' in result:
+                entry['score'] = max(entry['score'], result['score'])
+        entry['chunk_hits'] += 1
+        entry['aggregate_score'] += value
+
+    if aggregate == "sum":
+        ranked = sorted(grouped.values(), key=lambda entry: entry['aggregate_score'], reverse=True)
+    else:
+        ranked = sorted(grouped.values(), key=lambda entry: entry.get('score', entry['similarity']), reverse=True)
+        for entry in ranked:
+            del entry['aggregate_score']
+    return ranked[:limit]
@@ -0,0 +1,16 @@
+-- ============================================>
+-- Tabla base `documents` (la que ya existe en Neon), para levantar una base local con
+-- pgvector: benchmarks/load_test.py, desarrollo sin Neon. Después correr 001..00N en orden.
+-- ============================================>
+CREATE EXTENSION IF NOT EXISTS vector;
+
+CREATE TABLE IF NOT EXISTS documents (
+    id BIGSERIAL PRIMARY KEY,
+    content TEXT NOT NULL,
+    embedding vector(384),
+    metadata JSONB,
+    source TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS documents_embedding_hnsw_idx ON documents USING hnsw (embedding vector_cosine_ops);
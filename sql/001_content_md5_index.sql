@@ -0,0 +1,5 @@
+-- ============================================>
+-- Índice para la capa persistente de la caché de embeddings (embedding_cache.py)
+-- Permite buscar filas de documents por md5(content) sin recorrer la tabla.
+-- ============================================>
+CREATE INDEX IF NOT EXISTS documents_content_md5_idx ON documents (md5(content));
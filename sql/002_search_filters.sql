@@ -0,0 +1,9 @@
+-- ============================================>
+-- Índices para los prefiltros de /search (search_service.py)
+-- metadata @> ... usa el GIN jsonb_path_ops, keyword usa el GIN sobre el tsvector
+-- (la expresión debe coincidir con la de search_service._TSVECTOR) y el rango de
+-- fechas usa el btree sobre created_at.
+-- ============================================>
+CREATE INDEX IF NOT EXISTS documents_metadata_gin_idx ON documents USING GIN (metadata jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS documents_content_tsv_idx ON documents USING GIN (to_tsvector('simple', content));
+CREATE INDEX IF NOT EXISTS documents_created_at_idx ON documents (created_at);
@@ -0,0 +1,35 @@
+-- ============================================>
+-- Cola de jobs de embeddings en segundo plano (jobs.py, JOBS_BACKEND=postgres)
+-- Los workers toman chunks con FOR UPDATE SKIP LOCKED; locked_at es epoch en segundos
+-- y un chunk "running" con lease vencido vuelve a tomarse (retoma tras un crash).
+-- ============================================>
+CREATE TABLE IF NOT EXISTS embedding_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    chunks INTEGER NOT NULL,
+    processed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS embedding_job_chunks (
+    job_id BIGINT NOT NULL REFERENCES embedding_jobs (id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    texts JSONB,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    locked_by TEXT,
+    locked_at DOUBLE PRECISION,
+    document_ids JSONB,
+    failures JSONB,
+    error TEXT,
+    PRIMARY KEY (job_id, chunk_index)
+);
+
+CREATE INDEX IF NOT EXISTS embedding_job_chunks_claimable_idx
+    ON embedding_job_chunks (job_id, chunk_index)
+    WHERE status IN ('pending', 'running');
@@ -0,0 +1,13 @@
+-- ============================================>
+-- Columnas cuantizadas de embedding (quantization.py, QUANTIZED_STORAGE)
+-- Requiere pgvector >= 0.7 (halfvec, bit y binary_quantize).
+-- Las filas existentes se completan con: python manage.py quantize-backfill --kind halfvec
+-- ============================================>
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS embedding_half halfvec(384);
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS embedding_bit bit(384);
+
+-- Índices HNSW para la primera pasada (crear solo el del tipo que se use)
+CREATE INDEX IF NOT EXISTS documents_embedding_half_hnsw_idx
+    ON documents USING hnsw (embedding_half halfvec_cosine_ops);
+CREATE INDEX IF NOT EXISTS documents_embedding_bit_hnsw_idx
+    ON documents USING hnsw (embedding_bit bit_hamming_ops);
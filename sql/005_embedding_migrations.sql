@@ -0,0 +1,24 @@
+-- ============================================>
+-- Migraciones online de modelo / dimensiones (model_migration.py)
+-- La columna destino (vector(N)) la agrega `python manage.py migrate-start`.
+-- ============================================>
+CREATE TABLE IF NOT EXISTS embedding_migrations (
+    id BIGSERIAL PRIMARY KEY,
+    target_model TEXT NOT NULL,
+    target_dimensions INTEGER NOT NULL,
+    target_column TEXT NOT NULL,
+    backend TEXT NOT NULL DEFAULT 'hf',
+    -- backfilling -> cutover -> finished (o aborted)
+    status TEXT NOT NULL,
+    last_id BIGINT NOT NULL DEFAULT 0,
+    processed BIGINT NOT NULL DEFAULT 0,
+    throughput DOUBLE PRECISION,
+    started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    cutover_at TIMESTAMPTZ
+);
+
+-- Una sola migración activa a la vez
+CREATE UNIQUE INDEX IF NOT EXISTS embedding_migrations_active_idx
+    ON embedding_migrations ((true))
+    WHERE status IN ('backfilling', 'cutover');
@@ -0,0 +1,18 @@
+-- ============================================>
+-- Deduplicación de la ingesta por hash del contenido (document_store.aupsert_documents)
+-- content_hash = sha256 hex del contenido tal como se guarda (document_store.content_hash).
+-- Para las filas existentes solo se completa el hash de la primera fila de cada contenido:
+-- los duplicados previos quedan en NULL y no chocan con el índice único.
+-- ============================================>
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+UPDATE documents d
+SET content_hash = encode(sha256(convert_to(d.content, 'UTF8')), 'hex')
+FROM (
+    SELECT MIN(id) AS id
+    FROM documents
+    GROUP BY encode(sha256(convert_to(content, 'UTF8')), 'hex')
+) first_rows
+WHERE d.id = first_rows.id AND d.content_hash IS NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS documents_content_hash_key ON documents (content_hash);
@@ -0,0 +1,6 @@
+-- ============================================>
+-- Paginación keyset de /documents/latest y /documents/earliest (document_listing.py)
+-- WHERE (created_at, id) < (...) ORDER BY created_at DESC, id DESC se resuelve con un
+-- recorrido del índice, sin ordenar la tabla. /documents/range usa la clave primaria.
+-- ============================================>
+CREATE INDEX IF NOT EXISTS documents_created_at_id_idx ON documents (created_at, id);
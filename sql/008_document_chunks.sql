@@ -0,0 +1,10 @@
+-- ============================================>
+-- Documentos largos divididos en chunks (chunking.py, CHUNKING_ENABLED=1)
+-- El documento se guarda en una fila padre (contenido completo, embedding NULL) y cada
+-- chunk en una fila hija con parent_id y chunk_index. Borrar el padre borra sus chunks.
+-- Las búsquedas filtran embedding IS NOT NULL y agrupan los chunks por parent_id.
+-- ============================================>
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS parent_id BIGINT REFERENCES documents(id) ON DELETE CASCADE;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS chunk_index INT;
+
+CREATE INDEX IF NOT EXISTS documents_parent_id_idx ON documents (parent_id) WHERE parent_id IS NOT NULL;
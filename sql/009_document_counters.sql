@@ -0,0 +1,91 @@
+-- ============================================>
+-- Estadísticas de documents sin recorrer la tabla (document_counters.py, DOCUMENT_COUNTERS_ENABLED=1)
+-- Una fila por modelo (metadata->>'model') con cantidad de documentos, suma de largos y
+-- fechas extremas, mantenida por triggers por sentencia en la misma transacción que el
+-- INSERT/DELETE (un upsert por sentencia, no por fila). Los chunks (parent_id, ver
+-- sql/008_document_chunks.sql) no cuentan como documentos. Correr después de 008.
+-- Si se desincroniza (TRUNCATE, triggers deshabilitados): python manage.py stats-reconcile
+-- ============================================>
+CREATE TABLE IF NOT EXISTS document_counters (
+    model TEXT PRIMARY KEY,
+    documents BIGINT NOT NULL DEFAULT 0,
+    content_chars BIGINT NOT NULL DEFAULT 0,
+    min_created_at TIMESTAMPTZ,
+    max_created_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION document_counters_sync() RETURNS trigger AS $$
+DECLARE
+    source TEXT := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT 1 AS sign, * FROM new_rows'
+        WHEN 'DELETE' THEN 'SELECT -1 AS sign, * FROM old_rows'
+        ELSE 'SELECT 1 AS sign, * FROM new_rows UNION ALL SELECT -1 AS sign, * FROM old_rows'
+    END;
+BEGIN
+    -- En un UPDATE que no cambia modelo ni contenido (ej. backfill de embeddings) las
+    -- diferencias suman 0 y no se toca document_counters
+    EXECUTE format($sql$
+        INSERT INTO document_counters AS c (model, documents, content_chars, min_created_at, max_created_at)
+        SELECT COALESCE(metadata->>'model', ''), SUM(sign), SUM(sign * length(content)),
+               MIN(created_at) FILTER (WHERE sign > 0), MAX(created_at) FILTER (WHERE sign > 0)
+        FROM (%s) delta
+        WHERE parent_id IS NULL
+        GROUP BY 1
+        HAVING SUM(sign) <> 0 OR SUM(sign * length(content)) <> 0
+        ORDER BY 1  -- mismo orden de bloqueo de filas en transacciones concurrentes
+        ON CONFLICT (model) DO UPDATE SET
+            documents = c.documents + EXCLUDED.documents,
+            content_chars = c.content_chars + EXCLUDED.content_chars,
+            min_created_at = LEAST(c.min_created_at, EXCLUDED.min_created_at),
+            max_created_at = GREATEST(c.max_created_at, EXCLUDED.max_created_at),
+            updated_at = now()
+    $sql$, source);
+
+    -- Si se borró el documento más antiguo o más nuevo de un modelo se recalcula ese extremo
+    -- (MIN/MAX por el índice de sql/007_documents_keyset.sql)
+    IF TG_OP = 'DELETE' THEN
+        UPDATE document_counters c SET
+            min_created_at = (SELECT MIN(created_at) FROM documents d
+                              WHERE d.parent_id IS NULL AND COALESCE(d.metadata->>'model', '') = c.model),
+            max_created_at = (SELECT MAX(created_at) FROM documents d
+                              WHERE d.parent_id IS NULL AND COALESCE(d.metadata->>'model', '') = c.model)
+        WHERE EXISTS (
+            SELECT 1 FROM old_rows o
+            WHERE o.parent_id IS NULL AND COALESCE(o.metadata->>'model', '') = c.model
+              AND (o.created_at <= c.min_created_at OR o.created_at >= c.max_created_at)
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS documents_counters_insert ON documents;
+CREATE TRIGGER documents_counters_insert AFTER INSERT ON documents
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION document_counters_sync();
+
+DROP TRIGGER IF EXISTS documents_counters_update ON documents;
+CREATE TRIGGER documents_counters_update AFTER UPDATE ON documents
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION document_counters_sync();
+
+DROP TRIGGER IF EXISTS documents_counters_delete ON documents;
+CREATE TRIGGER documents_counters_delete AFTER DELETE ON documents
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION document_counters_sync();
+
+-- Carga inicial (lo mismo que manage.py stats-reconcile), en una transacción: LOCK TABLE
+-- fuera de una transacción falla con el autocommit de psql. SHARE sobre documents espera a
+-- las escrituras en curso y frena las nuevas hasta el COMMIT, así ningún INSERT se cuenta
+-- dos veces (trigger + recuento) ni se pierde entre el DELETE y el recuento.
+BEGIN;
+LOCK TABLE documents IN SHARE MODE;
+LOCK TABLE document_counters IN EXCLUSIVE MODE;
+DELETE FROM document_counters;
+INSERT INTO document_counters (model, documents, content_chars, min_created_at, max_created_at)
+SELECT COALESCE(metadata->>'model', ''), COUNT(*), COALESCE(SUM(length(content)), 0), MIN(created_at), MAX(created_at)
+FROM documents
+WHERE parent_id IS NULL
+GROUP BY 1;
+COMMIT;
@@ -0,0 +1,38 @@
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+"""
+Fixtures comunes. Los tests corren sin red ni Postgres: el backend de embeddings es el
+servidor falso de benchmarks/fake_hf_server.py y la cola de jobs usa SQLite.
+"""
+
+# Antes de importar hf_client (exige HF_TOKEN) y sin capa persistente (no hay base)
+os.environ.setdefault("HF_TOKEN", "hf_test")
+os.environ["EMBEDDING_CACHE_PERSISTENT"] = "0"
+
+from benchmarks import fake_hf_server  # noqa: E402
+
+_DEFAULT_CONFIG = dict(fake_hf_server.config)
+
+
+@pytest.fixture(scope="session")
+def fake_hf_url():
+    server = fake_hf_server.serve(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.fixture
+def fake_hf(fake_hf_url):
+    """Servidor falso con la configuración por defecto y los contadores en cero."""
+    fake_hf_server.control({**_DEFAULT_CONFIG, "reset_loading": True})
+    with fake_hf_server._lock:
+        for key in fake_hf_server.stats:
+            fake_hf_server.stats[key] = 0
+    yield fake_hf_server
+    fake_hf_server.control(dict(_DEFAULT_CONFIG))
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import numpy as np
+import ann_index
+from ann_index import IVFIndex, AnnIndexManager, ANN_INDEX_NPROBE, ANN_INDEX_MIN_ROWS_FOR_IVF
+
+"""
+Índice IVF en memoria (ann_index.py) sobre vectores sintéticos agrupados: recall@k contra la
+búsqueda exacta con el nprobe por defecto, y el índice no vence solo con la configuración
+por defecto.
+"""
+
+DIMENSIONS = 64
+
+
+def _clustered(n, clusters=40, noise=0.35, seed=1):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, DIMENSIONS))
+    return (centers[rng.integers(clusters, size=n)] + noise * rng.normal(size=(n, DIMENSIONS))).astype(np.float32)
+
+
+def _built_index():
+    n = ANN_INDEX_MIN_ROWS_FOR_IVF + 1000
+    index = IVFIndex(dimensions=DIMENSIONS)
+    index.build(np.arange(1, n + 1), _clustered(n))
+    return index
+
+
+def test_ivf_recall_at_default_nprobe():
+    index = _built_index()
+    assert index.centroids is not None
+    k = 10
+    queries = _clustered(100, seed=2)
+    hits = 0
+    for query in queries:
+        approx = {doc_id for doc_id, _ in index.search(query, k)}
+        exact = {doc_id for doc_id, _ in index.search(query, k, exact=True)}
+        hits += len(approx & exact)
+    assert hits / (k * len(queries)) >= 0.9
+
+
+def test_manager_recall_uses_default_nprobe():
+    manager = AnnIndexManager()
+    manager._index = _built_index()
+    report = manager.recall_at_k(k=10, samples=50)
+    assert report["nprobe"] == ANN_INDEX_NPROBE
+    assert report["recall_at_k"] >= 0.9
+
+
+def test_index_does_not_expire_by_default(monkeypatch):
+    monkeypatch.setattr(ann_index, "ANN_INDEX_ENABLED", True)
+    manager = AnnIndexManager()
+    manager._index = IVFIndex(dimensions=DIMENSIONS)
+    manager.loaded_at = 0.0
+    assert ann_index.ANN_INDEX_MAX_AGE_SECONDS == 0
+    assert manager.ready()
+    assert manager.status()["ready"]
+
+
+def test_recall_is_relative_to_the_rows_available():
+    manager = AnnIndexManager()
+    manager._index = IVFIndex(dimensions=DIMENSIONS)
+    manager._index.build(np.arange(1, 6), _clustered(5))
+    report = manager.recall_at_k(k=10, samples=5)
+    assert report["recall_at_k"] == 1.0
+
+
+def test_snapshot_is_not_affected_by_later_writes():
+    index = _built_index()
+    query = index.vectors[0].astype(np.float32)
+    view = index.snapshot()
+    before = view.search(query, 5)
+    index.remove([int(index.ids[0])])
+    index.add([999999], [query])
+    assert view.search(query, 5) == before
+    assert index.search(query, 1)[0][0] == 999999
+
+
+def test_async_search_runs_outside_the_event_loop(monkeypatch):
+    monkeypatch.setattr(ann_index, "ANN_INDEX_ENABLED", True)
+    manager = AnnIndexManager()
+    manager._index = _built_index()
+    query = manager._index.vectors[3].astype(np.float32)
+    threads = []
+    search = manager.search
+
+    def recording_search(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return search(*args, **kwargs)
+
+    monkeypatch.setattr(manager, "search", recording_search)
+    hits = asyncio.run(manager.asearch(query, 3))
+    assert hits[0][0] == int(manager._index.ids[3])
+    assert threads and threads[0] is not threading.main_thread()
@@ -0,0 +1,139 @@
+import time
+import asyncio
+import threading
+import pytest
+from hf_client import RequestCoalescer, AsyncRequestCoalescer
+
+"""
+Ventana de agrupado de pedidos (hf_client.RequestCoalescer / AsyncRequestCoalescer): reparto
+de resultados entre los pedidos agrupados y cancelación del líder o de un seguidor.
+"""
+
+WINDOW_MS = 200
+
+
+def _vector(text):
+    return [float(len(text)), float(ord(text[0]))]
+
+
+class FakeSend:
+    """Backend falso: registra cada batch enviado."""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    async def __call__(self, texts):
+        self.batches.append(list(texts))
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise RuntimeError("backend caído")
+        return [_vector(text) for text in texts]
+
+
+def test_results_are_split_across_merged_callers():
+    send = FakeSend()
+    coalescer = AsyncRequestCoalescer(send, window_ms=WINDOW_MS, max_batch=16)
+
+    async def run():
+        return await asyncio.gather(coalescer.submit(["a", "bb"]), coalescer.submit(["bb", "ccc"]),
+                                    coalescer.submit(["a"]))
+
+    results = asyncio.run(run())
+    assert send.batches == [["a", "bb", "ccc"]]
+    assert results == [[_vector("a"), _vector("bb")], [_vector("bb"), _vector("ccc")], [_vector("a")]]
+    assert coalescer.stats()["batches"] == 1
+
+
+def test_window_is_split_at_max_batch():
+    send = FakeSend()
+    coalescer = AsyncRequestCoalescer(send, window_ms=WINDOW_MS, max_batch=3)
+
+    async def run():
+        return await asyncio.gather(coalescer.submit(["a", "b"]), coalescer.submit(["c", "d"]))
+
+    results = asyncio.run(run())
+    assert send.batches == [["a", "b"], ["c", "d"]]
+    assert results == [[_vector("a"), _vector("b")], [_vector("c"), _vector("d")]]
+
+
+def test_send_error_reaches_every_caller():
+    coalescer = AsyncRequestCoalescer(FakeSend(fail=True), window_ms=WINDOW_MS, max_batch=16)
+
+    async def run():
+        return await asyncio.gather(coalescer.submit(["a"]), coalescer.submit(["b"]), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_cancelled_leader_still_closes_the_window():
+    send = FakeSend()
+    coalescer = AsyncRequestCoalescer(send, window_ms=WINDOW_MS, max_batch=16)
+
+    async def run():
+        leader = asyncio.ensure_future(coalescer.submit(["a"]))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(coalescer.submit([text])) for text in ("b", "c")]
+        await asyncio.sleep(0.02)
+        start = time.monotonic()
+        leader.cancel()
+        results = await asyncio.wait_for(asyncio.gather(*followers), 1)
+        waited = time.monotonic() - start
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # La ventana siguiente tiene su propio líder
+        after = await asyncio.wait_for(coalescer.submit(["d"]), 1)
+        return results, waited, after
+
+    results, waited, after = asyncio.run(run())
+    assert results == [[_vector("b")], [_vector("c")]]
+    assert waited < WINDOW_MS / 1000
+    assert send.batches == [["a", "b", "c"], ["d"]]
+    assert after == [_vector("d")]
+
+
+def test_cancelled_follower_does_not_break_the_batch():
+    send = FakeSend()
+    coalescer = AsyncRequestCoalescer(send, window_ms=50, max_batch=16)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        errors = []
+        loop.set_exception_handler(lambda loop, context: errors.append(context))
+        leader = asyncio.ensure_future(coalescer.submit(["a"]))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(coalescer.submit(["b"]))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        result = await asyncio.wait_for(leader, 1)
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        await asyncio.sleep(0.02)
+        return result, errors
+
+    result, errors = asyncio.run(run())
+    assert result == [_vector("a")]
+    assert errors == []
+
+
+def test_sync_coalescer_merges_threads():
+    batches = []
+
+    def send(texts):
+        batches.append(list(texts))
+        return [_vector(text) for text in texts]
+
+    coalescer = RequestCoalescer(send, window_ms=100, max_batch=16)
+    results = {}
+
+    def call(text):
+        results[text] = coalescer.submit([text])
+
+    threads = [threading.Thread(target=call, args=(text,)) for text in ("a", "bb", "ccc")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(batches) == 1 and sorted(batches[0]) == ["a", "bb", "ccc"]
+    assert results == {text: [_vector(text)] for text in ("a", "bb", "ccc")}
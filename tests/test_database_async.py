@@ -0,0 +1,40 @@
+import asyncio
+import database_async
+
+"""
+Apertura perezosa del pool async (database_async.py): requests concurrentes en el primer uso
+comparten un único pool.
+"""
+
+
+class FakePool:
+    opened = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def open(self):
+        await asyncio.sleep(0.01)
+        FakePool.opened += 1
+
+    async def close(self):
+        pass
+
+    @staticmethod
+    async def check_connection(conn):
+        pass
+
+
+def test_concurrent_first_use_opens_a_single_pool(monkeypatch):
+    monkeypatch.setattr(database_async, "AsyncConnectionPool", FakePool)
+    monkeypatch.setattr(database_async, "_database_url", lambda: "postgresql://test")
+    monkeypatch.setattr(database_async, "_async_pool", None)
+
+    async def first_requests():
+        pools = await asyncio.gather(*[database_async.get_async_pool() for _ in range(10)])
+        await database_async.close_async_pool()
+        return pools
+
+    pools = asyncio.run(first_requests())
+    assert FakePool.opened == 1
+    assert all(pool is pools[0] for pool in pools)
@@ -0,0 +1,175 @@
+import asyncio
+import base64
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone, timedelta
+import pytest
+from fastapi import HTTPException
+import document_listing
+from document_listing import encode_cursor, decode_cursor, afetch_page, aexport_documents
+
+"""
+Paginación keyset y exportación de documents (document_listing.py) sobre una tabla en memoria:
+cursores opacos, desempate por (created_at, id), cursores inválidos y filas de chunks.
+"""
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _row(doc_id, minutes, parent_id=None):
+    return {"id": doc_id, "content": f"doc {doc_id}", "metadata": {}, "created_at": T0 + timedelta(minutes=minutes),
+            "parent_id": parent_id}
+
+
+class FakeTable:
+    """Evalúa en Python las consultas que arma document_listing (WHERE keyset, ORDER BY, LIMIT)."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = []
+
+    def select(self, sql, params):
+        self.statements.append(sql)
+        rows = self.rows
+        if "parent_id IS NULL" in sql:
+            rows = [row for row in rows if row["parent_id"] is None]
+        if isinstance(params, tuple):
+            rows = [row for row in rows if row["id"] > params[0]]
+        elif "(created_at, id) <" in sql:
+            rows = [row for row in rows if (row["created_at"], row["id"]) < (params["created_at"], params["id"])]
+        elif "(created_at, id) >" in sql:
+            rows = [row for row in rows if (row["created_at"], row["id"]) > (params["created_at"], params["id"])]
+        elif "id > %(id)s" in sql:
+            rows = [row for row in rows if row["id"] > params["id"]]
+        elif "id >= %(id)s" in sql:
+            rows = [row for row in rows if row["id"] >= params["id"]]
+        if "created_at DESC" in sql:
+            rows = sorted(rows, key=lambda row: (row["created_at"], row["id"]), reverse=True)
+        elif "created_at ASC" in sql:
+            rows = sorted(rows, key=lambda row: (row["created_at"], row["id"]))
+        else:
+            rows = sorted(rows, key=lambda row: row["id"])
+        if isinstance(params, dict):
+            rows = rows[:params["limit"]]
+        return [{key: row[key] for key in ("id", "content", "metadata", "created_at")} for row in rows]
+
+
+class FakeCursor:
+    def __init__(self, table):
+        self.table = table
+        self.result = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql, params=None):
+        self.result = self.table.select(sql, params)
+
+    async def fetchall(self):
+        return self.result
+
+    def __aiter__(self):
+        return self._rows()
+
+    async def _rows(self):
+        for row in self.result:
+            yield row
+
+
+class FakeConnection:
+    def __init__(self, table):
+        self.table = table
+
+    def cursor(self, name=None):
+        return FakeCursor(self.table)
+
+    async def rollback(self):
+        pass
+
+
+@pytest.fixture
+def table(monkeypatch):
+    # Dos pares de filas con el mismo created_at, y un documento con dos chunks
+    fake = FakeTable([_row(1, 0), _row(2, 1), _row(3, 1), _row(4, 2), _row(5, 2), _row(6, 3),
+                      _row(7, 4, parent_id=6), _row(8, 4, parent_id=6)])
+
+    @asynccontextmanager
+    async def fake_connection():
+        yield FakeConnection(fake)
+
+    monkeypatch.setattr(document_listing, "async_connection", fake_connection)
+    monkeypatch.setattr(document_listing, "CHUNKING_ENABLED", True)
+    return fake
+
+
+def _all_pages(order, limit):
+    async def run():
+        ids, cursor, pages = [], None, 0
+        while True:
+            rows, cursor = await afetch_page(order, limit, cursor)
+            ids.extend(row["id"] for row in rows)
+            pages += 1
+            if cursor is None:
+                return ids, pages
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("order", ["created_desc", "created_asc", "id_asc"])
+def test_cursor_round_trip(order):
+    row = _row(42, 5)
+    params = decode_cursor(encode_cursor(order, row), order)
+    assert params["id"] == 42
+    if order != "id_asc":
+        assert params["created_at"] == row["created_at"]
+
+
+def test_pages_break_ties_on_id_without_skipping_or_repeating(table):
+    ids, pages = _all_pages("created_desc", 2)
+    assert ids == [6, 5, 4, 3, 2, 1]
+    assert pages == 3
+    ids, _ = _all_pages("created_asc", 1)
+    assert ids == [1, 2, 3, 4, 5, 6]
+    ids, _ = _all_pages("id_asc", 4)
+    assert ids == [1, 2, 3, 4, 5, 6]
+
+
+def test_chunk_rows_are_not_listed_or_exported(table):
+    rows, _ = asyncio.run(afetch_page("created_desc", 10))
+    assert [row["id"] for row in rows] == [6, 5, 4, 3, 2, 1]
+    assert all("parent_id IS NULL" in sql for sql in table.statements)
+
+    async def export():
+        return [line async for line in aexport_documents(after_id=3)]
+
+    lines = asyncio.run(export())
+    assert len(lines) == 3
+    assert "parent_id IS NULL" in table.statements[-1]
+
+
+def test_without_chunking_the_filter_is_not_added(table, monkeypatch):
+    monkeypatch.setattr(document_listing, "CHUNKING_ENABLED", False)
+    rows, _ = asyncio.run(afetch_page("id_asc", 10))
+    assert len(rows) == 8
+    assert "parent_id" not in table.statements[-1]
+
+
+@pytest.mark.parametrize("cursor", [
+    "no es base64 !!",
+    base64.urlsafe_b64encode(b"no es json").decode(),
+    base64.urlsafe_b64encode(b'{"o":"created_desc","i":"x","t":"2026-01-01T00:00:00"}').decode(),
+    base64.urlsafe_b64encode(b'{"o":"created_desc","i":1}').decode(),
+    base64.urlsafe_b64encode(b'{"o":"created_desc","i":1,"t":"ayer"}').decode(),
+    base64.urlsafe_b64encode(b"[1, 2]").decode(),
+])
+def test_malformed_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as raised:
+        decode_cursor(cursor, "created_desc")
+    assert raised.value.status_code == 400
+
+
+def test_cursor_from_another_order_is_rejected():
+    cursor = encode_cursor("id_asc", _row(1, 0))
+    with pytest.raises(HTTPException):
+        decode_cursor(cursor, "created_desc")
@@ -0,0 +1,125 @@
+import asyncio
+from contextlib import asynccontextmanager
+import pytest
+import document_store
+from chunking import pooled_embedding
+
+"""
+Ingesta con deduplicación (document_store.aupsert_documents) sobre una conexión falsa: con
+CONTENT_HASH_ENABLED=1 y CHUNKING_ENABLED=1 los textos largos se siguen dividiendo en chunks.
+"""
+
+
+class FakeCursor:
+    def __init__(self):
+        self.statements = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql, params=None):
+        self.statements.append(sql)
+
+    async def fetchall(self):
+        return []
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cursors = []
+        self.commits = 0
+
+    def cursor(self):
+        cursor = FakeCursor()
+        self.cursors.append(cursor)
+        return cursor
+
+    async def commit(self):
+        self.commits += 1
+
+
+class FakeStore:
+    """Reemplaza las sentencias de aupsert_documents y registra lo que se escribe."""
+
+    def __init__(self, existing=None):
+        self.existing = existing or {}
+        self.rows = []
+        self.chunked = []
+        self.embedded = []
+        self._next_id = 100
+        self.open_connections = 0
+        self.connections_during_embed = []
+
+    def _id(self):
+        self._next_id += 1
+        return self._next_id
+
+    async def embed(self, texts):
+        self.connections_during_embed.append(self.open_connections)
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    async def fetch_existing(self, conn, hashes):
+        return {digest: self.existing[digest] for digest in hashes if digest in self.existing}
+
+    async def upsert_rows(self, conn, rows, on_conflict):
+        self.rows.extend(rows)
+        return {row[-1]: {"id": self._id(), "updated": False} for row in rows}, {}
+
+    async def upsert_chunked(self, cur, text, digest, chunks, embeddings, metadata, on_conflict):
+        self.chunked.append((text, digest, chunks))
+        return {"id": self._id(), "updated": False, "chunk_ids": [self._id() for _ in chunks], "removed_ids": []}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    fake = FakeStore()
+
+    @asynccontextmanager
+    async def fake_connection():
+        fake.open_connections += 1
+        try:
+            yield FakeConnection()
+        finally:
+            fake.open_connections -= 1
+
+    monkeypatch.setattr(document_store, "CHUNKING_ENABLED", True)
+    monkeypatch.setattr(document_store, "chunk_text", lambda text: text.split("|"))
+    monkeypatch.setattr(document_store, "async_connection", fake_connection)
+    monkeypatch.setattr(document_store, "_afetch_existing", fake.fetch_existing)
+    monkeypatch.setattr(document_store, "_aupsert_rows", fake.upsert_rows)
+    monkeypatch.setattr(document_store, "_aupsert_chunked", fake.upsert_chunked)
+    return fake
+
+
+def test_dedupe_with_chunking_splits_long_texts(store):
+    texts = ["corto", "uno|dos|tres", "corto"]
+    result = asyncio.run(document_store.aupsert_documents(texts, store.embed))
+
+    assert store.embedded == ["corto", "uno", "dos", "tres"]
+    assert [row[0] for row in store.rows] == ["corto"]
+    assert store.chunked == [("uno|dos|tres", document_store.content_hash("uno|dos|tres"), ["uno", "dos", "tres"])]
+    assert result["statuses"] == ["inserted", "inserted", "duplicate"]
+    assert result["chunks"] == [1, 3, 1]
+    assert result["embeddings"][1] == pooled_embedding([[3.0, 1.0], [3.0, 1.0], [4.0, 1.0]])
+    # Al índice ANN van la fila corta y los chunks, no la fila padre
+    assert len(result["written_ids"]) == 4
+    assert result["document_ids"][1] not in result["written_ids"]
+
+
+def test_existing_chunked_document_is_not_embedded_again(store):
+    digest = document_store.content_hash("uno|dos")
+    store.existing[digest] = {"id": 7, "embedding": [0.6, 0.8], "status": "existing", "chunks": 2}
+    result = asyncio.run(document_store.aupsert_documents(["uno|dos"], store.embed))
+
+    assert store.embedded == []
+    assert (result["document_ids"], result["statuses"], result["chunks"]) == ([7], ["existing"], [2])
+
+
+def test_no_connection_is_held_while_embedding(store):
+    asyncio.run(document_store.aupsert_documents(["uno", "dos|tres"], store.embed))
+    assert store.connections_during_embed == [0]
+    assert store.open_connections == 0
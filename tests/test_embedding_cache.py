@@ -0,0 +1,78 @@
+import time
+import hf_client
+from embedding_cache import EmbeddingCache, cache_key, embedding_cache, _entry_size
+
+"""
+Caché de embeddings en memoria (embedding_cache.py): desalojo LRU por presupuesto de bytes,
+vencimiento por TTL y claves separadas por modelo y por texto normalizado.
+"""
+
+VECTOR = [0.1] * 8
+
+
+def _key(i):
+    return cache_key(f"texto {i}")
+
+
+def test_evicts_least_recently_used_to_stay_within_max_bytes():
+    entry = _entry_size(_key(0), VECTOR)
+    cache = EmbeddingCache(max_bytes=entry * 3, ttl_seconds=60)
+    cache.put_many({_key(i): VECTOR for i in range(3)})
+    # Usar la 0 la vuelve la más reciente: se desaloja la 1
+    assert list(cache.get_many([_key(0)])) == [_key(0)]
+    cache.put_many({_key(3): VECTOR})
+
+    assert set(cache.get_many([_key(i) for i in range(4)])) == {_key(0), _key(2), _key(3)}
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] <= stats["max_bytes"]
+
+
+def test_entry_larger_than_budget_is_not_stored():
+    cache = EmbeddingCache(max_bytes=_entry_size(_key(0), VECTOR) - 1, ttl_seconds=60)
+    cache.put_many({_key(0): VECTOR})
+    assert cache.get_many([_key(0)]) == {}
+    assert cache.stats()["bytes"] == 0
+
+
+def test_replacing_an_entry_does_not_double_count_bytes():
+    cache = EmbeddingCache(max_bytes=10 ** 6, ttl_seconds=60)
+    cache.put_many({_key(0): VECTOR})
+    cache.put_many({_key(0): [0.2] * 8})
+    assert cache.stats()["bytes"] == _entry_size(_key(0), VECTOR)
+    assert cache.get_many([_key(0)])[_key(0)] == [0.2] * 8
+
+
+def test_entries_expire_after_ttl():
+    cache = EmbeddingCache(max_bytes=10 ** 6, ttl_seconds=0.05)
+    cache.put_many({_key(0): VECTOR})
+    assert cache.get_many([_key(0)]) == {_key(0): VECTOR}
+    time.sleep(0.06)
+    assert cache.get_many([_key(0)]) == {}
+    stats = cache.stats()
+    assert (stats["expirations"], stats["entries"], stats["bytes"]) == (1, 0, 0)
+
+
+def test_key_depends_on_model_and_normalized_text():
+    assert cache_key("  hola   mundo\n") == cache_key("hola mundo")
+    assert cache_key("Hola mundo") != cache_key("hola mundo")
+    assert cache_key("hola", model="BAAI/bge-small-en-v1.5") != cache_key("hola", model="BAAI/bge-base-en-v1.5")
+    assert cache_key("hola", model="BAAI/bge-base-en-v1.5").startswith("BAAI/bge-base-en-v1.5:")
+
+
+def test_only_misses_go_upstream(monkeypatch):
+    sent = []
+
+    class FakeCoalescer:
+        def submit(self, texts):
+            sent.append(list(texts))
+            return [[float(len(text))] for text in texts]
+
+    monkeypatch.setattr(hf_client, "coalescer", FakeCoalescer())
+    embedding_cache.clear()
+    try:
+        assert hf_client.get_embeddings_from_hf(["a", "bb", "a"]) == [[1.0], [2.0], [1.0]]
+        assert hf_client.get_embeddings_from_hf(["bb", " a ", "ccc"]) == [[2.0], [1.0], [3.0]]
+        assert sent == [["a", "bb"], ["ccc"]]
+    finally:
+        embedding_cache.clear()
@@ -0,0 +1,139 @@
+import threading
+import pytest
+import jobs
+from jobs import SqliteJobStore, JobWorkerPool
+
+"""
+Cola de jobs (jobs.py) con la cola local en SQLite y funciones falsas de embeddings e
+INSERT: alta del job, toma de chunks sin duplicados entre workers, checkpoint por chunk y
+retoma de un job cuyo worker murió a mitad de camino.
+"""
+
+
+class FakeDocuments:
+    """Reemplaza a get_embeddings_from_hf e insert_documents; registra cada texto embebido."""
+
+    def __init__(self, fail_on=None):
+        self.embedded = []
+        self.fail_on = fail_on
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def embed(self, texts):
+        if self.fail_on is not None and self.fail_on in texts:
+            raise RuntimeError("backend caído")
+        with self._lock:
+            self.embedded.extend(texts)
+        return [[float(len(text))] for text in texts]
+
+    def insert(self, texts, embeddings, metadata=None, conn=None):
+        with self._lock:
+            ids = list(range(self._next_id, self._next_id + len(texts)))
+            self._next_id += len(texts)
+        return ids, []
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SqliteJobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture
+def fake_documents(monkeypatch):
+    fake = FakeDocuments()
+    monkeypatch.setattr(jobs, "get_embeddings_from_hf", fake.embed)
+    monkeypatch.setattr(jobs, "insert_documents", fake.insert)
+    return fake
+
+
+def _texts(n):
+    return [f"texto {i}" for i in range(n)]
+
+
+def test_submit_creates_queued_job_with_chunks(store):
+    job_id = store.create_job(_texts(10), chunk_size=4)
+    job = store.get_job(job_id, include_chunks=True)
+    assert job["status"] == "queued"
+    assert (job["total"], job["chunks"], job["processed"]) == (10, 3, 0)
+    assert [chunk["status"] for chunk in job["chunks_detail"]] == ["pending"] * 3
+    assert store.get_job(job_id + 1) is None
+
+
+def test_concurrent_workers_never_claim_the_same_chunk(store):
+    job_id = store.create_job(_texts(200), chunk_size=5)
+    claimed = []
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        while True:
+            chunk = store.claim_chunk(worker_id)
+            if chunk is None:
+                return
+            with lock:
+                claimed.append((chunk["job_id"], chunk["chunk_index"]))
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(claimed) == len(set(claimed)) == 40
+    assert store.get_job(job_id)["status"] == "running"
+
+
+def test_each_chunk_is_checkpointed(store, fake_documents):
+    job_id = store.create_job(_texts(6), chunk_size=4)
+    pool = JobWorkerPool(store, workers=0)
+
+    assert pool.run_once("w1")
+    job = store.get_job(job_id, include_chunks=True)
+    assert job["status"] == "running"
+    assert job["processed"] == 4
+    first, second = job["chunks_detail"]
+    assert first["status"] == "done" and first["document_ids"] == [1, 2, 3, 4]
+    assert second["status"] == "pending"
+
+    assert pool.run_once("w1")
+    assert not pool.run_once("w1")
+    job = store.get_job(job_id)
+    assert (job["status"], job["processed"], job["progress"]) == ("done", 6, 1.0)
+
+
+def test_killed_worker_job_resumes_from_checkpoint(store, fake_documents, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_CHUNK_LEASE_SECONDS", 0.0)
+    texts = _texts(12)
+    job_id = store.create_job(texts, chunk_size=3)
+    pool = JobWorkerPool(store, workers=0)
+
+    # El worker A hace el primer chunk y muere después de tomar el segundo
+    assert pool.run_once("A")
+    orphan = store.claim_chunk("A")
+    assert orphan["chunk_index"] == 1
+
+    # Con el lease vencido, B retoma desde el chunk 1 sin repetir el chunk 0
+    while pool.run_once("B"):
+        pass
+    assert fake_documents.embedded == texts
+    job = store.get_job(job_id, include_chunks=True)
+    assert (job["status"], job["processed"], job["failed"]) == ("done", 12, 0)
+    assert [chunk["attempts"] for chunk in job["chunks_detail"]] == [1, 2, 1, 1]
+
+    # Si A vuelve, su checkpoint se rechaza: el chunk ya es de otro worker
+    store.process_chunk(orphan, "A")
+    assert store.get_job(job_id)["processed"] == 12
+
+
+def test_failing_chunk_is_retried_then_marks_the_job_failed(store, fake_documents):
+    fake_documents.fail_on = "texto 4"
+    job_id = store.create_job(_texts(6), chunk_size=3)
+    pool = JobWorkerPool(store, workers=0)
+
+    while pool.run_once("w1"):
+        pass
+    job = store.get_job(job_id, include_chunks=True)
+    assert job["status"] == "failed"
+    assert (job["processed"], job["failed"]) == (3, 3)
+    assert job["chunks_detail"][1]["attempts"] == jobs.JOBS_MAX_ATTEMPTS
+    assert "backend caído" in job["error"]
+    assert pool.chunks_failed == jobs.JOBS_MAX_ATTEMPTS
@@ -0,0 +1,44 @@
+import pytest
+import model_migration
+from model_migration import skipped_ids, _embed_rows, MODEL_MIGRATION_MAX_ROW_FAILURES
+
+"""
+Backfill de model_migration.py con un backend destino falso: una fila que falla siempre se
+aísla del resto del lote y se saltea después de MODEL_MIGRATION_MAX_ROW_FAILURES pasadas.
+"""
+
+
+class FakeTarget:
+    def __init__(self, bad=(), down=False):
+        self.bad = set(bad)
+        self.down = down
+
+    def embed(self, texts):
+        if self.down or self.bad.intersection(texts):
+            raise RuntimeError("el modelo rechazó el texto")
+        return [[1.0, 0.0] for _ in texts]
+
+
+@pytest.fixture
+def migration():
+    return {"target_model": "destino", "target_column": "embedding_destino", "target_dimensions": 2}
+
+
+def _rows(*contents):
+    return [{"id": i + 1, "content": content} for i, content in enumerate(contents)]
+
+
+def test_failing_row_is_isolated_and_then_skipped(migration, monkeypatch):
+    monkeypatch.setattr(model_migration, "target_backend", lambda m: FakeTarget(bad={"malo"}))
+    for attempt in range(MODEL_MIGRATION_MAX_ROW_FAILURES):
+        assert skipped_ids(migration) == []
+        pairs = _embed_rows(migration, _rows("a", "malo", "c"))
+        assert [doc_id for doc_id, _ in pairs] == [1, 3]
+    assert skipped_ids(migration) == [2]
+
+
+def test_backend_outage_raises_instead_of_skipping(migration, monkeypatch):
+    monkeypatch.setattr(model_migration, "target_backend", lambda m: FakeTarget(down=True))
+    with pytest.raises(RuntimeError):
+        _embed_rows(migration, _rows("a", "b"))
+    assert skipped_ids(migration) == [] and migration.get("row_failures", {}) == {}
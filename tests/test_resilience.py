@@ -0,0 +1,195 @@
+import time
+import random
+import asyncio
+import pytest
+from fastapi import HTTPException
+import hf_client
+import resilience
+from embedding_backends import EmbeddingBackend
+from hf_client import HFInferenceBackend
+from resilience import ResilientBackend, CircuitBreaker, CircuitOpenError, UpstreamError, retry_delay
+
+"""
+ResilientBackend (resilience.py) contra el servidor falso de HF: reintentos con jitter,
+espera de carga del modelo, circuit breaker, backend secundario y hedging.
+"""
+
+
+class FixedBackend(EmbeddingBackend):
+    """Backend secundario de prueba: siempre el mismo vector."""
+    name = "fixed"
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed(self, texts):
+        self.calls += 1
+        return [[0.5] * 4 for _ in texts]
+
+    async def aembed(self, texts):
+        return self.embed(texts)
+
+
+@pytest.fixture
+def make_backend(fake_hf, fake_hf_url, monkeypatch):
+    """ResilientBackend sobre el servidor falso, instalado como backend de hf_client."""
+    monkeypatch.setattr(resilience, "HF_RETRY_BACKOFF_SECONDS", 0.01)
+
+    def make(secondary=None, failures=2, reset_seconds=0.2, hedge=False):
+        backend = ResilientBackend(HFInferenceBackend("hf_test", base_url=fake_hf_url, timeout=5), secondary,
+                                   breaker=CircuitBreaker(failures, reset_seconds), hedge=hedge)
+        monkeypatch.setattr(hf_client, "backend", backend)
+        return backend
+
+    return make
+
+
+def test_retry_delay_is_jittered_and_bounded():
+    random.seed(0)
+    error = UpstreamError(503, "unavailable", retryable=True)
+    for attempt in range(4):
+        ceiling = min(resilience.HF_RETRY_MAX_BACKOFF_SECONDS, resilience.HF_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+        delays = [retry_delay(error, attempt, 0.0, max_retries=10) for _ in range(50)]
+        assert all(0 <= delay <= ceiling for delay in delays)
+        assert len(set(delays)) > 1
+    assert retry_delay(error, 3, 0.0, max_retries=3) is None
+    assert retry_delay(UpstreamError(500, "bad input"), 0, 0.0, max_retries=3) is None
+
+
+def test_transient_errors_are_retried_then_raised(make_backend, fake_hf):
+    make_backend(failures=100)
+    fake_hf.control({"error_rate": 1.0, "error_status": 502})
+    with pytest.raises(HTTPException) as raised:
+        hf_client._request_with_retries(["hola"])
+    assert raised.value.status_code == 502
+    assert fake_hf.stats["requests"] == hf_client.HF_CHUNK_RETRIES + 1
+
+
+def test_waits_for_model_loading(make_backend, fake_hf):
+    backend = make_backend()
+    fake_hf.control({"loading_seconds": 0.3, "reset_loading": True})
+    start = time.monotonic()
+    vectors = hf_client._request_with_retries(["hola"])
+    assert len(vectors) == 1
+    assert time.monotonic() - start >= 0.2
+    assert fake_hf.stats["loading"] >= 1
+    # El modelo cargando no cuenta como falla del backend
+    assert backend.breaker.stats()["state"] == "closed"
+
+
+def test_breaker_opens_rejects_and_closes_after_probe(make_backend, fake_hf):
+    backend = make_backend(failures=2, reset_seconds=0.2)
+    fake_hf.control({"error_rate": 1.0, "error_status": 502})
+    for _ in range(2):
+        with pytest.raises(Exception):
+            backend.embed(["hola"])
+    assert backend.breaker.stats()["state"] == "open"
+
+    requests = fake_hf.stats["requests"]
+    with pytest.raises(CircuitOpenError):
+        backend.embed(["hola"])
+    assert fake_hf.stats["requests"] == requests
+
+    time.sleep(0.25)
+    fake_hf.control({"error_rate": 0.0})
+    assert len(backend.embed(["hola"])) == 1
+    assert backend.breaker.stats()["state"] == "closed"
+
+
+def test_failed_probe_reopens_the_circuit(make_backend, fake_hf):
+    backend = make_backend(failures=1, reset_seconds=0.1)
+    fake_hf.control({"error_rate": 1.0, "error_status": 502})
+    with pytest.raises(Exception):
+        backend.embed(["hola"])
+    time.sleep(0.15)
+    with pytest.raises(Exception):
+        backend.embed(["hola"])
+    assert backend.breaker.stats()["state"] == "open"
+
+
+def test_non_availability_error_does_not_close_half_open_circuit(make_backend, fake_hf):
+    backend = make_backend(failures=1, reset_seconds=0.1)
+    fake_hf.control({"error_rate": 1.0, "error_status": 502})
+    with pytest.raises(Exception):
+        backend.embed(["hola"])
+    time.sleep(0.15)
+    fake_hf.control({"error_status": 400})
+    with pytest.raises(Exception):
+        backend.embed(["hola"])
+    stats = backend.breaker.stats()
+    assert stats["state"] == "half_open"
+    assert stats["consecutive_failures"] == 1
+    # La prueba se liberó: la siguiente llamada puede volver a probar
+    fake_hf.control({"error_rate": 0.0})
+    assert len(backend.embed(["hola"])) == 1
+    assert backend.breaker.stats()["state"] == "closed"
+
+
+def test_cancelled_probe_releases_the_breaker(make_backend, fake_hf):
+    backend = make_backend(failures=1, reset_seconds=0.1)
+    fake_hf.control({"error_rate": 1.0, "error_status": 502})
+    with pytest.raises(Exception):
+        backend.embed(["hola"])
+    time.sleep(0.15)
+    fake_hf.control({"error_rate": 0.0, "latency_ms": 2000})
+
+    async def cancel_probe():
+        probe = asyncio.ensure_future(backend.aembed(["hola"]))
+        await asyncio.sleep(0.1)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(cancel_probe())
+    assert backend.breaker.acquire() is not None
+
+
+def test_falls_back_to_secondary_backend(make_backend, fake_hf):
+    secondary = FixedBackend()
+    backend = make_backend(secondary=secondary, failures=1, reset_seconds=60)
+    fake_hf.control({"error_rate": 1.0, "error_status": 502})
+    # La falla del primario pasa la llamada al secundario y abre el circuito
+    assert backend.embed(["hola"]) == [[0.5] * 4]
+    requests = fake_hf.stats["requests"]
+    # Con el circuito abierto ni se intenta el primario
+    assert backend.embed(["hola"]) == [[0.5] * 4]
+    assert fake_hf.stats["requests"] == requests
+    assert secondary.calls == 2
+    assert backend.stats()["fallback_calls"] == 2
+
+
+def test_hedged_call_wins_over_slow_primary(make_backend, fake_hf):
+    backend = make_backend(hedge=True)
+    for _ in range(resilience.HF_HEDGE_MIN_SAMPLES):
+        backend.latencies.record(0.2)
+    fake_hf.control({"slow_rate": 1.0, "slow_ms": 3000})
+
+    async def hedged():
+        call = asyncio.ensure_future(backend.aembed(["hola"]))
+        # Solo el primer request es lento; la copia lanzada al superar el p95 responde enseguida
+        while fake_hf.stats["slow"] == 0:
+            await asyncio.sleep(0.005)
+        fake_hf.control({"slow_rate": 0.0})
+        return await call
+
+    start = time.monotonic()
+    vectors = asyncio.run(hedged())
+    assert len(vectors) == 1
+    assert time.monotonic() - start < 2
+    assert backend.stats()["hedged_calls"] == 1
+    assert backend.stats()["hedge_wins"] == 1
+
+
+def test_only_the_probe_owner_releases_the_half_open_slot():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+    stale = breaker.acquire()
+    breaker.record_failure(stale)
+    time.sleep(0.1)
+    probe = breaker.acquire()
+    assert probe
+    # Una llamada admitida antes de abrir el circuito termina mientras la prueba sigue en curso
+    breaker.release(stale)
+    breaker.release(CircuitBreaker.NO_PROBE)
+    assert breaker.acquire() is None
+    breaker.release(probe)
+    assert breaker.acquire() is not None
@@ -0,0 +1,77 @@
+import base64
+import struct
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from response_formats import pack_embeddings, pack_search_results, embeddings_base64, resolve_format
+
+"""
+Formatos compactos de response_formats.py decodificados como lo haría un cliente, según el
+layout documentado: header de 16 bytes, dtype, byte order little-endian y shape.
+"""
+
+HEADER = struct.Struct("<4sBBHII")
+EMBEDDINGS = [[0.5, -1.25, 3.0], [1e-3, 0.0, -2.5]]
+
+
+def _unpack(payload):
+    magic, code, flags, reserved, rows, cols = HEADER.unpack_from(payload)
+    return magic, code, flags, reserved, rows, cols, payload[HEADER.size:]
+
+
+@pytest.mark.parametrize("dtype, code, np_dtype", [("float32", 1, "<f4"), ("float16", 2, "<f2")])
+def test_embeddings_binary_round_trip(dtype, code, np_dtype):
+    payload = pack_embeddings(EMBEDDINGS, dtype)
+    magic, got_code, flags, reserved, rows, cols, body = _unpack(payload)
+    assert (magic, got_code, flags, reserved, rows, cols) == (b"EMB1", code, 0, 0, 2, 3)
+    assert len(body) == rows * cols * np.dtype(np_dtype).itemsize
+    matrix = np.frombuffer(body, dtype=np_dtype).reshape(rows, cols)
+    np.testing.assert_allclose(matrix, EMBEDDINGS, rtol=1e-3)
+
+
+def test_embeddings_binary_with_ids():
+    payload = pack_embeddings(np.asarray(EMBEDDINGS), ids=[7, None])
+    magic, _, flags, _, rows, cols, body = _unpack(payload)
+    assert flags & 1
+    ids = np.frombuffer(body[:rows * 8], dtype="<i8")
+    matrix = np.frombuffer(body[rows * 8:], dtype="<f4").reshape(rows, cols)
+    assert ids.tolist() == [7, -1]
+    np.testing.assert_array_equal(matrix, np.asarray(EMBEDDINGS, dtype=np.float32))
+
+
+def test_byte_order_is_little_endian():
+    payload = pack_embeddings([[1.0]], ids=[1])
+    body = payload[HEADER.size:]
+    assert body[:8] == (1).to_bytes(8, "little")
+    assert body[8:] == struct.pack("<f", 1.0)
+    assert payload[12:16] == (1).to_bytes(4, "little")
+
+
+def test_search_results_round_trip_pads_missing_hits():
+    results = [[{"id": 3, "similarity": 0.9}, {"id": 1, "similarity": 0.5}], [{"id": 2, "similarity": 0.75}]]
+    payload = pack_search_results(results, limit=3, dtype="float16")
+    magic, code, flags, _, rows, cols, body = _unpack(payload)
+    assert (magic, code, flags, rows, cols) == (b"SIM1", 2, 1, 2, 3)
+    ids = np.frombuffer(body[:rows * cols * 8], dtype="<i8").reshape(rows, cols)
+    similarities = np.frombuffer(body[rows * cols * 8:], dtype="<f2").reshape(rows, cols)
+    assert ids.tolist() == [[3, 1, -1], [2, -1, -1]]
+    np.testing.assert_allclose(similarities[0, :2], [0.9, 0.5], rtol=1e-3)
+    assert np.isnan(similarities[0, 2]) and np.isnan(similarities[1, 1:]).all()
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_base64_round_trip(dtype):
+    encoded = embeddings_base64(EMBEDDINGS, dtype)
+    assert (encoded["dtype"], encoded["byteorder"], encoded["shape"]) == (dtype, "little", [2, 3])
+    matrix = np.frombuffer(base64.b64decode(encoded["data"]), dtype="<f4" if dtype == "float32" else "<f2")
+    np.testing.assert_allclose(matrix.reshape(encoded["shape"]), EMBEDDINGS, rtol=1e-3)
+
+
+def test_unknown_dtype_and_format_are_400():
+    with pytest.raises(HTTPException) as raised:
+        pack_embeddings(EMBEDDINGS, "float64")
+    assert raised.value.status_code == 400
+    with pytest.raises(HTTPException):
+        resolve_format("xml", None)
+    assert resolve_format(None, "application/octet-stream") == "binary"
+    assert resolve_format(None, "application/json") == "json"
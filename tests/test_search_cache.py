@@ -0,0 +1,68 @@
+import time
+import pytest
+import search_cache as search_cache_module
+import model_migration
+from search_cache import SearchResultCache, search_scope
+
+"""
+Caché de resultados de /search (search_cache.py): hit exacto, vencimiento por TTL,
+invalidación por generación y vaciado en el cutover de una migración de modelo.
+"""
+
+RESULTS = [{"id": 1, "content": "hola", "similarity": 0.9}]
+SCOPE = search_scope(5, "semantic", "max")
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(search_cache_module, "SEARCH_CACHE_ENABLED", True)
+
+
+def test_exact_hit_uses_normalized_text():
+    cache = SearchResultCache()
+    cache.put(SCOPE, "  hola   mundo ", [1.0, 0.0], RESULTS, cache.generation)
+    assert cache.get(SCOPE, "hola mundo") == RESULTS
+    assert cache.get(search_scope(10, "semantic", "max"), "hola mundo") is None
+    assert cache.stats()["exact_hits"] == 1
+
+
+def test_entries_expire_after_ttl():
+    cache = SearchResultCache(ttl_seconds=0.05)
+    cache.put(SCOPE, "hola", [1.0, 0.0], RESULTS, cache.generation)
+    assert cache.get(SCOPE, "hola") == RESULTS
+    time.sleep(0.06)
+    assert cache.get(SCOPE, "hola") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_invalidate_drops_entries_and_rejects_searches_started_before():
+    cache = SearchResultCache()
+    cache.put(SCOPE, "hola", [1.0, 0.0], RESULTS, cache.generation)
+    generation = cache.generation
+    cache.invalidate()
+    assert cache.get(SCOPE, "hola") is None
+    # Una búsqueda que empezó antes de la escritura no deja su resultado en la caché
+    cache.put(SCOPE, "chau", [0.0, 1.0], RESULTS, generation)
+    assert cache.get(SCOPE, "chau") is None
+    assert cache.stats()["generation"] == generation + 1
+
+
+def test_similar_query_reuses_results():
+    cache = SearchResultCache(max_distance=0.02)
+    cache.put(SCOPE, "hola", [1.0, 0.0], RESULTS, cache.generation)
+    assert cache.get_similar(SCOPE, [0.999, 0.01]) == RESULTS
+    assert cache.get_similar(SCOPE, [0.0, 1.0]) is None
+
+
+def test_cutover_seen_by_an_instance_invalidates_the_cache(monkeypatch):
+    cache = SearchResultCache()
+    monkeypatch.setattr(model_migration, "search_cache", cache)
+    migration = {"status": "backfilling", "target_column": "embedding_nuevo"}
+    state = model_migration.MigrationState()
+    state._store(migration)
+    cache.put(SCOPE, "hola", [1.0, 0.0], RESULTS, cache.generation)
+
+    state._store(migration)
+    assert cache.get(SCOPE, "hola") == RESULTS
+    state._store({**migration, "status": "cutover"})
+    assert cache.get(SCOPE, "hola") is None
@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Any, Tuple
+import numpy as np
+from constants import MODEL_NAME, MODEL_DIMENSIONS
+from database import connection
+
+"""
+Snapshots de los embeddings de `documents` en archivos .npy (python manage.py export-snapshot).
+
+Un snapshot con prefijo P son tres archivos:
+- P.npy: matriz (N, MODEL_DIMENSIONS) float32 o float16, en el orden de los ids.
+- P.ids.npy: ids (int64) de cada fila de la matriz.
+- P.json: manifiesto (modelo, dimensiones, dtype, cantidad, id máximo, fecha).
+
+Los .npy se leen con np.load(..., mmap_mode="r") sin cargarlos en memoria, así el índice ANN
+(ANN_INDEX_SNAPSHOT, ann_index.py) o un análisis offline arrancan sin recorrer la tabla.
+La exportación lee todo en una transacción REPEATABLE READ (cantidad y filas consistentes)
+con un cursor del lado del servidor, escribiendo cada lote directo en la matriz mapeada, y
+publica los archivos con os.replace al terminar.
+"""
+
+app_logger = logging.getLogger(__name__)
+
+SNAPSHOT_DTYPES = {"float32": np.float32, "float16": np.float16}
+
+_COUNT_SQL = "SELECT COUNT(*) AS total, COALESCE(MAX(id), 0) AS max_id FROM documents WHERE embedding IS NOT NULL;"
+_SCAN_SQL = "SELECT id, embedding::text AS embedding FROM documents WHERE embedding IS NOT NULL ORDER BY id;"
+
+
+def snapshot_paths(prefix: str) -> Dict[str, str]:
+    return {"vectors": prefix + ".npy", "ids": prefix + ".ids.npy", "manifest": prefix + ".json"}
+
+
+def export_snapshot(prefix: str, dtype: str = "float32", batch_size: int = 5000) -> Dict[str, Any]:
+    """ ==========================================================================================
+    Exporta los embeddings de documents a un snapshot .npy.
+    Args:
+        prefix: Ruta sin extensión de los archivos a generar.
+        dtype: "float32" o "float16" (la mitad de espacio; suficiente para el índice ANN).
+        batch_size: Filas por FETCH del cursor.
+    Returns:
+        El manifiesto escrito en P.json.
+    =========================================================================================== """
+    if dtype not in SNAPSHOT_DTYPES:
+        raise ValueError(f"dtype debe ser uno de {', '.join(SNAPSHOT_DTYPES)}")
+    paths = snapshot_paths(prefix)
+    tmp = {name: path + ".tmp" for name, path in paths.items()}
+    start = time.monotonic()
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+            cur.execute(_COUNT_SQL)
+            counts = cur.fetchone()
+        total = counts["total"]
+        # Las filas se escriben directo en el archivo: la memoria no crece con la tabla
+        vectors = np.lib.format.open_memmap(tmp["vectors"], mode="w+", dtype=SNAPSHOT_DTYPES[dtype],
+                                            shape=(total, MODEL_DIMENSIONS))
+        ids = np.lib.format.open_memmap(tmp["ids"], mode="w+", dtype=np.int64, shape=(total,))
+        row = 0
+        with conn.cursor(name="vector_snapshot") as cur:
+            cur.itersize = batch_size
+            cur.execute(_SCAN_SQL)
+            for record in cur:
+                ids[row] = record["id"]
+                vectors[row] = np.fromstring(record["embedding"][1:-1], dtype=np.float32, sep=",")
+                row += 1
+                if row % (batch_size * 20) == 0:
+                    app_logger.info(f"Snapshot: {row}/{total} filas")
+        conn.rollback()
+
+    vectors.flush()
+    ids.flush()
+    del vectors, ids
+    manifest = {
+        "model": MODEL_NAME,
+        "dimensions": MODEL_DIMENSIONS,
+        "dtype": dtype,
+        "count": row,
+        "max_id": counts["max_id"],
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "seconds": round(time.monotonic() - start, 3),
+    }
+    with open(tmp["manifest"], "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    for name, path in paths.items():
+        os.replace(tmp[name], path)
+    app_logger.info(f"Snapshot {paths['vectors']}: {row} vectores en {manifest['seconds']}s")
+    return manifest
+
+
+def read_snapshot(prefix: str) -> Tuple[np.ndarray, np.ndarray, Dict[str, Any]]:
+    """
+    (ids, vectores, manifiesto) de un snapshot, con los .npy mapeados en memoria (solo lectura).
+    Falla si el snapshot es de otro modelo o de otras dimensiones.
+    """
+    paths = snapshot_paths(prefix)
+    with open(paths["manifest"], encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest["model"] != MODEL_NAME or manifest["dimensions"] != MODEL_DIMENSIONS:
+        raise ValueError(f"El snapshot es de {manifest['model']} ({manifest['dimensions']} dims), "
+                         f"no de {MODEL_NAME} ({MODEL_DIMENSIONS} dims)")
+    ids = np.load(paths["ids"], mmap_mode="r")
+    vectors = np.load(paths["vectors"], mmap_mode="r")
+    if len(ids) != len(vectors):
+        raise ValueError(f"Snapshot inconsistente: {len(ids)} ids y {len(vectors)} vectores")
+    return ids, vectors, manifest
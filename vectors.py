@@ -0,0 +1,45 @@
+import io
+from typing import List, Sequence
+import numpy as np
+from metrics import timed
+
+"""
+Serialización de embeddings al formato de texto de pgvector ('[0.1,0.2,...]').
+
+En lugar de armar cada vector con ",".join(str(x) ...) en Python, el lote completo se
+convierte a una matriz float32 de NumPy y se formatea fila por fila con un único
+formato precompilado (np.savetxt). float32 es la precisión que almacena pgvector y
+'%.9g' alcanza para reconstruir exactamente cada valor.
+"""
+
+_FLOAT_FORMAT = "%.9g"
+
+
+def as_matrix(embeddings) -> np.ndarray:
+    """
+    Convierte una lista de embeddings (o un ndarray) en una matriz float32 2D contigua.
+    """
+    matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    return matrix
+
+
+def to_pgvector_literals(embeddings) -> List[str]:
+    """
+    Convierte un lote de embeddings en literales de pgvector, uno por fila.
+    """
+    with timed("serialize"):
+        matrix = as_matrix(embeddings)
+        if matrix.shape[0] == 0:
+            return []
+        buffer = io.StringIO()
+        np.savetxt(buffer, matrix, fmt=_FLOAT_FORMAT, delimiter=",")
+        return ["[" + line + "]" for line in buffer.getvalue().splitlines()]
+
+
+def to_pgvector_literal(embedding: Sequence[float]) -> str:
+    """
+    Convierte un único embedding en su literal de pgvector.
+    """
+    return to_pgvector_literals([embedding])[0]